@@ -1,11 +1,83 @@
-import os
-from flask import Flask, render_template, request
+import gzip, hmac, json, os, re, time
+from contextlib import nullcontext
+from flask import Flask, Response, abort, jsonify, render_template, request, send_file, url_for
+from werkzeug.utils import safe_join
+from werkzeug.wsgi import wrap_file
+from validation.bitmaps import BitmapStore
+from validation.checkpoint import CheckpointStore
+from validation.compression import gzip_content_size
+from validation.error_store import ErrorStore
+from validation.history import HistoryStore
+from validation.parse_cache import ParseCache
+from validation.memory import AccountingBusyError, MemoryAccounting
+from validation.profiler import SamplingProfiler
+from validation.runner import CancelFlags, Limits, ProgressBoard, RunOptions
+from validation.storage import JobTokens, UploadStore, new_job_id
+from settings.store import config_store
 
 app = Flask(__name__)
 
 # File save location
 userfile_path = os.path.join(app.instance_path, 'userfiles')
 
+# Uploads are stored by content hash and reports by job, old files are
+# evicted in the background so static/userfiles does not grow forever
+upload_store = UploadStore()
+upload_store.start_sweeper()
+
+# Errors of every run are indexed for the paginated error browser
+error_store = ErrorStore()
+upload_store.add_sweep_hook(error_store.prune)
+
+# Failing rows of every run per check and column, as row bitmaps
+bitmap_store = BitmapStore()
+upload_store.add_sweep_hook(bitmap_store.prune)
+
+# Per dataset data quality history, kept across uploads
+history_store = HistoryStore()
+
+# Parsed tables of earlier runs, so a report can be re-run without re-uploading
+parse_cache = ParseCache()
+upload_store.add_sweep_hook(parse_cache.prune)
+
+# On-disk indexes of the reference datasets of the referential integrity check
+from validation.custom_checks import reference_indexes
+upload_store.add_sweep_hook(reference_indexes.prune)
+
+# Running jobs can be cancelled from any worker, the run stops at its next poll
+cancel_flags = CancelFlags()
+upload_store.add_sweep_hook(cancel_flags.prune)
+
+# Job ids are made by the server, with a token the page needs to cancel or
+# resume its run
+job_tokens = JobTokens()
+upload_store.add_sweep_hook(job_tokens.prune)
+
+# Runs publish a progress sample every few seconds, streamed to the page
+# from GET /jobs/<job_id>/progress
+progress_board = ProgressBoard()
+upload_store.add_sweep_hook(progress_board.prune)
+
+# Long runs checkpoint their progress, a run whose worker died is resumed
+# with POST /jobs/<job_id>/resume
+checkpoint_store = CheckpointStore()
+upload_store.add_sweep_hook(checkpoint_store.prune)
+
+# Admins can profile a run with ?profile=<token> or an X-Profile-Token header,
+# and account memory per check with ?memory=<token> or an X-Memory-Token
+# header. Both are off unless PROFILE_TOKEN is set
+profile_token = os.environ.get('PROFILE_TOKEN')
+
+# A progress stream is checked twice a second and ends after an hour, the
+# page reconnects if the run is still going. Streams hold a thread each, the
+# Procfile runs gunicorn with threaded workers
+PROGRESS_POLL_SECONDS = 0.5
+PROGRESS_STREAM_SECONDS = 3600
+PROGRESS_RETRY_SECONDS = 1
+
+# Reports are stored gzipped unless REPORT_COMPRESSION is set to an empty value
+report_compression = os.environ.get('REPORT_COMPRESSION', 'gzip') or None
+
 
 @app.route('/')
 def home():
@@ -17,15 +89,373 @@ def run_validator():
       if request.files['filename'].filename != '':
          new_file = request.files['filename']
          outputselection = request.values['outputSelection']
-         filename = str(new_file.filename)
          outputselection = str(outputselection)
-         new_file.save(os.path.join('static/userfiles/', new_file.filename))
+         job_id = client_job_id() or new_job_id()
+         upload = upload_store.save_upload(new_file)
+         # Pin one config version for the whole run, a client may ask for a specific one
+         if request.values.get('config_version'):
+            try:
+               config = config_store.snapshot(request.values['config_version'])
+            except (OSError, ValueError):
+               abort(409)
+         else:
+            config = config_store.current()
+         report_path = upload_store.report_path(job_id, upload.filename, outputselection)
          from validation import validator
-         report_name = validator.custom_validate(filename,outputselection)
-         return render_template('htmlPage.html', display = True, report = report_name)
+         profiler = SamplingProfiler() if admin_requested('profile', 'X-Profile-Token') else None
+         accounting = MemoryAccounting() if admin_requested('memory', 'X-Memory-Token') else None
+         # The corrected copy and its change log go next to the report
+         fix_paths = (report_path + '-fixed.csv', report_path + '-fixes.jsonl') \
+            if request.values.get('autoFix') == 'on' and outputselection != 'header' else None
+         upload_store.pin(upload.path)
+         try:
+            with profiler or nullcontext(), accounting or nullcontext():
+               report_file = validator.custom_validate(upload.path, outputselection, run_options(
+                  job_id, report_path = report_path, filename = upload.filename,
+                  dataset = request.values.get('dataset'), config = config, digest = upload.digest,
+                  memory_accounting = accounting, raw_text = raw_text_requested(), fix_paths = fix_paths))
+         except AccountingBusyError:
+            # tracemalloc serves one accounted run per worker
+            abort(409)
+         finally:
+            upload_store.unpin(upload.path)
+            cancel_flags.clear(job_id)
+            progress_board.finish(job_id)
+         upload_store.record_write(report_file)
+         report_name = url_for('serve_report', name = os.path.basename(report_path))
+         profile_name = None
+         if profiler is not None:
+            # Flame graph input and time per check, next to the report
+            for profile_file in profiler.write(report_path + '-profile'):
+               upload_store.record_write(profile_file)
+            profile_name = url_for('serve_report', name = os.path.basename(report_path) + '-profile.folded')
+         memory_name = None
+         if accounting is not None:
+            upload_store.record_write(accounting.write(report_path + '-memory.json'))
+            memory_name = url_for('serve_report', name = os.path.basename(report_path) + '-memory.json')
+         fixed_name = fixes_name = None
+         # A run stopped early writes no corrected copy
+         if fix_paths is not None and os.path.isfile(fix_paths[0]):
+            for fix_file in fix_paths:
+               upload_store.record_write(fix_file)
+            fixed_name = url_for('serve_report', name = os.path.basename(fix_paths[0]))
+            fixes_name = url_for('serve_report', name = os.path.basename(fix_paths[1]))
+         return render_template('htmlPage.html', display = True, report = report_name,
+                                report_id = job_id, output_selection = outputselection,
+                                digest = upload.digest, filename = upload.filename,
+                                profile = profile_name, memory = memory_name,
+                                fixed = fixed_name, fixes = fixes_name,
+                                raw_text = raw_text_requested())
    
    return render_template('htmlPage.html')
    
+def raw_text_requested():
+   # Checks get the cell text as written in the file, see RawTextDetector
+   return request.values.get('rawText') == 'on'
+
+def job_limits(job_id):
+   # Runs of the page can be cancelled and report their progress
+   return Limits(cancelled = cancel_flags.checker(job_id), progress = progress_board.reporter(job_id))
+
+def run_options(job_id, **options):
+   # Runs of the page are recorded in every store of the app
+   options.setdefault('report_compression', report_compression)
+   return RunOptions(job_id = job_id, limits = job_limits(job_id), error_store = error_store,
+                     history_store = history_store, parse_cache = parse_cache,
+                     checkpoints = checkpoint_store, bitmap_store = bitmap_store, **options)
+
+def client_job_id():
+   # The page gets a job id from POST /jobs before uploading, so it can follow
+   # and cancel the run, an id only starts one run
+   job_id = request.values.get('job_id', '')
+   if not job_id:
+      return None
+   if not re.fullmatch(r'[0-9a-f]{32}', job_id) or not job_tokens.start(job_id, request.values.get('job_token', '')):
+      abort(409)
+   return job_id
+
+def job_token_valid(job_id):
+   token = request.values.get('token') or request.headers.get('X-Job-Token', '')
+   return re.fullmatch(r'[0-9a-f]{32}', job_id) is not None and job_tokens.check(job_id, token)
+
+def admin_requested(param, header):
+   token = request.args.get(param) or request.headers.get(header)
+   return bool(profile_token) and token is not None and hmac.compare_digest(token, profile_token)
+
+@app.route('/rerun', methods=['POST'])
+def rerun_validator():
+   # Revalidates an earlier upload with the current check selection, from the
+   # parse cache when it has the table, otherwise from the stored upload
+   digest = request.values.get('digest', '')
+   filename = request.values.get('filename') or digest
+   outputselection = str(request.values.get('outputSelection', ''))
+   path = upload_store.find_upload(digest)
+   cached = re.fullmatch(r'[0-9a-f]{64}', digest) is not None and parse_cache.has(digest)
+   # Schema and header reports read the file itself
+   if path is None and (not cached or outputselection in ('schema', 'header')):
+      abort(410)
+   job_id = client_job_id() or new_job_id()
+   config = config_store.current()
+   report_path = upload_store.report_path(job_id, filename, outputselection)
+   from validation import validator
+   if path is not None:
+      upload_store.pin(path)
+   try:
+      report_file = validator.custom_validate(path or parse_cache.path(digest), outputselection, run_options(
+         job_id, report_path = report_path, filename = filename, dataset = request.values.get('dataset'),
+         config = config, digest = digest, raw_text = raw_text_requested()))
+   finally:
+      if path is not None:
+         upload_store.unpin(path)
+      cancel_flags.clear(job_id)
+      progress_board.finish(job_id)
+   upload_store.record_write(report_file)
+   report_name = url_for('serve_report', name = os.path.basename(report_path))
+   return render_template('htmlPage.html', display = True, report = report_name,
+                          report_id = job_id, output_selection = outputselection,
+                          digest = digest, filename = filename,
+                          raw_text = raw_text_requested())
+
+@app.route('/jobs', methods=['POST'])
+def create_job():
+   # Id and token of the next run of the page
+   job_id, token = job_tokens.issue()
+   return jsonify({'job_id': job_id, 'token': token}), 201
+
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+   # The run stops at its next poll and still writes a partial report
+   if not job_token_valid(job_id):
+      abort(403)
+   cancel_flags.cancel(job_id)
+   return jsonify({'job_id': job_id, 'cancelled': True}), 202
+
+@app.route('/jobs/<job_id>/progress')
+def job_progress(job_id):
+   # Server-sent events with the latest progress sample of the run, sent
+   # when it changes, the last one has done set
+   if not re.fullmatch(r'[0-9a-f]{32}', job_id):
+      abort(404)
+   def events():
+      # Browsers reconnect retry ms after a stream ends, one is only held
+      # open once the run has published its first sample
+      yield f'retry: {int(PROGRESS_RETRY_SECONDS * 1000)}\n\n'
+      sent = None
+      waited = 0.0
+      while waited < PROGRESS_STREAM_SECONDS:
+         latest = progress_board.latest(job_id)
+         if latest is None:
+            return
+         if latest[0] != sent:
+            sent = latest[0]
+            yield 'data: ' + json.dumps(latest[1], separators = (',', ':')) + '\n\n'
+            if latest[1].get('done'):
+               return
+         elif not int(waited / PROGRESS_POLL_SECONDS) % 30:
+            # Keeps proxies from closing a quiet stream
+            yield ': waiting\n\n'
+         time.sleep(PROGRESS_POLL_SECONDS)
+         waited += PROGRESS_POLL_SECONDS
+   return Response(events(), mimetype = 'text/event-stream',
+                   headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/jobs/<job_id>/resume', methods=['POST'])
+def resume_job(job_id):
+   # Finishes a run from its last checkpoint, with the arguments of the run
+   if not job_token_valid(job_id):
+      abort(403)
+   run = checkpoint_store.run(job_id)
+   if run is None or not run['arguments']:
+      abort(404)
+   arguments = run['arguments']
+   if not os.path.isfile(arguments['filepath']):
+      abort(410)
+   try:
+      config = config_store.snapshot(arguments['config_version'])
+   except (OSError, ValueError):
+      abort(409)
+   from validation import validator
+   upload_store.pin(arguments['filepath'])
+   try:
+      report_file = validator.custom_validate(arguments['filepath'], arguments['output_selection'], run_options(
+         job_id, report_path = arguments['report_path'], report_compression = arguments['report_compression'],
+         filename = arguments['filename'], dataset = arguments['dataset'], config = config,
+         digest = arguments['digest'], raw_text = arguments['raw_text']))
+   finally:
+      upload_store.unpin(arguments['filepath'])
+      cancel_flags.clear(job_id)
+      progress_board.finish(job_id)
+   upload_store.record_write(report_file)
+   return jsonify({'job_id': job_id,
+                   'report': url_for('serve_report', name = os.path.basename(arguments['report_path']))})
+
+@app.route('/preflight', methods=['POST'])
+def run_preflight():
+   # Header only structural checks for publish pipelines, answered from the
+   # first bytes of the upload without storing the whole file
+   new_file = request.files.get('filename')
+   if new_file is None or new_file.filename == '':
+      abort(400)
+   if request.values.get('config_version'):
+      try:
+         config = config_store.snapshot(request.values['config_version'])
+      except (OSError, ValueError):
+         abort(409)
+   else:
+      config = config_store.current()
+   from validation import validator
+   head_path = upload_store.save_head(new_file)
+   try:
+      report = validator.preflight(head_path, config)
+   finally:
+      os.remove(head_path)
+   resource = report.tasks[0].resource if report.tasks else None
+   dialect = None
+   if resource is not None:
+      # The resource only keeps what differs from the defaults, e.g. nothing
+      # for a plain comma separated file
+      dialect = resource.dialect.to_copy()
+      dialect.expand()
+      dialect = dialect.to_dict()
+   return jsonify({
+      'valid': report.valid,
+      'time': report.time,
+      'labels': resource.labels if resource is not None else [],
+      'encoding': resource.get('encoding') if resource is not None else None,
+      'dialect': dialect,
+      'errors': report.flatten(['code', 'fieldName', 'note', 'message']),
+   })
+
+@app.route('/gate', methods=['POST'])
+def run_gate():
+   # Pass or fail for publish pipelines, stopping at the first max_errors
+   # errors of the selected codes or tags (codes=type-error,#header)
+   new_file = request.files.get('filename')
+   if new_file is None or new_file.filename == '':
+      abort(400)
+   if request.values.get('config_version'):
+      try:
+         config = config_store.snapshot(request.values['config_version'])
+      except (OSError, ValueError):
+         abort(409)
+   else:
+      config = config_store.current()
+   max_errors = request.values.get('max_errors', type = int)
+   codes = [code.strip() for value in request.values.getlist('codes') for code in value.split(',') if code.strip()]
+   from validation import validator
+   upload = upload_store.save_upload(new_file)
+   upload_store.pin(upload.path)
+   try:
+      result = validator.gate(upload.path, config, max_errors or validator.DEFAULT_GATE_ERRORS, codes,
+                              raw_text_requested())
+   finally:
+      upload_store.unpin(upload.path)
+   return jsonify({
+      'valid': result['valid'],
+      'time': result['time'],
+      'row': result['row'],
+      'errors': [[error.get(prop) for prop in ('code', 'rowPosition', 'fieldName', 'note', 'message')]
+                 for error in result['errors']],
+   })
+
+@app.route('/reports/<name>')
+def serve_report(name):
+   path = safe_join(upload_store.reports_dir, name)
+   if path is None:
+      abort(404)
+
+   # Reports never change once written, so the hash of the stored file is a
+   # strong ETag. send_file and make_conditional answer If-None-Match with
+   # 304 and Range requests with 206
+   if os.path.isfile(path):
+      mimetype = {'.folded': 'text/plain', '.csv': 'text/csv', '.jsonl': 'application/x-ndjson'}.get(
+         os.path.splitext(path)[1], 'application/json')
+      return send_file(path, mimetype=mimetype, etag=upload_store.digest(path))
+
+   # Gzipped reports are sent compressed to clients that accept it and
+   # decompressed on the fly for the rest, each encoding with its own ETag
+   stored = path + '.gz'
+   if not os.path.isfile(stored):
+      abort(404)
+   upload_store.touch(stored)
+   digest = upload_store.digest(stored)
+   if request.accept_encodings['gzip'] > 0:
+      response = send_file(stored, mimetype='application/json', etag=digest + '-gzip')
+      response.headers['Content-Encoding'] = 'gzip'
+   else:
+      infile = gzip.open(stored, 'rb')
+      response = Response(wrap_file(request.environ, infile, 64 * 1024),
+                          mimetype='application/json', direct_passthrough=True)
+      response.set_etag(digest)
+      response = response.make_conditional(request, accept_ranges=True,
+                                           complete_length=gzip_content_size(stored))
+   response.headers['Vary'] = 'Accept-Encoding'
+   return response
+
+@app.route('/reports/<report_id>/errors')
+def report_errors(report_id):
+   if not error_store.has_report(report_id):
+      abort(404)
+   page = error_store.errors(
+      report_id,
+      code = request.args.get('code') or None,
+      field = request.args.get('field') or None,
+      offset = request.args.get('offset', 0, type=int),
+      limit = request.args.get('limit', 100, type=int),
+   )
+   return jsonify(page)
+
+@app.route('/reports/<report_id>/counts/<by>')
+def report_error_counts(report_id, by):
+   if by not in ('code', 'field') or not error_store.has_report(report_id):
+      abort(404)
+   return jsonify(error_store.counts(report_id, by))
+
+@app.route('/reports/<report_id>/rows')
+def report_failing_rows(report_id):
+   # Row positions failing the checks, a page at a time: every check=code or
+   # check=code:field with match=all (the default), any of them with
+   # match=any, any check at all without one
+   index = bitmap_store.index(report_id) if re.fullmatch(r'[0-9a-f]{32}', report_id) else None
+   if index is None:
+      abort(404)
+   selectors = [tuple(check.split(':', 1)) if ':' in check else check
+                for check in request.args.getlist('check') if check]
+   match = request.args.get('match', 'all')
+   if match not in ('all', 'any'):
+      abort(400)
+   if not selectors:
+      rows = index.any()
+   elif match == 'all':
+      rows = index.intersection(*selectors)
+   else:
+      rows = index.union(*selectors)
+   offset = max(request.args.get('offset', 0, type=int), 0)
+   limit = min(max(request.args.get('limit', 1000, type=int), 0), 100000)
+   # truncated: the run stopped early or kept only its first errors, more rows may fail
+   return jsonify({'total': int(len(rows)), 'offset': offset, 'limit': limit, 'truncated': index.truncated,
+                   'rows': rows[offset:offset + limit].tolist()})
+
+@app.route('/reports/<report_id>/bitmaps')
+def report_bitmaps(report_id):
+   # The index itself, read with validation.bitmaps.BitmapIndex.load
+   path = bitmap_store.path(report_id)
+   if not re.fullmatch(r'[0-9a-f]{32}', report_id) or not os.path.isfile(path):
+      abort(404)
+   return send_file(path, mimetype='application/octet-stream', download_name=report_id + '.bitmaps')
+
+@app.route('/history/<dataset>')
+def dataset_history(dataset):
+   trend = history_store.trend(
+      dataset,
+      limit = request.args.get('limit', 50, type=int),
+      code = request.args.get('code') or None,
+      field = request.args.get('field') or None,
+   )
+   if trend is None:
+      abort(404)
+   return jsonify(trend)
+
 @app.route('/field_config', methods=['GET','POST'])
 def check_config():
    if request.method == 'POST':
@@ -37,17 +467,13 @@ def check_config():
                new_check_cfg[key.split('[')[0]].append(value)
             else:
                new_check_cfg[key.split('[')[0]] = [value]
-      with open('./settings/fields.cfg','w') as outfile:
-         for key,value in new_check_cfg.items():
-            line = str(key) + ' = ' + ','.join(value) + '\n'
-            outfile.write(line.upper())
-      
-   field_cfg = {}
-   field_cfg_file = open('./settings/fields.cfg')
-   for line in field_cfg_file:
-      if not line.startswith('#'): 
-         key, value = line.split('=')
-         field_cfg[key.strip()] = [item.strip() for item in value.split(',')]
+      new_field_cfg = ''
+      for key,value in new_check_cfg.items():
+         line = str(key) + ' = ' + ','.join(value) + '\n'
+         new_field_cfg += line.upper()
+      config_store.write('fields.cfg', new_field_cfg)
+
+   field_cfg = config_store.current().fields
 
    return render_template('fieldconfig.html', config_dict = field_cfg)
 
@@ -56,25 +482,27 @@ def check_select():
    if request.method == 'POST':
       data = request.form.to_dict()
       new_check_selection = ''
-      with open('./settings/checks.cfg','r') as outfile:
-         for line in outfile:
-            custom_check = line.split('=')[0].strip()
-            if custom_check in data:
-               new_check_selection += custom_check + ' = 1\n'
-            else:
-               new_check_selection += custom_check + ' = 0\n'
+      for custom_check in config_store.current().checks:
+         if custom_check in data:
+            new_check_selection += custom_check + ' = 1\n'
+         else:
+            new_check_selection += custom_check + ' = 0\n'
 
-      with open('./settings/checks.cfg','w') as outfile:
-         outfile.write(new_check_selection)
+      config_store.write('checks.cfg', new_check_selection)
       
-   check_selection = {}
-   check_file = open('./settings/checks.cfg')
-   for line in check_file:
-      if not line.startswith('#'): 
-         key, value = line.split('=')
-         check_selection[key.strip()] = int(value.strip())
+   check_selection = config_store.current().checks
 
    return render_template('checkconfig.html', check_select = check_selection)
+
+@app.route('/config/version')
+def config_version():
+   # Long polls with ?since=<version> until the config changes
+   since = request.args.get('since', type=int)
+   if since is None:
+      snapshot = config_store.current()
+   else:
+      snapshot = config_store.wait_for_change(since, timeout = min(request.args.get('timeout', 30, type=float), 60))
+   return jsonify({'version': snapshot.version, 'created': snapshot.created})
    
 if __name__ == "__main__":
    app.run(host='localhost', port=5000)
\ No newline at end of file
@@ -0,0 +1,299 @@
+"""
+Load test for the validator web app.
+
+Sends a mix of upload sizes, report types and check selections at a fixed
+arrival rate and reports latency percentiles, throughput, error rate and the
+memory of the server processes.
+
+Against the app in this process (Flask test client):
+    python loadtest.py --rate 2 --duration 60
+
+Against a local gunicorn, e.g. started with `gunicorn -w 4 app:app`:
+    python loadtest.py --url http://127.0.0.1:8000 --server-pid <master pid>
+
+Arrivals are open loop: a request is sent on schedule even while earlier
+ones are still running, and its latency is measured from its scheduled
+time, so a saturated server shows up as growing latency instead of a
+quietly lower arrival rate.
+"""
+import argparse
+import io
+import itertools
+import json
+import os
+import random
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_SIZES = (100, 10000, 100000)
+DEFAULT_REPORT_TYPES = ('', 'error', 'schema', 'header')
+DEFAULT_CHECK_SETS = (
+    'header_format',
+    'header_format,zip_code_format,phone_number_format_error,lead_trail_spaces',
+    'valid_namefield_value_in_cell,valid_address_value_in_cell,valid_text_field_in_cell,valid_summerized_data',
+)
+
+HEADER = ['NAME', 'ADDRESS', 'ZIP', 'PHONE', 'AMOUNT', 'WEBSITE', 'NOTES']
+
+# How often the server memory is sampled, in seconds
+RSS_INTERVAL = 0.5
+
+
+def make_csv(rows, seed=0):
+    """CSV bytes with a realistic share of bad cells for every check."""
+    generator = random.Random(seed)
+    lines = [','.join(HEADER)]
+    for number in range(rows):
+        lines.append(','.join([
+            generator.choice(['John Smith', 'mary ann', 'Zoe Lee']),
+            generator.choice(['1 Main St', '"12 Oak Ave, Portland"', ' 5 Elm St ']),
+            generator.choice(['97201', '97201-1234', '9720']),
+            generator.choice(['503-555-0100', '5035550100', '(503) 555 0100']),
+            generator.choice(['12.50', '$1,200', '(4.00)', 'TOTAL']),
+            generator.choice(['https://example.org', 'example', '']),
+            generator.choice(['ok', '<b>bold</b>', '', 'sum of rows']),
+        ]))
+    return ('\n'.join(lines) + '\n').encode()
+
+
+# Clients
+
+
+class TestClient:
+    """Runs requests against app.py in this process."""
+
+    def __init__(self):
+        from app import app
+        self.app = app
+        self.local = threading.local()
+
+    def __client(self):
+        if not hasattr(self.local, 'client'):
+            self.local.client = self.app.test_client()
+        return self.local.client
+
+    def get(self, path):
+        response = self.__client().get(path)
+        return response.status_code, response.get_data(as_text=True)
+
+    def post(self, path, data, files=None):
+        data = dict(data)
+        for name, (filename, content) in (files or {}).items():
+            data[name] = (io.BytesIO(content), filename)
+        response = self.__client().post(path, data=data, content_type='multipart/form-data')
+        return response.status_code, response.get_data(as_text=True)
+
+
+class HttpClient:
+    """Runs requests against a server over HTTP."""
+
+    def __init__(self, url):
+        import requests
+        self.url = url.rstrip('/')
+        self.local = threading.local()
+        self.requests = requests
+
+    def __session(self):
+        if not hasattr(self.local, 'session'):
+            self.local.session = self.requests.Session()
+        return self.local.session
+
+    def get(self, path):
+        response = self.__session().get(self.url + path)
+        return response.status_code, response.text
+
+    def post(self, path, data, files=None):
+        response = self.__session().post(self.url + path, data=data, files=files)
+        return response.status_code, response.text
+
+
+# Server memory
+
+
+class RssSampler:
+    """Samples the resident memory of the server processes from /proc."""
+
+    def __init__(self, pid=None, interval=RSS_INTERVAL):
+        self.pid = pid or os.getpid()
+        self.interval = interval
+        self.peak = {}
+        self.last = {}
+        self.__stop = threading.Event()
+        self.__thread = None
+
+    def start(self):
+        self.__thread = threading.Thread(target=self.__run, name='rss-sampler', daemon=True)
+        self.__thread.start()
+
+    def stop(self):
+        self.__stop.set()
+        if self.__thread:
+            self.__thread.join()
+        self.sample()
+
+    def sample(self):
+        for pid in [self.pid] + _children(self.pid):
+            rss = _rss_bytes(pid)
+            if rss is None:
+                continue
+            self.last[pid] = rss
+            self.peak[pid] = max(self.peak.get(pid, 0), rss)
+
+    def __run(self):
+        while not self.__stop.wait(self.interval):
+            self.sample()
+
+
+def _children(pid):
+    children = []
+    try:
+        for task in os.listdir(f'/proc/{pid}/task'):
+            with open(f'/proc/{pid}/task/{task}/children') as infile:
+                children.extend(int(child) for child in infile.read().split())
+    except OSError:
+        pass
+    return children
+
+
+def _rss_bytes(pid):
+    try:
+        with open(f'/proc/{pid}/status') as infile:
+            for line in infile:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+    return None
+
+
+# Load
+
+
+def config_versions(client, check_sets):
+    """Create one config version per check selection, then restore the current one."""
+    page = client.get('/check_select')[1]
+    current = set(re.findall(r'name="([a-z_]+)"[^>]*checked', page))
+    versions = {}
+    for check_set in check_sets:
+        client.post('/check_select', {name: 'on' for name in check_set.split(',') if name})
+        versions[check_set] = json.loads(client.get('/config/version')[1])['version']
+    client.post('/check_select', {name: 'on' for name in current})
+    return versions
+
+
+def run(client, rate, duration, sizes, report_types, check_sets, concurrency, seed=0):
+    files = {size: make_csv(size, seed) for size in sizes}
+    versions = config_versions(client, check_sets)
+    generator = random.Random(seed)
+    mix = list(itertools.product(sizes, report_types, check_sets))
+    results = []
+    lock = threading.Lock()
+
+    def send(scheduled, size, report_type, check_set):
+        data = {'outputSelection': report_type, 'config_version': str(versions[check_set])}
+        files_ = {'filename': (f'load-{size}.csv', files[size])}
+        try:
+            status, _ = client.post('/', data, files_)
+        except Exception:
+            status = None
+        latency = time.monotonic() - scheduled
+        with lock:
+            results.append({
+                'size': size, 'report_type': report_type or 'full', 'checks': check_set,
+                'status': status, 'latency': latency,
+            })
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for number in itertools.count():
+            scheduled = start + number / rate
+            if scheduled - start >= duration:
+                break
+            delay = scheduled - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            executor.submit(send, scheduled, *generator.choice(mix))
+    elapsed = time.monotonic() - start
+    return results, elapsed
+
+
+def summarize(results, elapsed):
+    summary = {'overall': _stats(results, elapsed), 'by_request': {}}
+    groups = {}
+    for result in results:
+        groups.setdefault((result['size'], result['report_type']), []).append(result)
+    for (size, report_type), group in sorted(groups.items()):
+        summary['by_request'][f'{size} rows/{report_type}'] = _stats(group, elapsed)
+    return summary
+
+
+def _stats(results, elapsed):
+    latencies = sorted(result['latency'] for result in results)
+    failures = sum(1 for result in results if result['status'] is None or result['status'] >= 400)
+    return {
+        'requests': len(results),
+        'throughput': len(results) / elapsed if elapsed else 0.0,
+        'error_rate': failures / len(results) if results else 0.0,
+        'p50': _percentile(latencies, 50),
+        'p95': _percentile(latencies, 95),
+        'p99': _percentile(latencies, 99),
+    }
+
+
+def _percentile(values, percent):
+    if not values:
+        return None
+    index = min(len(values) - 1, max(0, int(round(percent / 100 * len(values) + 0.5)) - 1))
+    return values[index]
+
+
+def print_summary(summary, sampler):
+    print(f"{'':28}{'requests':>9}{'req/s':>8}{'errors':>8}{'p50':>9}{'p95':>9}{'p99':>9}")
+    rows = [('overall', summary['overall'])] + list(summary['by_request'].items())
+    for name, stats in rows:
+        percentiles = ''.join(
+            f"{stats[key]:>8.3f}s" if stats[key] is not None else f"{'-':>9}"
+            for key in ('p50', 'p95', 'p99')
+        )
+        print(f"{name:28}{stats['requests']:>9}{stats['throughput']:>8.2f}"
+              f"{stats['error_rate']:>7.1%} {percentiles}")
+    print()
+    for pid, peak in sorted(sampler.peak.items()):
+        print(f'pid {pid}: peak RSS {peak / 2**20:.1f} MiB, last {sampler.last.get(pid, 0) / 2**20:.1f} MiB')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', help='server to test, default is the app in this process')
+    parser.add_argument('--server-pid', type=int, help='gunicorn master pid, for worker RSS')
+    parser.add_argument('--rate', type=float, default=1.0, help='requests per second')
+    parser.add_argument('--duration', type=float, default=30.0, help='seconds of load')
+    parser.add_argument('--concurrency', type=int, default=32, help='max requests in flight')
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)), help='rows per upload')
+    parser.add_argument('--report-types', default=','.join(t or 'full' for t in DEFAULT_REPORT_TYPES))
+    parser.add_argument('--checks', action='append', help='comma separated check selection, repeatable')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='also write the summary to this file')
+    args = parser.parse_args()
+
+    client = HttpClient(args.url) if args.url else TestClient()
+    sizes = [int(size) for size in args.sizes.split(',')]
+    report_types = ['' if name == 'full' else name for name in args.report_types.split(',')]
+    sampler = RssSampler(args.server_pid if args.url else None)
+    sampler.start()
+    results, elapsed = run(client, args.rate, args.duration, sizes, report_types,
+                           args.checks or list(DEFAULT_CHECK_SETS), args.concurrency, args.seed)
+    sampler.stop()
+
+    summary = summarize(results, elapsed)
+    summary['rss'] = {str(pid): {'peak': peak, 'last': sampler.last.get(pid)} for pid, peak in sampler.peak.items()}
+    print_summary(summary, sampler)
+    if args.json:
+        with open(args.json, 'w') as outfile:
+            json.dump(summary, outfile, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+"""
+Validate large files with workers on several hosts.
+
+The coordinator cuts each file into row ranges and queues them in a shared
+directory (VALIDATION_QUEUE_DIR, e.g. an NFS mount), workers on any host
+sharing it run the tasks, and the coordinator writes one report per file,
+the same report a single run would write.
+
+On every worker host:
+    python revalidate.py work --queue /mnt/shared/queue --processes 8
+
+Then:
+    python revalidate.py coordinate --queue /mnt/shared/queue --reports out/ data/*.csv
+
+On one machine, with local worker processes started by the coordinator:
+    python revalidate.py coordinate --local-workers 4 --reports out/ big.csv
+
+A publish gate only asks whether a file is clean, it exits 1 at the first
+error (or the first --max-errors of the selected --codes):
+    python revalidate.py gate data.csv
+
+Append-only feeds are followed instead, validating only the records
+appended since the last look, their errors written as JSON lines:
+    python revalidate.py follow --state feed.tail --errors feed-errors.jsonl feed.csv
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import pickle
+import sys
+import time
+from validation.distributed import DEFAULT_QUEUE_DIR, DEFAULT_TASK_BYTES, Coordinator, TaskQueue, work
+from validation.error_records import SEPARATORS, dump_report
+from validation.runner import DEFAULT_MAX_ERRORS, Limits
+from validation.tail import DEFAULT_TAIL_SECONDS, FileTail
+from validation.validator import DEFAULT_GATE_ERRORS, gate
+
+
+def start_workers(queue_dir, processes, idle_exit=None):
+    workers = [
+        multiprocessing.Process(target=work, args=(TaskQueue(queue_dir),), kwargs={'idle_exit': idle_exit})
+        for _ in range(processes)
+    ]
+    for worker in workers:
+        worker.start()
+    return workers
+
+
+def coordinate(args):
+    queue = TaskQueue(args.queue)
+    coordinator = Coordinator(queue, task_bytes=args.task_mb * 1024 * 1024)
+    workers = start_workers(args.queue, args.local_workers) if args.local_workers else []
+    os.makedirs(args.reports, exist_ok=True)
+    try:
+        # Every file is queued first, workers move on to the next file while
+        # the tasks of the first one finish
+        jobs = [(path, coordinator.submit(path, raw_text=args.raw_text, max_errors=args.max_errors or None))
+                for path in args.files]
+        for path, job_id in jobs:
+            started = time.monotonic()
+            report = coordinator.wait(job_id, Limits(max_rows=None, max_errors=args.max_errors or None,
+                                                     max_seconds=args.max_seconds or None, max_memory_mb=None))
+            report_path = os.path.join(args.reports, os.path.basename(path) + '-report.json')
+            with open(report_path, 'w', encoding='utf-8') as outfile:
+                dump_report(report, outfile)
+            errors = sum(len(task.errors) for task in report.tasks) + len(report.errors)
+            print(f'{path}: {"valid" if report.valid else f"{errors} errors"} '
+                  f'in {time.monotonic() - started:.1f}s -> {report_path}')
+    finally:
+        for worker in workers:
+            worker.terminate()
+            worker.join()
+
+
+def run_workers(args):
+    workers = start_workers(args.queue, args.processes, args.idle_exit)
+    for worker in workers:
+        worker.join()
+
+
+def follow(args):
+    checkpoint = None
+    if args.state and os.path.exists(args.state):
+        with open(args.state, 'rb') as infile:
+            checkpoint = pickle.load(infile)
+    tail = FileTail(args.file, raw_text=args.raw_text, from_start=not args.from_end, checkpoint=checkpoint)
+    outfile = open(args.errors, 'a', encoding='utf-8') if args.errors else sys.stdout
+    try:
+        for batch in tail.follow(args.interval):
+            for error in batch['errors']:
+                outfile.write(json.dumps(error, separators=SEPARATORS) + '\n')
+            outfile.flush()
+            if args.state:
+                # The errors are written before the tail moves past them
+                with open(args.state + '.incoming', 'wb') as state_file:
+                    pickle.dump(tail.checkpoint(), state_file, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(args.state + '.incoming', args.state)
+            last = batch['row_position'] + batch['rows'] - 1
+            print(f'{args.file}: {"restarted, " if batch["restarted"] else ""}rows {batch["row_position"]}-{last}: '
+                  f'{len(batch["errors"])} errors', file=sys.stderr)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if outfile is not sys.stdout:
+            outfile.close()
+
+
+def run_gate(args):
+    codes = [code.strip() for code in args.codes.split(',') if code.strip()] if args.codes else None
+    result = gate(args.file, max_errors=args.max_errors, codes=codes, raw_text=args.raw_text)
+    if result['valid']:
+        print(f'{args.file}: valid in {result["time"]:.3f}s')
+        return
+    where = f'stopped at row {result["row"]}' if result['row'] is not None else 'read every row'
+    print(f'{args.file}: {len(result["errors"])} errors, {where} in {result["time"]:.3f}s')
+    for error in result['errors']:
+        print(json.dumps(error, separators=SEPARATORS))
+    sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--queue', default=DEFAULT_QUEUE_DIR, help='queue directory shared by every host')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    coordinator = commands.add_parser('coordinate', parents=[common], help='queue files and write their reports')
+    coordinator.add_argument('files', nargs='+')
+    coordinator.add_argument('--reports', default='.', help='directory of the reports')
+    coordinator.add_argument('--task-mb', type=int, default=DEFAULT_TASK_BYTES // (1024 * 1024),
+                             help='size of the row range of one task')
+    coordinator.add_argument('--local-workers', type=int, default=0, help='worker processes to start here')
+    coordinator.add_argument('--raw-text', action='store_true', help='checks see the cells as written')
+    coordinator.add_argument('--max-errors', type=int, default=DEFAULT_MAX_ERRORS or 0, help='0 for no limit')
+    coordinator.add_argument('--max-seconds', type=float, default=0, help='per file, 0 for no limit')
+    coordinator.set_defaults(run=coordinate)
+
+    worker = commands.add_parser('work', parents=[common], help='run queued tasks')
+    worker.add_argument('--processes', type=int, default=os.cpu_count() or 1)
+    worker.add_argument('--idle-exit', type=float, help='exit after this many seconds without tasks')
+    worker.set_defaults(run=run_workers)
+
+    gater = commands.add_parser('gate', help='pass or fail a file, stopping at its first errors')
+    gater.add_argument('file')
+    gater.add_argument('--max-errors', type=int, default=DEFAULT_GATE_ERRORS, help='errors that fail the file')
+    gater.add_argument('--codes', help='comma separated error codes or tags that count, e.g. type-error,#header')
+    gater.add_argument('--raw-text', action='store_true', help='checks see the cells as written')
+    gater.set_defaults(run=run_gate)
+
+    follower = commands.add_parser('follow', help='validate the records appended to a CSV as it grows')
+    follower.add_argument('file')
+    follower.add_argument('--errors', help='JSON lines file the errors are appended to, stdout by default')
+    follower.add_argument('--state', help='file keeping the position and check state across restarts')
+    follower.add_argument('--interval', type=float, default=DEFAULT_TAIL_SECONDS,
+                          help='seconds between two looks at the file')
+    follower.add_argument('--from-end', action='store_true', help='skip the records already in the file')
+    follower.add_argument('--raw-text', action='store_true', help='checks see the cells as written')
+    follower.set_defaults(run=follow)
+
+    args = parser.parse_args()
+    args.run(args)
+
+
+if __name__ == '__main__':
+    main()
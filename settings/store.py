@@ -0,0 +1,288 @@
+import json
+import os
+import tempfile
+import threading
+import time
+
+# File locks are only available on POSIX, single process servers on Windows
+# do not need them
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+SETTINGS_DIR = os.path.dirname(os.path.abspath(__file__))
+CONFIG_FILES = ('checks.cfg', 'fields.cfg', 'rules.cfg')
+
+# Number of old snapshots kept around for pinned requests
+KEEP_VERSIONS = 50
+
+
+def parse_checks(text):
+    """checks.cfg text -> {check name: 0 or 1}, in file order."""
+    checks = {}
+    for line in text.splitlines():
+        if line.strip() and not line.startswith('#'):
+            key, value = line.split('=')
+            checks[key.strip()] = int(value.strip())
+    return checks
+
+
+def parse_fields(text):
+    """fields.cfg text -> {check key: [field labels]}, in file order."""
+    fields = {}
+    for line in text.splitlines():
+        if line.strip() and not line.startswith('#'):
+            key, value = line.split('=', 1)
+            fields[key.strip()] = [item.strip() for item in value.split(',')]
+    return fields
+
+
+def parse_rules(text):
+    """
+    rules.cfg text -> [(column, rule, argument, line number)].
+
+    Each line reads COLUMN = rule argument, e.g. ZIP = regex ^[0-9]{5}$.
+    Syntax errors raise ValueError with the line number.
+    """
+    rules = []
+    for number, line in enumerate(text.splitlines(), start=1):
+        if not line.strip() or line.lstrip().startswith('#'):
+            continue
+        if '=' not in line:
+            raise ValueError(f'rules.cfg line {number}: expected COLUMN = rule argument')
+        column, definition = line.split('=', 1)
+        parts = definition.strip().split(None, 1)
+        if not column.strip() or not parts:
+            raise ValueError(f'rules.cfg line {number}: expected COLUMN = rule argument')
+        argument = parts[1].strip() if len(parts) > 1 else ''
+        rules.append((column.strip(), parts[0].lower(), argument, number))
+    return rules
+
+
+class ConfigSnapshot:
+    """One immutable version of the settings files."""
+
+    def __init__(self, version, files, created=None):
+        self.version = version
+        self.files = files
+        self.created = created
+        self.checks = parse_checks(files.get('checks.cfg', ''))
+        self.fields = parse_fields(files.get('fields.cfg', ''))
+        # A broken rules file disables the rules only, not the whole config
+        self.rules_error = None
+        try:
+            self.rules = parse_rules(files.get('rules.cfg', ''))
+        except ValueError as exception:
+            self.rules = []
+            self.rules_error = str(exception)
+
+    @property
+    def selected_checks(self):
+        return [name for name, value in self.checks.items() if value == 1]
+
+
+class ConfigStore:
+    """
+    Versioned, multi-process safe access to the settings files.
+
+    Every write creates a new numbered snapshot in settings/versions and then
+    atomically swaps the CURRENT pointer, so a reader always sees a complete
+    pair of files. Requests pin a snapshot for their whole duration and other
+    processes notice a new version through the pointer file.
+    """
+
+    def __init__(self, directory=SETTINGS_DIR, keep_versions=KEEP_VERSIONS):
+        self.directory = directory
+        self.versions_dir = os.path.join(directory, 'versions')
+        self.pointer_path = os.path.join(self.versions_dir, 'CURRENT')
+        self.keep_versions = keep_versions
+        os.makedirs(self.versions_dir, exist_ok=True)
+        self.__lock = threading.Lock()
+        self.__write_thread_lock = threading.Lock()
+        self.__cache = {}
+        self.__current = None
+        self.__current_stamp = None
+
+    # Read
+
+    def current(self):
+        """The latest snapshot, re-read only when another process changed it."""
+        if self.__pointer_stamp() is None or self.__files_edited():
+            # First use, or somebody edited the .cfg files by hand: record
+            # the files on disk as a new version
+            with self.__write_lock():
+                if self.__pointer_stamp() is None or self.__files_edited():
+                    self.__commit(self.__disk_files())
+        stamp = self.__pointer_stamp()
+        if stamp != self.__current_stamp:
+            self.__current = self.snapshot(self.__pointer_version())
+            self.__current_stamp = stamp
+        return self.__current
+
+    def snapshot(self, version):
+        """A specific snapshot, for requests pinned to a config version."""
+        version = int(version)
+        with self.__lock:
+            if version in self.__cache:
+                return self.__cache[version]
+        with open(self.__snapshot_path(version)) as infile:
+            data = json.load(infile)
+        snapshot = ConfigSnapshot(data['version'], data['files'], data.get('created'))
+        with self.__lock:
+            self.__cache[version] = snapshot
+        return snapshot
+
+    def versions(self):
+        return sorted(
+            int(name.split('.')[0]) for name in os.listdir(self.versions_dir)
+            if name.endswith('.json')
+        )
+
+    # Write
+
+    def write(self, name, text):
+        """Replace one settings file and return the new snapshot."""
+        if name not in CONFIG_FILES:
+            raise ValueError(f'unknown settings file: {name}')
+        with self.__write_lock():
+            if self.__pointer_stamp() is None or self.__files_edited():
+                files = self.__disk_files()
+            else:
+                files = dict(self.snapshot(self.__pointer_version()).files)
+            files[name] = text
+            return self.__commit(files)
+
+    # Change notification
+
+    def wait_for_change(self, version, timeout=30.0, interval=0.25):
+        """Block until the current version differs from version, or timeout."""
+        deadline = time.monotonic() + timeout
+        while True:
+            snapshot = self.current()
+            if snapshot.version != version or time.monotonic() >= deadline:
+                return snapshot
+            time.sleep(interval)
+
+    def watch(self, callback, interval=1.0):
+        """Call callback(snapshot) from a daemon thread whenever the version changes."""
+        def run():
+            version = self.current().version
+            while True:
+                snapshot = self.wait_for_change(version, timeout=3600, interval=interval)
+                if snapshot.version != version:
+                    version = snapshot.version
+                    callback(snapshot)
+
+        thread = threading.Thread(target=run, name='config-watch', daemon=True)
+        thread.start()
+        return thread
+
+    # Internal
+
+    def __commit(self, files):
+        # Called with the write lock held
+        versions = self.versions()
+        version = versions[-1] + 1 if versions else 1
+        data = {'version': version, 'created': time.time(), 'files': files}
+        self.__atomic_write(self.__snapshot_path(version), json.dumps(data))
+        for name, text in files.items():
+            if self.__read_file(name) != text:
+                self.__atomic_write(os.path.join(self.directory, name), text)
+        self.__atomic_write(self.__stamps_path(), json.dumps(self.__file_stamps()))
+        self.__atomic_write(self.pointer_path, str(version))
+        for old in versions[: -self.keep_versions]:
+            try:
+                os.remove(self.__snapshot_path(old))
+            except FileNotFoundError:
+                pass
+        return self.snapshot(version)
+
+    def __atomic_write(self, path, text):
+        directory = os.path.dirname(path)
+        handle, temp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+        try:
+            with os.fdopen(handle, 'w') as outfile:
+                outfile.write(text)
+                outfile.flush()
+                os.fsync(outfile.fileno())
+            os.chmod(temp_path, 0o644)
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def __write_lock(self):
+        return _FileLock(os.path.join(self.versions_dir, '.lock'), self.__write_thread_lock)
+
+    def __pointer_version(self):
+        with open(self.pointer_path) as pointer:
+            return int(pointer.read().strip())
+
+    def __disk_files(self):
+        return {name: self.__read_file(name) for name in CONFIG_FILES}
+
+    def __read_file(self, name):
+        try:
+            with open(os.path.join(self.directory, name)) as infile:
+                return infile.read()
+        except FileNotFoundError:
+            return ''
+
+    def __file_stamps(self):
+        stamps = {}
+        for name in CONFIG_FILES:
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+                stamps[name] = [stat.st_mtime_ns, stat.st_size]
+            except FileNotFoundError:
+                stamps[name] = None
+        return stamps
+
+    def __files_edited(self):
+        try:
+            with open(self.__stamps_path()) as infile:
+                recorded = json.load(infile)
+        except (FileNotFoundError, ValueError):
+            return False
+        return recorded != self.__file_stamps()
+
+    def __pointer_stamp(self):
+        try:
+            stat = os.stat(self.pointer_path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_ino, stat.st_mtime_ns)
+
+    def __snapshot_path(self, version):
+        return os.path.join(self.versions_dir, f'{int(version):06d}.json')
+
+    def __stamps_path(self):
+        return os.path.join(self.versions_dir, 'STAMPS')
+
+
+class _FileLock:
+    # Serializes writers across threads and, where supported, processes
+
+    def __init__(self, path, thread_lock):
+        self.path = path
+        self.thread_lock = thread_lock
+        self.handle = None
+
+    def __enter__(self):
+        self.thread_lock.acquire()
+        if fcntl is not None:
+            self.handle = open(self.path, 'a')
+            fcntl.flock(self.handle, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.handle is not None:
+            fcntl.flock(self.handle, fcntl.LOCK_UN)
+            self.handle.close()
+            self.handle = None
+        self.thread_lock.release()
+
+
+config_store = ConfigStore()
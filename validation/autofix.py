@@ -0,0 +1,97 @@
+import csv
+import json
+import os
+from frictionless import Check
+from .storage import new_job_id
+
+
+class AutoFixer(Check):
+    """
+    Writes a corrected copy of the table while it is validated.
+
+    Every text cell goes through the fix(field_name, text) of the selected
+    checks that have one (lead_trail_spaces first), the row is written to
+    the copy with the dialect of the file and each changed cell is logged
+    as a JSON line: row, field, error code of the check, text before and
+    after.
+
+    Runs as the last check, the copy is only published when the whole table
+    was read, like the parse cache, discard() drops it after a partial run.
+    """
+
+    code = "auto-fixer"
+    Errors = []
+
+    def __init__(self, checks, fixed_path, log_path, descriptor=None):
+        super().__init__(descriptor)
+        self.__fixers = sorted(
+            (check for check in checks if hasattr(check, 'fix')), key=lambda check: getattr(check, 'fix_order', 1)
+        )
+        self.__fixed_path = fixed_path
+        self.__log_path = log_path
+        self.__temp_path = None
+        self.__fixed = self.__log = self.__writer = None
+        self.__field_names = []
+
+    def validate_start(self):
+        header = self.resource.header
+        if not self.resource.tabular or header.row_positions != [1]:
+            return
+        dialect = self.resource.dialect
+        self.__temp_path = os.path.join(os.path.dirname(self.__fixed_path), '.incoming-' + new_job_id())
+        self.__fixed = open(self.__temp_path, 'w', newline='', encoding=self.resource.encoding or 'utf-8')
+        self.__log = open(self.__temp_path + '-log', 'w', encoding='utf-8')
+        self.__writer = csv.writer(self.__fixed, delimiter=dialect.delimiter, quotechar=dialect.quote_char,
+                                   lineterminator=dialect.line_terminator)
+        self.__writer.writerow(header.labels)
+        self.__field_names = list(self.resource.schema.field_names)
+        yield from []
+
+    def validate_row(self, row):
+        if self.__temp_path is None:
+            return
+        # The cells as parsed from the file, not the values cast from them
+        cells = list(row.cells)
+        for index, field_name in enumerate(self.__field_names[:len(cells)]):
+            text = cells[index]
+            if not isinstance(text, str):
+                continue
+            for check in self.__fixers:
+                fixed = check.fix(field_name, text)
+                if fixed != text:
+                    self.__log.write(json.dumps({
+                        'rowPosition': row.row_position, 'fieldName': field_name, 'code': check.Errors[0].code,
+                        'before': text, 'after': fixed,
+                    }) + '\n')
+                    text = fixed
+            cells[index] = text
+        self.__writer.writerow(cells)
+        yield from []
+
+    def validate_end(self):
+        if self.__temp_path is None:
+            return
+        self.__fixed.close()
+        self.__log.close()
+        os.replace(self.__temp_path + '-log', self.__log_path)
+        os.replace(self.__temp_path, self.__fixed_path)
+        self.__temp_path = None
+        yield from []
+
+    def discard(self):
+        """Drop an unpublished copy, e.g. after a partial run."""
+        if self.__temp_path is None:
+            return
+        self.__fixed.close()
+        self.__log.close()
+        for path in (self.__temp_path, self.__temp_path + '-log'):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        self.__temp_path = None
+
+    metadata_profile = {  # type: ignore
+        "type": "object",
+        "properties": {},
+    }
@@ -0,0 +1,241 @@
+import json
+import os
+import numpy as np
+from .error_records import ErrorBuffer
+from .storage import DATA_DIR, new_job_id
+
+DEFAULT_DIRECTORY = os.path.join(DATA_DIR, 'bitmaps')
+
+MAGIC = b'RBIX1\n'
+
+# Container kinds, roaring style: the low 16 bits of the rows of one 65536
+# row chunk as a sorted array, a bitmap or runs, whichever is smallest
+ARRAY, BITMAP, RUNS = 0, 1, 2
+CHUNK_ROWS = 1 << 16
+BITMAP_BYTES = CHUNK_ROWS // 8
+
+
+class BitmapStore:
+    """
+    Row bitmaps of the errors of each report, a compact companion of the
+    report for files with millions of rows.
+
+    A report's index answers which rows fail a check (in one column or any),
+    fail any check, or fail several at once, without reading the report.
+    """
+
+    def __init__(self, directory=DEFAULT_DIRECTORY):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, report_id):
+        return os.path.join(self.directory, os.path.basename(str(report_id)) + '.bitmaps')
+
+    def add_report(self, report_id, report):
+        BitmapIndex.from_report(report).write(self.path(report_id))
+
+    def index(self, report_id):
+        """BitmapIndex of report_id, None if it has none."""
+        try:
+            return BitmapIndex.load(self.path(report_id))
+        except FileNotFoundError:
+            return None
+
+    def prune(self, older_than):
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                if os.path.getmtime(path) < older_than:
+                    os.remove(path)
+            except FileNotFoundError:
+                continue
+
+
+class BitmapIndex:
+    """
+    Failing rows per (error code, field name), field name None for errors
+    of a whole row, as compressed row bitmaps.
+
+    Only the errors the report kept are in. truncated is set when the run
+    stopped early or dropped errors past max_errors, other rows may fail too.
+
+    Rows are split into chunks of 65536, each stored as the sorted low bits
+    of its rows, a bitmap or runs of consecutive rows. A loaded index maps
+    the file and only decodes the chunks a query reads. Queries return the
+    sorted row positions as a numpy array.
+    """
+
+    def __init__(self, keys, blob, truncated=False):
+        # keys: {(code, field name): (count, [(high, kind, offset, size), ...])}
+        self.__keys = keys
+        self.__blob = blob
+        self.truncated = truncated
+
+    @classmethod
+    def from_report(cls, report):
+        groups = {}
+        for task in report.tasks:
+            if isinstance(task.errors, ErrorBuffer):
+                keys, kinds, positions = task.errors.row_index()
+                kinds = np.asarray(kinds, dtype=np.int64)
+                positions = np.asarray(positions, dtype=np.int64)
+                for kind in np.unique(kinds):
+                    if kind >= 0:
+                        groups.setdefault(keys[kind], []).append(positions[kinds == kind])
+                for index in np.flatnonzero(kinds < 0):
+                    _add_error(groups, task.errors[int(index)])
+            else:
+                for error in task.errors:
+                    _add_error(groups, error)
+        for error in report.errors:
+            _add_error(groups, error)
+
+        keys = {}
+        parts = []
+        size = 0
+        for key, arrays in groups.items():
+            rows = np.unique(np.concatenate(arrays))
+            containers = []
+            for high, data, kind in _encode(rows):
+                containers.append((high, kind, size, len(data)))
+                parts.append(data)
+                size += len(data)
+            keys[key] = (len(rows), containers)
+        truncated = not report.tasks or any(
+            task.partial or getattr(task.errors, 'dropped', 0) for task in report.tasks)
+        return cls(keys, np.frombuffer(b''.join(parts), dtype=np.uint8), truncated)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as infile:
+            if infile.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f'{path} is not a row bitmap index')
+            length = int.from_bytes(infile.read(8), 'little')
+            header = json.loads(infile.read(length))
+        start = len(MAGIC) + 8 + length
+        blob = np.memmap(path, dtype=np.uint8, mode='r', offset=start) \
+            if os.path.getsize(path) > start else np.zeros(0, dtype=np.uint8)
+        keys = {(entry['code'], entry['field']): (entry['count'], [tuple(c) for c in entry['containers']])
+                for entry in header['keys']}
+        return cls(keys, blob, header.get('truncated', False))
+
+    def write(self, path):
+        header = json.dumps({'truncated': self.truncated, 'keys': [
+            {'code': code, 'field': field, 'count': count, 'containers': containers}
+            for (code, field), (count, containers) in self.__keys.items()
+        ]}, separators=(',', ':')).encode()
+        temp_path = os.path.join(os.path.dirname(path) or '.', '.incoming-' + new_job_id())
+        with open(temp_path, 'wb') as outfile:
+            outfile.write(MAGIC)
+            outfile.write(len(header).to_bytes(8, 'little'))
+            outfile.write(header)
+            outfile.write(self.__blob.tobytes())
+        os.replace(temp_path, path)
+
+    def keys(self):
+        """{(code, field name): failing rows} of every key of the index."""
+        return {key: count for key, (count, _) in self.__keys.items()}
+
+    def rows(self, code, field=None):
+        """Rows failing code, in column field or, with None, in any column."""
+        return self.union((code, field))
+
+    def union(self, *selectors):
+        """Rows failing any selector, a code or a (code, field name) pair."""
+        keys = [key for selector in selectors for key in self.__selected(selector)]
+        containers = sorted(container for key in keys for container in self.__keys.get(key, (0, []))[1])
+        if len({key for key in keys if key in self.__keys}) <= 1:
+            # The chunks of one key never overlap, they are decoded in order
+            return self.__rows(self.__decode(*container) for container in containers)
+        return self.__positions(self.__chunks(keys))
+
+    def any(self, codes=None):
+        """Rows failing any check, or any of codes."""
+        return self.union(*[key for key in self.__keys if codes is None or key[0] in codes])
+
+    def intersection(self, *selectors):
+        """Rows failing every selector, a code or a (code, field name) pair."""
+        chunks = None
+        for selector in selectors:
+            selected = self.__chunks(self.__selected(selector))
+            if chunks is None:
+                chunks = selected
+            else:
+                # Only the chunks both have rows in are read
+                chunks = {high: np.logical_and(bits, selected[high])
+                          for high, bits in chunks.items() if high in selected}
+            if not chunks:
+                break
+        return self.__positions(chunks or {})
+
+    # Internal
+
+    def __selected(self, selector):
+        code, field = selector if isinstance(selector, tuple) else (selector, None)
+        if field is not None:
+            return [(code, field)]
+        return [key for key in self.__keys if key[0] == code]
+
+    def __chunks(self, keys):
+        # {high: bool[65536]} of the rows of any of keys
+        chunks = {}
+        for key in keys:
+            for container in self.__keys.get(key, (0, []))[1]:
+                high = container[0]
+                bits = self.__bits(*container)
+                chunks[high] = np.logical_or(chunks[high], bits) if high in chunks else bits
+        return chunks
+
+    def __positions(self, chunks):
+        return self.__rows((high << 16) + np.flatnonzero(chunks[high]) for high in sorted(chunks))
+
+    @staticmethod
+    def __rows(arrays):
+        arrays = list(arrays)
+        return np.concatenate(arrays).astype(np.int64) if arrays else np.zeros(0, dtype=np.int64)
+
+    def __decode(self, high, kind, offset, size):
+        if kind == ARRAY:
+            lows = np.frombuffer(self.__blob, dtype=np.uint16, count=size // 2, offset=offset)
+        elif kind == BITMAP:
+            lows = np.flatnonzero(np.unpackbits(self.__blob[offset:offset + size], bitorder='little'))
+        else:
+            runs = np.frombuffer(self.__blob, dtype=np.uint16, count=size // 2, offset=offset).reshape(-1, 2)
+            lows = np.concatenate([np.arange(start, last + 1) for start, last in runs.astype(np.int64)])
+        return (high << 16) + lows.astype(np.int64)
+
+    def __bits(self, high, kind, offset, size):
+        if kind == BITMAP:
+            return np.unpackbits(self.__blob[offset:offset + size], bitorder='little').view(bool)
+        bits = np.zeros(CHUNK_ROWS, dtype=bool)
+        bits[self.__decode(high, kind, offset, size) - (high << 16)] = True
+        return bits
+
+
+def _add_error(groups, error):
+    row = error.get('rowPosition')
+    if row is not None:
+        groups.setdefault((error.code, error.get('fieldName')), []).append(np.array([row], dtype=np.int64))
+
+
+def _encode(rows):
+    # (high, bytes, kind) of each chunk of the sorted unique rows
+    highs = rows >> 16
+    bounds = np.flatnonzero(np.diff(highs)) + 1
+    for chunk in np.split(rows, bounds):
+        high = int(chunk[0] >> 16)
+        lows = (chunk & 0xFFFF).astype(np.uint16)
+        breaks = np.flatnonzero(np.diff(lows.astype(np.int64)) != 1)
+        starts = np.concatenate([lows[:1], lows[breaks + 1]])
+        lasts = np.concatenate([lows[breaks], lows[-1:]])
+        sizes = {ARRAY: 2 * len(lows), BITMAP: BITMAP_BYTES, RUNS: 4 * len(starts)}
+        kind = min(sizes, key=lambda kind: (sizes[kind], kind))
+        if kind == ARRAY:
+            data = lows.tobytes()
+        elif kind == BITMAP:
+            bits = np.zeros(CHUNK_ROWS, dtype=bool)
+            bits[lows] = True
+            data = np.packbits(bits, bitorder='little').tobytes()
+        else:
+            data = np.stack([starts, lasts], axis=1).astype(np.uint16).tobytes()
+        yield high, data, kind
@@ -0,0 +1,161 @@
+import os
+import pickle
+import shutil
+import time
+from frictionless import Report, helpers
+from .distributed import kept_errors, merge_report, merge_states, plan_job, validate_range
+from .runner import Limits, offset_progress
+from .storage import DATA_DIR, new_job_id
+
+DEFAULT_DIRECTORY = os.path.join(DATA_DIR, 'checkpoints')
+
+# Bytes validated between two checkpoints
+CHECKPOINT_BYTES = int(os.environ.get('VALIDATION_CHECKPOINT_MB', 64)) * 1024 * 1024
+
+# Smaller files are validated in one go, a restart costs little
+MIN_CHECKPOINT_BYTES = int(os.environ.get('VALIDATION_CHECKPOINT_MIN_MB', 256)) * 1024 * 1024
+
+
+class CheckpointStore:
+    """
+    Progress of long validation runs, so a run whose worker died resumes
+    where it stopped instead of from row 1.
+
+    A run has a directory named after its job id with its plan and
+    arguments (run.pickle), the result of every range validated so far
+    (one file each, errors included) and the last checkpoint
+    (checkpoint.pickle: next range, byte offset, row position and the state
+    of the stateful checks), replaced after each range.
+    """
+
+    def __init__(self, directory=DEFAULT_DIRECTORY):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def start(self, job_id, run):
+        self.clear(job_id)
+        os.makedirs(self.__path(job_id))
+        self.__write(job_id, 'run.pickle', run)
+
+    def run(self, job_id):
+        """Plan and arguments of the run of job_id, None without checkpoints."""
+        return self.__read(job_id, 'run.pickle')
+
+    def checkpoint(self, job_id):
+        return self.__read(job_id, 'checkpoint.pickle')
+
+    def save(self, job_id, number, result, checkpoint):
+        # The result first, a checkpoint never points past the stored ranges
+        self.__write(job_id, f'range-{number:06d}.pickle', result)
+        self.__write(job_id, 'checkpoint.pickle', checkpoint)
+
+    def results(self, job_id, count):
+        return [self.__read(job_id, f'range-{number:06d}.pickle') for number in range(count)]
+
+    def clear(self, job_id):
+        shutil.rmtree(self.__path(job_id), ignore_errors=True)
+
+    def prune(self, older_than):
+        """Drop checkpoints of runs not resumed since the older_than timestamp."""
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                if os.path.getmtime(path) < older_than:
+                    shutil.rmtree(path)
+            except FileNotFoundError:
+                continue
+
+    def __path(self, job_id):
+        return os.path.join(self.directory, os.path.basename(str(job_id)))
+
+    def __read(self, job_id, name):
+        try:
+            with open(os.path.join(self.__path(job_id), name), 'rb') as infile:
+                return pickle.load(infile)
+        except FileNotFoundError:
+            return None
+
+    def __write(self, job_id, name, value):
+        temp_path = os.path.join(self.__path(job_id), '.incoming-' + new_job_id())
+        with open(temp_path, 'wb') as outfile:
+            pickle.dump(value, outfile, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, os.path.join(self.__path(job_id), name))
+
+
+def should_checkpoint(filepath, checkpoints, job_id):
+    """Whether a run of filepath under job_id goes through validate_checkpointed."""
+    if checkpoints is None or not job_id:
+        return False
+    return checkpoints.run(job_id) is not None or os.path.getsize(filepath) >= MIN_CHECKPOINT_BYTES
+
+
+@Report.from_validate
+def validate_checkpointed(filepath, checkpoints, job_id, config, limits=None, raw_text=False,
+                          arguments=None, interval=CHECKPOINT_BYTES):
+    """
+    Validate filepath a range of about interval bytes at a time, with a
+    checkpoint after each, resuming from the checkpoint of job_id if its
+    run was stopped midway.
+
+    The ranges are read and merged like the tasks of distributed.py, the
+    stateful checks starting each range from the state the range before
+    ended with, so a resumed run writes the report of an uninterrupted one.
+    """
+    timer = helpers.Timer()
+    started = time.monotonic()
+    limits = limits or Limits()
+    stat = os.stat(filepath)
+    # Not the mtime, the upload store touches the files it pins
+    stamp = (os.path.abspath(filepath), stat.st_size, stat.st_ino, config.version, raw_text, limits.max_errors)
+    run = checkpoints.run(job_id)
+    if run is None or run['stamp'] != stamp:
+        job, ranges = plan_job(filepath, config, raw_text, limits.max_errors, interval)
+        run = {'stamp': stamp, 'job': job, 'ranges': ranges, 'arguments': arguments}
+        checkpoints.start(job_id, run)
+    job, ranges = run['job'], run['ranges']
+
+    checkpoint = checkpoints.checkpoint(job_id) or {
+        'number': 0, 'offset': ranges[0][0], 'row_position': ranges[0][2], 'state': {}, 'errors': 0,
+    }
+    results = checkpoints.results(job_id, checkpoint['number'])
+    # Errors per code of the ranges done, for the progress samples
+    counts = {}
+    for number, result in enumerate(results):
+        kept_errors(result, number).count_codes(counts)
+    note = None
+    for number in range(checkpoint['number'], len(ranges)):
+        if limits.max_errors and checkpoint['errors'] >= limits.max_errors:
+            break
+        note = limits.exceeded(started)
+        if note:
+            break
+        start, stop, row_position = ranges[number]
+        left = limits.max_seconds - (time.monotonic() - started) if limits.max_seconds else None
+        progress = limits.progress
+        if start is not None:
+            progress = offset_progress(progress, start - len(job['header']), counts, stat.st_size)
+        result = validate_range(job, start, stop, row_position, checkpoint['state'], Limits(
+            max_rows=limits.max_rows, max_seconds=left, max_errors=limits.max_errors,
+            max_memory_mb=limits.max_memory_mb, cancelled=limits.cancelled, progress=progress,
+        ))
+        if 'failed' in result:
+            checkpoints.clear(job_id)
+            return merge_report(job, ranges, results, failed=result['failed'], timer=timer)
+        results.append(result)
+        kept = kept_errors(result, number)
+        kept.count_codes(counts)
+        checkpoint = {
+            'number': number + 1,
+            'offset': stop,
+            'row_position': row_position + result['rows'],
+            'state': merge_states(checkpoint['state'], result['states']),
+            'errors': checkpoint['errors'] + len(kept),
+        }
+        checkpoints.save(job_id, number, result, checkpoint)
+        # Stopped inside the range by a limit
+        if result['partial']:
+            break
+
+    report = merge_report(job, ranges, results, note, timer=timer)
+    checkpoints.clear(job_id)
+    return report
@@ -0,0 +1,132 @@
+import bz2
+import gzip
+import io
+import lzma
+import os
+from frictionless import system
+from frictionless.plugin import Plugin
+from frictionless.plugins.local import LocalLoader
+
+# zstd support is optional, it needs the zstandard package
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+def _open_zstd(byte_stream):
+    if zstandard is None:
+        raise OSError('zstd compressed uploads need the "zstandard" package')
+    raw = _RewindableReader(byte_stream, zstandard.ZstdDecompressor().stream_reader)
+    return io.BufferedReader(raw)
+
+
+# Compressed extension -> function opening a decompressing binary stream
+DECOMPRESSORS = {
+    'gz': gzip.open,
+    'bz2': bz2.open,
+    'xz': lzma.open,
+    'zst': _open_zstd,
+}
+
+REPORT_COMPRESSIONS = {
+    'gzip': ('.gz', gzip.open),
+}
+
+
+def detect_compression(path):
+    """Return (compression, inner format) for a path such as data.csv.gz."""
+    name = os.path.basename(str(path)).lower()
+    stem, extension = os.path.splitext(name)
+    compression = extension[1:]
+    if compression not in DECOMPRESSORS:
+        return '', extension[1:]
+    return compression, os.path.splitext(stem)[1][1:]
+
+
+def resource_options(path):
+    """Resource options that make frictionless stream-decompress the file."""
+    compression, format = detect_compression(path)
+    if not compression:
+        return {}
+    options = {'compression': compression}
+    if format:
+        options['format'] = format
+    return options
+
+
+def open_report(path, compression=None):
+    """Open a report file for writing text, compressed if requested."""
+    if compression:
+        extension, opener = REPORT_COMPRESSIONS[compression]
+        return path + extension, opener(path + extension, 'wt', encoding='utf-8')
+    return path, open(path, 'w', encoding='utf-8')
+
+
+def gzip_content_size(path):
+    """Decompressed size of a single member gzip file under 4 GiB, like our reports."""
+    with open(path, 'rb') as infile:
+        infile.seek(-4, os.SEEK_END)
+        return int.from_bytes(infile.read(4), 'little')
+
+
+class CompressionPlugin(Plugin):
+    """
+    Frictionless plugin for compressed local files.
+
+    Decompresses gzip, bz2, xz and zstd uploads while they are read, the
+    decompressed data is never written to disk.
+    """
+
+    code = 'compression'
+
+    def create_loader(self, resource):
+        if resource.scheme == 'file' and resource.compression in DECOMPRESSORS:
+            return CompressedLoader(resource)
+
+
+class CompressedLoader(LocalLoader):
+
+    def read_byte_stream_decompress(self, byte_stream):
+        return DECOMPRESSORS[self.resource.compression](byte_stream)
+
+
+# Internal
+
+
+class _RewindableReader(io.RawIOBase):
+    # Frictionless rewinds the stream after sniffing the first bytes, forward
+    # only decompressors are restarted from the beginning of the file instead
+
+    def __init__(self, byte_stream, open_reader):
+        self.__byte_stream = byte_stream
+        self.__open_reader = open_reader
+        self.__reader = open_reader(byte_stream)
+        self.__position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.__reader.read(len(buffer))
+        buffer[: len(data)] = data
+        self.__position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.__position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET and offset == 0:
+            self.__byte_stream.seek(0)
+            self.__reader = self.__open_reader(self.__byte_stream)
+            self.__position = 0
+        elif not (whence == io.SEEK_CUR and offset == 0):
+            raise io.UnsupportedOperation('compressed streams can only be rewound')
+        return self.__position
+
+
+system.register(CompressionPlugin.code, CompressionPlugin())
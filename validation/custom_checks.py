@@ -1,20 +1,60 @@
 from frictionless import Check, errors
 from frictionless.errors.label import LabelError
 from .custom_errors import *
+from .keywords import keyword_scanner
+from .reference_index import ReferenceIndexes
+from .rules import RuleError, compile_rules
 from sqlalchemy.sql.expression import false, label, true
+from settings.store import config_store
+from contextlib import contextmanager
 from datetime import datetime
+import contextvars
 import re
-import importlib.resources as resources
 
 
-# Load the fields.cfg file into a dictionary with
-# the User's custom fields
-cfg_dict = {}
-cfg_file = resources.open_text('settings', 'fields.cfg')
-for line in cfg_file:
-    if not line.startswith('#'): 
-        key, value = line.rstrip('\n').split(' = ')
-        cfg_dict[key] = value.split(',')
+# The User's custom fields and rules come from the config store. A request
+# pins one config version while it creates its checks, otherwise the latest
+# version is used
+_pinned_config = contextvars.ContextVar('pinned_config', default=None)
+
+
+def current_config():
+    config = _pinned_config.get()
+    if config is None:
+        config = config_store.current()
+    return config
+
+
+def field_config():
+    return current_config().fields
+
+
+# Reference datasets of the referential integrity check, indexed once and
+# shared by every run of the process
+reference_indexes = ReferenceIndexes()
+
+# Reference lookups remembered per column and run
+REFERENCE_MEMO_SIZE = 65536
+
+
+@contextmanager
+def pinned_config(config):
+    token = _pinned_config.set(config)
+    try:
+        yield
+    finally:
+        _pinned_config.reset(token)
+
+
+# Checks with a fix(field_name, text) method correct their cells in the
+# auto-fix output, see autofix.py. A fix only rewrites text it is sure of and
+# returns anything else as it is
+
+
+def fix_zip_code(text):
+    # Nine digits without the hyphen, 972171202 -> 97217-1202
+    return f"{text[:5]}-{text[5:]}" if re.fullmatch("[0-9]{9}", text) else text
+
 
 class header_format(Check):
     """
@@ -113,6 +153,10 @@ class numeric_field(Check):
     """
     code = "numeric-field-error"
     Errors = [NumericFieldError]
+    # Looks at one cell at a time, see sharding.py
+    column_local = True
+    # Columns of these inferred types keep their type in raw text runs
+    needs_types = ("number", "integer")
 
     def __init__(self, descriptor=None):
         super().__init__(descriptor)
@@ -164,11 +208,14 @@ class zip_code_format(Check):
     """
     code = "zip-code-consistency-error"
     Errors = [ZipCodeFormatError]
+    # Looks at one cell at a time, see sharding.py
+    column_local = True
 
     def __init__(self, descriptor=None):
         super().__init__(descriptor)
         self.__checklabels = []
         # Append any new labels from the config file
+        cfg_dict = field_config()
         if 'ZIP_CODE_FORMAT' in cfg_dict:
             for new_label in cfg_dict['ZIP_CODE_FORMAT']:
                 if new_label.strip() not in self.__checklabels:
@@ -200,6 +247,11 @@ class zip_code_format(Check):
                         row, note=note, field_name=field_name
                     )
 
+    def fix(self, field_name, text):
+        if field_name.upper() in self.__checklabels:
+            return fix_zip_code(text)
+        return text
+
     # Metadata
     metadata_profile = {  # type: ignore
         "type": "object",
@@ -218,17 +270,33 @@ class zip_code_consistency(Check):
     """
     code = "zip-code-consistency-error"
     Errors = [ZipCodeFormatConsistencyError]
+    # Looks at one cell at a time, see sharding.py
+    column_local = True
 
     def __init__(self, descriptor=None):
         super().__init__(descriptor)
         self.__memory = {}
         self.__checklabels = []
         # Append any new labels from the config file
+        cfg_dict = field_config()
         if 'ZIP_CODE_CONSISTENCY' in cfg_dict:
             for new_label in cfg_dict['ZIP_CODE_CONSISTENCY']:
                 if new_label.strip() not in self.__checklabels:
                     self.__checklabels.append(new_label.strip().upper())
 
+    # The first format of each column decides the later rows, runs over
+    # consecutive row ranges carry it over, see distributed.py
+    def state(self):
+        return dict(self.__memory)
+
+    def restore_state(self, state):
+        self.__memory = dict(state)
+
+    @staticmethod
+    def merge_state(earlier, later):
+        # Columns decided earlier keep their format
+        return {**later, **earlier}
+
     # check if zip code is in header and get the key
     def validate_start(self):
         has_zip_code = False
@@ -273,6 +341,12 @@ class zip_code_consistency(Check):
                             row, note=note, field_name=field_name
                         )
 
+    def fix(self, field_name, text):
+        # The hyphen is all a nine-digit zip code can be missing here
+        if field_name.upper() in self.__checklabels:
+            return fix_zip_code(text)
+        return text
+
     # Metadata
     metadata_profile = {  # type: ignore
         "type": "object",
@@ -288,11 +362,28 @@ class boolean_format_consistency(Check):
     """
     code = "boolean-format-consistency-error"
     Errors = [BooleanFormatConsistencyError]
+    # Looks at one cell at a time, see sharding.py
+    column_local = True
+    # Columns of these inferred types keep their type in raw text runs
+    needs_types = ("boolean",)
 
     def __init__(self, descriptor=None):
         super().__init__(descriptor)
         self.__memory = {}
 
+    # State of the check across row ranges (the boolean set chosen per
+    # column), see distributed.py
+    def state(self):
+        return dict(self.__memory)
+
+    def restore_state(self, state):
+        self.__memory = dict(state)
+
+    @staticmethod
+    def merge_state(earlier, later):
+        # A set chosen in earlier rows wins
+        return {**later, **earlier}
+
     # check if there is are boolean data types in the dataset
     def validate_start(self):
         column_data_types = [field["type"] for field in self.resource.schema.fields]
@@ -341,6 +432,22 @@ class boolean_format_consistency(Check):
                             row, note=note, field_name=field_name
                         )
 
+    # Pairs of the auto-fix, the true value first
+    BOOLEAN_PAIRS = (("1", "0"), ("t", "f"), ("true", "false"), ("yes", "no"), ("y", "n"), ("on", "off"))
+
+    def fix(self, field_name, text):
+        # Only values validate_row flags, written in the set chosen for the
+        # column, e.g. Yes -> 1 in a column of 1 and 0
+        saved_boolean_format = self.__memory.get(field_name)
+        if not saved_boolean_format or text in saved_boolean_format[0]:
+            return text
+        value = text.lower()
+        target = next(pair for pair in self.BOOLEAN_PAIRS if set(pair) == set(saved_boolean_format[0]))
+        for pair in self.BOOLEAN_PAIRS:
+            if value in pair:
+                return target[pair.index(value)]
+        return text
+
     # Metadata
     metadata_profile = {  # type: ignore
         "type": "object",
@@ -359,6 +466,8 @@ class lead_trail_spaces(Check):
 
     code = "leading-or-trailing-whitespace"
     Errors = [LeadTrailWhitespace]
+    # Looks at one cell at a time, see sharding.py
+    column_local = True
 
     def __init__(self, descriptor=None):
         super().__init__(descriptor)
@@ -376,6 +485,12 @@ class lead_trail_spaces(Check):
                 note = "value has leading or trailing whitespace"
                 yield LeadTrailWhitespace.from_row(row, note=note, field_name=cell[0])
 
+    # Trimmed before the other fixes look at the text
+    fix_order = 0
+
+    def fix(self, field_name, text):
+        return text.strip()
+
     metadata_profile = {  # type: ignore
         "type": "object",
         "properties": {},
@@ -397,6 +512,7 @@ class address_field_seperate(Check):
         super().__init__(descriptor)
         self.__checklabels = []
         # Append any new labels from the config file
+        cfg_dict = field_config()
         if 'ADDRESS_FIELD_SEPERATE' in cfg_dict:
             for new_label in cfg_dict['ADDRESS_FIELD_SEPERATE']:
                 if new_label.strip() not in self.__checklabels:
@@ -449,6 +565,8 @@ class monetary_fields(Check):
 
     code = "monetary fields"
     Errors = [MonetaryFields]
+    # Looks at one cell at a time, see sharding.py
+    column_local = True
     
 
     def __init__(self, descriptor=None):
@@ -456,6 +574,7 @@ class monetary_fields(Check):
         self.__checklabels = []
 
         # Append any new labels from the config file
+        cfg_dict = field_config()
         if 'MONETARY_FIELDS' in cfg_dict:
             for new_label in cfg_dict['MONETARY_FIELDS']:
                 if new_label.strip() not in self.__checklabels:
@@ -476,6 +595,16 @@ class monetary_fields(Check):
                         row, note=note, field_name=field
                     )
 
+    # Amounts the auto-fix rewrites: a dollar sign and commas only between
+    # groups of thousands, $1,200.50 but not $1,5 or 1,23,4
+    FIXABLE_AMOUNT = re.compile(r"^\$?-?(\d{1,3}(,\d{3})+|\d+)(\.\d{2})?$")
+
+    def fix(self, field_name, text):
+        # $1,200.50 -> 1200.50, other amounts are left for a person
+        if field_name.upper() not in self.__checklabels or not self.FIXABLE_AMOUNT.match(text):
+            return text
+        return text.replace("$", "").replace(",", "")
+
     metadata_profile = {  # type: ignore
         "type": "object",
         "properties": {},
@@ -485,12 +614,15 @@ class monetary_fields(Check):
 class phone_number_format_error(Check):
     code = "phone-number-format-error"
     Errors = [PhoneNumberFormatError]
+    # Looks at one cell at a time, see sharding.py
+    column_local = True
 
     def __init__(self, descriptor=None):
         super().__init__(descriptor)
         self.__checklabels = []
 
         # Append any new labels from the config file
+        cfg_dict = field_config()
         if 'PHONE_NUMBER_FORMAT_ERROR' in cfg_dict:
             for new_label in cfg_dict['PHONE_NUMBER_FORMAT_ERROR']:
                 if new_label.strip() not in self.__checklabels:
@@ -517,6 +649,17 @@ class phone_number_format_error(Check):
                             row, note=note, field_name=label
                         )
 
+    def fix(self, field_name, text):
+        # Ten digits written another way, (503) 555 1234 or 5035551234
+        if field_name.upper() not in self.__checklabels or not re.fullmatch("[0-9()+. -]+", text):
+            return text
+        digits = re.sub("[^0-9]", "", text)
+        if len(digits) == 11 and digits.startswith("1"):
+            digits = digits[1:]
+        if len(digits) != 10:
+            return text
+        return f"{digits[:3]}-{digits[3:6]}-{digits[6:]}"
+
     # Metadata
 
     metadata_profile = {  # type: ignore
@@ -528,12 +671,15 @@ class phone_number_format_error(Check):
 class web_link_format_error(Check):
     code = "web-link-format-error"
     Errors = [WebLinkFormatError]
+    # Looks at one cell at a time, see sharding.py
+    column_local = True
 
     def __init__(self, descriptor=None):
         super().__init__(descriptor)
         self.__checklabels = []
 
         # Append any new labels from the config file
+        cfg_dict = field_config()
         if 'WEB_LINK_FORMAT_ERROR' in cfg_dict:
             for new_label in cfg_dict['WEB_LINK_FORMAT_ERROR']:
                 if new_label.strip() not in self.__checklabels:
@@ -567,6 +713,7 @@ class geolocation_format_error(Check):
         self.__checklabels = []
 
         # Append any new labels from the config file
+        cfg_dict = field_config()
         if 'GEOLOCATION_FORMAT_ERROR' in cfg_dict:
             for new_label in cfg_dict['GEOLOCATION_FORMAT_ERROR']:
                 if new_label.strip() not in self.__checklabels:
@@ -688,6 +835,7 @@ class log_date_match_error(Check):
         self.__checklabels = []
 
         # Append any new labels from the config file
+        cfg_dict = field_config()
         if 'LOG_DATE_MATCH_ERROR' in cfg_dict:
             for new_label in cfg_dict['LOG_DATE_MATCH_ERROR']:
                 if new_label.strip() not in self.__checklabels:
@@ -839,12 +987,15 @@ This class to check  email format.
 class valid_email_in_cell(Check):
     code = "valid-email-in-cell"
     Errors = [ValidEmailInCell]
+    # Looks at one cell at a time, see sharding.py
+    column_local = True
 
     def __init__(self, descriptor=None):
         super().__init__(descriptor)
         self.__checklabels = []
 
         # Append any new labels from the config file
+        cfg_dict = field_config()
         if 'VALID_EMAIL_IN_CELL' in cfg_dict:
             for new_label in cfg_dict['VALID_EMAIL_IN_CELL']:
                 if new_label.strip() not in self.__checklabels:
@@ -896,12 +1047,15 @@ This class to check  Date format.
 class valid_date_in_cell(Check):
     code = "valid-date-in-cell"
     Errors = [ValidDateInCell]
+    # Looks at one cell at a time, see sharding.py
+    column_local = True
 
     def __init__(self, descriptor=None):
         super().__init__(descriptor)
         self.__checklabels = []
 
         # Append any new labels from the config file
+        cfg_dict = field_config()
         if 'VALID_DATE_IN_CELL' in cfg_dict:
             for new_label in cfg_dict['VALID_DATE_IN_CELL']:
                 if new_label.strip() not in self.__checklabels:
@@ -940,35 +1094,40 @@ This class to check  Negative Value format.
 class valid_negative_value_in_cell(Check):
     code = "valid-negative-value-in-cell"
     Errors = [ValidNegativeValueInCell]
+    # Looks at one cell at a time, see sharding.py
+    column_local = True
 
     def __init__(self, descriptor=None):
         super().__init__(descriptor)
         self.__checklabels = []
 
         # Append any new labels from the config file
+        cfg_dict = field_config()
         if 'VALID_NEGATIVE_VALUE_IN_CELL' in cfg_dict:
             for new_label in cfg_dict['VALID_NEGATIVE_VALUE_IN_CELL']:
                 if new_label.strip() not in self.__checklabels:
                     self.__checklabels.append(new_label.strip().upper())
     
+        # Words and signs written instead of a minus sign
+        self.__keywords = keyword_scanner(("MINUS", "SUB", "MINU", "("))
+        self.__fields = []
+
     def validate_start(self):
         # Check if config file has loaded at least one keys
         if not self.__checklabels:
             note = f"Configuration does not follow VALID_NEGATIVE_VALUE_IN_CELL check. Must add at least one field name to check."
             yield errors.CheckError(note=note)
+        # Match the configured labels once instead of on every row
+        self.__fields = [
+            field for field in self.resource.schema.field_names
+            if field.upper() in self.__checklabels
+        ]
 
     def validate_row(self, row):
-        for field, value in row.items():
-            if field.upper() in self.__checklabels:
-                isError = False
-                if value.upper().find("MINUS") != -1: # find String contain String "MINUS" in cell
-                    isError = True
-                if (not isError) and (value.upper().find("SUB") != -1): # find String contain String "SUB" in cell
-                    isError = True
-                if (not isError) and (value.upper().find("MINU") != -1):# find String contain String "Minus" in cell
-                    isError = True
-                if (not isError) and (value.upper().find("(") != -1):# find String contain String "(" in cell
-                    isError = True
+        for field in self.__fields:
+            value = row[field]
+            if value is not None:
+                isError = self.__keywords.search(value) is not None # one pass for all the keywords
                 if isError:# If have error, we will set message into Note for Frictionless print into report
                     note = f"Type error in the cell value: \"{value}\" is not valid in Negative Value"
                     yield ValidNegativeValueInCell.from_row(
@@ -987,29 +1146,43 @@ This class to check  Name Field format.
 class valid_namefield_value_in_cell(Check):
     code = "valid_namefield_value_in_cell"
     Errors = [ValidNamefieldValueInCell]
+    # Looks at one cell at a time, see sharding.py
+    column_local = True
 
     def __init__(self, descriptor=None):
         super().__init__(descriptor)
-        self.__memory = {}
+        self.__fields = []
+        self.__field_names = set()
+
+    def validate_start(self):
+        # Only run on fields with NAME in their name, found once per file
+        self.__fields = keyword_scanner(("NAME",)).matching_fields(self.resource.schema.field_names)
+        self.__field_names = {fieldName for _, fieldName in self.__fields}
+        yield from []
 
     def validate_row(self, row):
-        for fieldPosition, field in enumerate(row):
-            fieldName = str(row.field_names[fieldPosition])
-            if fieldName.upper().find("NAME") != -1:
-                cell = str(row[fieldName])
-                # Split the string and get all words in a list
-                list_of_words = cell.split()
-                isError = False
-                for elem in list_of_words:
-                    # capitalize first letter of each word and add to a string
-                    tmp = elem.strip().capitalize()
-                    if tmp != elem: # compare Origin word and capitalize word
-                        isError = True # If it is not equal, it mean Error requirement 
-                if isError:# If have error, we will set message into Note for Frictionless print into report
-                    note = f"Type error in the cell value: {cell} is not valid Name Field"
-                    yield ValidNamefieldValueInCell.from_row(
-                        row, note=note, field_name=fieldName
-                    )
+        for fieldPosition, fieldName in self.__fields:
+            cell = str(row[fieldName])
+            # Split the string and get all words in a list
+            list_of_words = cell.split()
+            isError = False
+            for elem in list_of_words:
+                # capitalize first letter of each word and add to a string
+                tmp = elem.strip().capitalize()
+                if tmp != elem: # compare Origin word and capitalize word
+                    isError = True # If it is not equal, it mean Error requirement 
+            if isError:# If have error, we will set message into Note for Frictionless print into report
+                note = f"Type error in the cell value: {cell} is not valid Name Field"
+                yield ValidNamefieldValueInCell.from_row(
+                    row, note=note, field_name=fieldName
+                )
+
+    def fix(self, field_name, text):
+        # Only names written all in lower or all in upper case, john o'brien
+        # -> John O'Brien; McDonald or van der Berg are left as they are
+        if field_name not in self.__field_names or not (text.islower() or text.isupper()):
+            return text
+        return re.sub(r"[^\W\d_]+", lambda letters: letters.group(0).capitalize(), text)
 
     # Metadata
     metadata_profile = {  # type: ignore
@@ -1023,32 +1196,33 @@ This class to check  Address format.
 class valid_address_value_in_cell(Check):
     code = "valid-address-value-in-cell"
     Errors = [ValidAddressValueInCell]
+    # Looks at one cell at a time, see sharding.py
+    column_local = True
 
     def __init__(self, descriptor=None):
         super().__init__(descriptor)
-        self.__memory = {}
+        self.__fields = []
+
+    def validate_start(self):
+        # only run on field names containing ADDRESS, STATE, ZIP or CITY, found once per file
+        scanner = keyword_scanner(("ADDRESS", "STATE", "ZIP", "CITY"))
+        self.__fields = scanner.matching_fields(self.resource.schema.field_names)
+        yield from []
 
     def validate_row(self, row):
-        for fieldPosition, field in enumerate(row):
-            fieldName = str(row.field_names[fieldPosition])
-            if (
-                (fieldName.upper().find("ADDRESS") != -1) # only run on field name is ADDRESS
-                or (fieldName.upper().find("STATE") != -1) # only run on field name is STATE
-                or (fieldName.upper().find("ZIP") != -1) # only run on field name is ZIP
-                or (fieldName.upper().find("CITY") != -1) # only run on field name is CITY
-            ):
-                cell = str(row[fieldName])
-                isError = False
-                #City State and zip codes should be separated out of the address and stored in separate columns named as CITY, STATE, and ZIPCODE
-                if cell.upper().find(",") != -1:  # 'find comma to detect error, 
-                    isError = True
-                if isError:# If have error, we will set message into Note for Frictionless print into report
-                    note = (
-                        f"Type error in the cell value: \"{cell}\", City State and zip codes should be separated out of the address and stored in separate columns named as CITY, STATE, and ZIPCODE"
-                    )
-                    yield ValidAddressValueInCell.from_row(
-                        row, note=note, field_name=fieldName
-                    )
+        for fieldPosition, fieldName in self.__fields:
+            cell = str(row[fieldName])
+            isError = False
+            #City State and zip codes should be separated out of the address and stored in separate columns named as CITY, STATE, and ZIPCODE
+            if "," in cell:  # 'find comma to detect error, 
+                isError = True
+            if isError:# If have error, we will set message into Note for Frictionless print into report
+                note = (
+                    f"Type error in the cell value: \"{cell}\", City State and zip codes should be separated out of the address and stored in separate columns named as CITY, STATE, and ZIPCODE"
+                )
+                yield ValidAddressValueInCell.from_row(
+                    row, note=note, field_name=fieldName
+                )
 
     # Metadata
     metadata_profile = {  # type: ignore
@@ -1056,35 +1230,42 @@ class valid_address_value_in_cell(Check):
         "properties": {},
     }
 
+HTML_TAG = re.compile("<[^/>][^>]*>")
+
 """
 This class to check  Text Field format.
 """
 class valid_text_field_in_cell(Check):
     code = "valid-text-field-in-cell"
     Errors = [ValidTextFieldInCell]
+    # Looks at one cell at a time, see sharding.py
+    column_local = True
 
     def __init__(self, descriptor=None):
         super().__init__(descriptor)
+        self.__fields = []
+
+    def validate_start(self):
+        # ignore number fields, we only run on String cell. The field names
+        # are classified once per file
+        numeric_words = ("AMOUNT", "VALUE", "AMT", "SALARY")
+        self.__fields = [
+            fieldName for fieldName in self.resource.schema.field_names
+            if not all(fieldName.upper().find(word) != -1 for word in numeric_words)
+        ]
+        yield from []
 
     def validate_row(self, row):
-        rowPosition = row.row_position
-        for fieldPosition, field in enumerate(row):
-            fieldName = str(row.field_names[fieldPosition])
-            if (
-                (fieldName.upper().find("AMOUNT") == -1)
-                or (fieldName.upper().find("VALUE") == -1)
-                or (fieldName.upper().find("AMT") == -1)
-                or (fieldName.upper().find("SALARY") == -1)
-            ):  # ignore number fields, we only run on String cell
-                cell = str(row[fieldName])
-                isError = False
-                if re.search("<[^/>][^>]*>", cell) != None: # Find html tag in cell String
-                    isError = True
-                if isError:# If have error, we will set message into Note for Frictionless print into report
-                    note = f"Type error in the cell value: {cell} is not a valid Text Field Value"
-                    yield ValidTextFieldInCell.from_row(
-                        row, note=note, field_name=fieldName
-                    )
+        for fieldName in self.__fields:
+            cell = str(row[fieldName])
+            isError = False
+            if HTML_TAG.search(cell) != None: # Find html tag in cell String
+                isError = True
+            if isError:# If have error, we will set message into Note for Frictionless print into report
+                note = f"Type error in the cell value: {cell} is not a valid Text Field Value"
+                yield ValidTextFieldInCell.from_row(
+                    row, note=note, field_name=fieldName
+                )
 
     # Metadata
     metadata_profile = {  # type: ignore
@@ -1098,6 +1279,8 @@ This class to check Data Completeness format.
 class valid_data_completeness(Check):
     code = "valid-data-completeness"
     Errors = [ValidDataCompleteness]
+    # Looks at one cell at a time, see sharding.py
+    column_local = True
 
     def __init__(self, descriptor=None):
         super().__init__(descriptor)
@@ -1126,10 +1309,12 @@ This class to check Summerized Data format.
 class valid_summerized_data(Check):
     code = "valid-summerized-data"
     Errors = [ValidSummerizedData]
+    # Looks at one cell at a time, see sharding.py
+    column_local = True
 
     def __init__(self, descriptor=None):
         super().__init__(descriptor)
-        self.__memory = {}
+        self.__keywords = keyword_scanner(("TOT", "SUM"))
 
     def validate_row(self, row):
         rowPosition = row.row_position
@@ -1137,7 +1322,7 @@ class valid_summerized_data(Check):
             fieldName = str(row.field_names[fieldPosition])
             cell = str(row[fieldName])
             isError = False
-            if (cell.upper().find("TOT") >= 0) or (cell.upper().find("SUM") >= 0): # only run on field name contains string "TOT" = total and "SUM"
+            if self.__keywords.search(cell) is not None: # only run on field name contains string "TOT" = total and "SUM"
                 isError = True
             if isError:# If have error, we will set message into Note for Frictionless print into report
                 note = f"Cell containing \"{cell}\" appears to summarize values from previous fields."
@@ -1149,6 +1334,143 @@ class valid_summerized_data(Check):
         "properties": {},
     }
 
+class field_rules(Check):
+    """
+    Declarative field rules from settings/rules.cfg
+
+    Runs the regex, enum, lookup, range, length and cross-field rules configured
+    for each column. The rules are compiled once per file into plain functions
+    and run on the cell text as it appears in the file.
+    """
+    code = "field-rule-error"
+    Errors = [FieldRuleError]
+
+    def __init__(self, descriptor=None):
+        super().__init__(descriptor)
+        config = current_config()
+        self.__rules = config.rules
+        self.__rules_error = config.rules_error
+        self.__compiled = []
+        self.__skipped = []
+
+    def validate_start(self):
+        if self.__rules_error:
+            yield errors.CheckError(note=self.__rules_error)
+            return
+        try:
+            self.__compiled = compile_rules(self.__rules, self.resource.schema.field_names,
+                                            skipped=self.__skipped)
+        except RuleError as exception:
+            yield errors.CheckError(note=str(exception))
+            return
+        if not self.__compiled:
+            for note in self.__skipped:
+                yield errors.CheckError(note=note)
+            note = f"Field rules check requires rules in settings/rules.cfg for at least one column of the data."
+            yield errors.CheckError(note=note)
+
+    def validate_row(self, row):
+        cells = row.cells
+        cell_count = len(cells)
+        for position, field_name, tests in self.__compiled:
+            value = cells[position] if position < cell_count else None
+            # Blank cells are left to the data completeness check
+            if value is None or value == "":
+                continue
+            if not isinstance(value, str):
+                value = str(value)
+            for test in tests:
+                note = test(value, cells)
+                if note:
+                    yield FieldRuleError.from_row(
+                        row, note=f"\"{value}\" {note}", field_name=field_name
+                    )
+
+    def validate_end(self):
+        # Rules left out for a column the table lacks, the others ran (a
+        # check error from validate_start would stop them all)
+        for note in self.__skipped if self.__compiled else []:
+            yield errors.CheckError(note=note)
+
+    # Metadata
+    metadata_profile = {  # type: ignore
+        "type": "object",
+        "properties": {},
+    }
+
+class referential_integrity(Check):
+    """
+    Foreign key check against reference datasets
+
+    Each REFERENTIAL_INTEGRITY item in settings/fields.cfg reads
+    COLUMN:FILE or COLUMN:FILE:REFERENCE COLUMN, e.g. NEIGHBORHOOD:NEIGHBORHOODS.CSV.
+    Every non blank cell of COLUMN must be a value of the reference column
+    (the first one by default) of FILE in settings/lookups. The reference
+    file is indexed on disk the first time it is used and memory-mapped by
+    later runs, and the answer for each distinct cell value is remembered.
+    """
+    code = "referential-integrity-error"
+    Errors = [ReferentialIntegrityError]
+    # Looks at one cell at a time, see sharding.py
+    column_local = True
+
+    def __init__(self, descriptor=None):
+        super().__init__(descriptor)
+        self.__references = [
+            item.strip() for item in field_config().get('REFERENTIAL_INTEGRITY', []) if item.strip()
+        ]
+        self.__columns = []
+
+    def validate_start(self):
+        field_names = self.resource.schema.field_names
+        positions = {name.upper(): index for index, name in enumerate(field_names)}
+        for item in self.__references:
+            parts = [part.strip() for part in item.split(':')]
+            if len(parts) not in (2, 3) or not all(parts):
+                note = f"fields.cfg REFERENTIAL_INTEGRITY item \"{item}\" should read COLUMN:FILE or COLUMN:FILE:REFERENCE COLUMN"
+                yield errors.CheckError(note=note)
+                return
+            position = positions.get(parts[0].upper())
+            if position is None:
+                continue
+            try:
+                index = reference_indexes.get(parts[1], parts[2] if len(parts) == 3 else None)
+            except (OSError, ValueError) as exception:
+                yield errors.CheckError(note=f"referential integrity check: {exception}")
+                return
+            self.__columns.append((position, field_names[position], index.meta['source'], index, {}))
+        if not self.__columns:
+            note = f"Referential integrity check requires a REFERENTIAL_INTEGRITY column of the data in settings/fields.cfg:{self.__references}"
+            yield errors.CheckError(note=note)
+
+    def validate_row(self, row):
+        cells = row.cells
+        cell_count = len(cells)
+        for position, field_name, source, index, memo in self.__columns:
+            value = cells[position] if position < cell_count else None
+            # Blank cells are left to the data completeness check
+            if value is None or value == "":
+                continue
+            if not isinstance(value, str):
+                value = str(value)
+            value = value.strip()
+            found = memo.get(value)
+            if found is None:
+                found = value in index
+                if len(memo) < REFERENCE_MEMO_SIZE:
+                    memo[value] = found
+            if not found:
+                note = f"\"{value}\" is not a value of the reference dataset {source}"
+                yield ReferentialIntegrityError.from_row(
+                    row, note=note, field_name=field_name
+                )
+
+    # Metadata
+    metadata_profile = {  # type: ignore
+        "type": "object",
+        "properties": {},
+    }
+
 # Function to check Blank value
 def isNotBlank(myString):
     if myString and myString.strip():
@@ -192,4 +192,22 @@ class ValidSummerizedData(errors.CellError):
     template = (
         "Row at position {rowPosition}: {note}"
     )
-    description = 'Summarized Data (total, sums, roll-ups) should not be included in datasets.'
\ No newline at end of file
+    description = 'Summarized Data (total, sums, roll-ups) should not be included in datasets.'
+
+class FieldRuleError(errors.CellError):
+    code = "field-rule-error"
+    name = "Field Rule Error"
+    tags = ["#table", "#row", "#cell"]
+    template = (
+        "Row at position {rowPosition} and field at position {fieldPosition}: {note}"
+    )
+    description = 'Cell does not follow a rule configured for its column in settings/rules.cfg.'
+
+class ReferentialIntegrityError(errors.CellError):
+    code = "referential-integrity-error"
+    name = "Referential Integrity Error"
+    tags = ["#table", "#row", "#cell"]
+    template = (
+        "Row at position {rowPosition} and field at position {fieldPosition}: {note}"
+    )
+    description = 'Cell value is not found in the reference dataset configured for its column in settings/fields.cfg.'
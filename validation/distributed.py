@@ -0,0 +1,704 @@
+import codecs
+import hashlib
+import io
+import os
+import pickle
+import shutil
+import socket
+import time
+from frictionless import Detector, Report, ReportTask, Resource, helpers
+from frictionless.errors import TaskError
+from frictionless.exception import FrictionlessException
+from settings.store import ConfigSnapshot, config_store
+from . import custom_checks
+from .compression import resource_options
+from .error_records import ErrorBuffer
+from .runner import DEFAULT_MAX_ERRORS, Limits, validate_limited
+from .storage import DATA_DIR, new_job_id
+from .validator import RawTextDetector, check_select, needed_types
+
+# Shared by the coordinator and every worker, e.g. an NFS mount on several hosts
+DEFAULT_QUEUE_DIR = os.environ.get('VALIDATION_QUEUE_DIR', os.path.join(DATA_DIR, 'queue'))
+
+# Bytes of the file validated by one task
+DEFAULT_TASK_BYTES = int(os.environ.get('VALIDATION_TASK_MB', 64)) * 1024 * 1024
+
+# A task whose worker has not been heard of for this long goes to another worker
+LEASE_SECONDS = int(os.environ.get('VALIDATION_LEASE_SECONDS', 300))
+HEARTBEAT_SECONDS = 10
+
+# Tries of a task whose workers keep dying before it is reported failed
+MAX_ATTEMPTS = 3
+
+SCAN_BLOCK = 1024 * 1024
+
+
+class TaskQueue:
+    """
+    Queue of row range tasks in a shared directory, no broker needed.
+
+    A task is a file that moves from pending/ to running/ to done/, every
+    move an atomic rename, so a task is claimed by exactly one worker even
+    across hosts sharing the directory over NFS. A running task file is
+    touched as the worker's heartbeat. Results are pickled to results/.
+    """
+
+    def __init__(self, directory=DEFAULT_QUEUE_DIR):
+        self.directory = directory
+        for name in ('jobs', 'pending', 'running', 'done', 'results'):
+            os.makedirs(os.path.join(directory, name), exist_ok=True)
+        self.__jobs = {}
+
+    def add_job(self, job_id, job):
+        path = os.path.join(self.directory, 'jobs', job_id)
+        os.makedirs(path, exist_ok=True)
+        self.__write(os.path.join(path, 'job.pickle'), job)
+
+    def job(self, job_id):
+        job = self.__jobs.get(job_id)
+        if job is None:
+            with open(os.path.join(self.directory, 'jobs', job_id, 'job.pickle'), 'rb') as infile:
+                job = self.__jobs[job_id] = pickle.load(infile)
+        return job
+
+    def put(self, task):
+        self.__write(os.path.join(self.directory, 'pending', task_name(task)), task)
+
+    def claim(self):
+        """(claim, task) of the oldest pending task, or None."""
+        for name in sorted(os.listdir(os.path.join(self.directory, 'pending'))):
+            if name.startswith('.'):
+                # Being reseeded
+                continue
+            claim = f'{name}.{new_job_id()}'
+            try:
+                os.rename(self.__path('pending', name), self.__path('running', claim))
+            except FileNotFoundError:
+                # Another worker was faster
+                continue
+            with open(self.__path('running', claim), 'rb') as infile:
+                return claim, pickle.load(infile)
+        return None
+
+    def heartbeat(self, claim):
+        """Mark a running task alive, False once it was taken back or its job cancelled."""
+        if os.path.exists(os.path.join(self.directory, 'jobs', _job_id(claim), 'cancelled')):
+            return False
+        try:
+            os.utime(self.__path('running', claim))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def complete(self, claim, result):
+        result_path = self.__path('results', claim)
+        self.__write(result_path, result)
+        try:
+            os.rename(self.__path('running', claim), self.__path('done', claim))
+        except FileNotFoundError:
+            # The task was given to another worker meanwhile
+            os.remove(result_path)
+
+    def done(self, job_id):
+        """(task, result) of the finished tasks of job_id, each returned once."""
+        finished = []
+        for claim in os.listdir(os.path.join(self.directory, 'done')):
+            if _job_id(claim) != job_id:
+                continue
+            with open(self.__path('done', claim), 'rb') as infile:
+                task = pickle.load(infile)
+            with open(self.__path('results', claim), 'rb') as infile:
+                result = pickle.load(infile)
+            os.remove(self.__path('done', claim))
+            os.remove(self.__path('results', claim))
+            finished.append((task, result))
+        return finished
+
+    def reseed(self, task, seed):
+        """Replace the seed of a task still pending, False if it was claimed."""
+        name = task_name(task)
+        moving = self.__path('pending', '.reseed-' + name)
+        try:
+            os.rename(self.__path('pending', name), moving)
+        except FileNotFoundError:
+            return False
+        with open(moving, 'rb') as infile:
+            task = pickle.load(infile)
+        self.put(dict(task, seed=seed))
+        os.remove(moving)
+        return True
+
+    def reclaim(self, older_than):
+        """Give back running tasks without a heartbeat since older_than."""
+        for claim in os.listdir(os.path.join(self.directory, 'running')):
+            path = self.__path('running', claim)
+            moving = self.__path('running', '.reclaim-' + claim)
+            try:
+                if claim.startswith('.') or os.path.getmtime(path) >= older_than:
+                    continue
+                os.rename(path, moving)
+            except FileNotFoundError:
+                continue
+            with open(moving, 'rb') as infile:
+                task = pickle.load(infile)
+            task = dict(task, attempt=task['attempt'] + 1)
+            if task['attempt'] < MAX_ATTEMPTS:
+                self.put(task)
+            else:
+                note = f'task of rows from {task["row_position"]} failed: its workers stopped responding'
+                self.__write(self.__path('results', claim), {'failed': [TaskError(note=note)]})
+                self.__write(self.__path('done', claim), task)
+            os.remove(moving)
+
+    def cancel(self, job_id):
+        """Stop the running tasks of job_id and drop the pending ones."""
+        with open(os.path.join(self.directory, 'jobs', job_id, 'cancelled'), 'w'):
+            pass
+        for name in os.listdir(os.path.join(self.directory, 'pending')):
+            if _job_id(name) == job_id:
+                try:
+                    os.remove(self.__path('pending', name))
+                except FileNotFoundError:
+                    pass
+
+    def remove_job(self, job_id):
+        for folder in ('pending', 'running', 'done', 'results'):
+            for name in os.listdir(os.path.join(self.directory, folder)):
+                if _job_id(name) == job_id:
+                    try:
+                        os.remove(self.__path(folder, name))
+                    except FileNotFoundError:
+                        pass
+        shutil.rmtree(os.path.join(self.directory, 'jobs', job_id), ignore_errors=True)
+        self.__jobs.pop(job_id, None)
+
+    def prune(self, older_than):
+        """Drop jobs submitted before older_than, e.g. of a coordinator that died."""
+        for job_id in os.listdir(os.path.join(self.directory, 'jobs')):
+            try:
+                if os.path.getmtime(os.path.join(self.directory, 'jobs', job_id)) < older_than:
+                    self.cancel(job_id)
+                    self.remove_job(job_id)
+            except FileNotFoundError:
+                continue
+
+    def __path(self, folder, name):
+        return os.path.join(self.directory, folder, name)
+
+    def __write(self, path, value):
+        # Written aside and renamed, readers never see half a file
+        temp_path = os.path.join(self.directory, '.incoming-' + new_job_id())
+        with open(temp_path, 'wb') as outfile:
+            pickle.dump(value, outfile, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, path)
+
+
+class Coordinator:
+    """
+    Splits files into row range tasks and merges their results.
+
+    submit() scans a CSV for the ends of its records and queues one task
+    per DEFAULT_TASK_BYTES, with the schema inferred from the head of the
+    file like a single run. wait() collects the results of a job in file
+    order into one report.
+
+    Checks with a state carried from row to row (the consistency checks)
+    define state(), restore_state() and merge_state(). A task starts from
+    the state of the tasks before it known when it is claimed. Once those
+    tasks are all done, a task that started from another state than theirs
+    is run again, so the report is the one a single run would write.
+    """
+
+    def __init__(self, queue=None, task_bytes=DEFAULT_TASK_BYTES):
+        self.queue = queue or TaskQueue()
+        self.task_bytes = task_bytes
+        self.__jobs = {}
+
+    def submit(self, filepath, config=None, raw_text=False, max_errors=DEFAULT_MAX_ERRORS):
+        """Queue the validation of filepath, returns the job id."""
+        job, ranges = plan_job(filepath, config, raw_text, max_errors, self.task_bytes)
+        job_id = new_job_id()
+        self.queue.add_job(job_id, job)
+        order = f'{time.time_ns():020d}'
+        for number, (start, stop, row_position) in enumerate(ranges):
+            self.queue.put({
+                'order': order, 'job_id': job_id, 'number': number, 'start': start, 'stop': stop,
+                'row_position': row_position, 'attempt': 0, 'seed': {},
+            })
+        self.__jobs[job_id] = {
+            'job': job, 'order': order, 'ranges': ranges, 'results': {}, 'finished': {},
+            'prefix': 0, 'state': {}, 'seeded': {}, 'errors': 0,
+        }
+        return job_id
+
+    def poll(self):
+        """Collect finished tasks of every submitted job and reseed the pending ones."""
+        self.queue.reclaim(time.time() - LEASE_SECONDS)
+        for job_id, entry in self.__jobs.items():
+            for task, result in self.queue.done(job_id):
+                entry['finished'][task['number']] = (task, result)
+            self.__advance(job_id, entry)
+
+    def wait(self, job_id, limits=None, interval=0.5):
+        """Report of job_id once its tasks are done, or when limits stop it."""
+        timer = helpers.Timer()
+        started = time.monotonic()
+        entry = self.__jobs[job_id]
+        note = None
+        try:
+            while True:
+                self.poll()
+                if entry['prefix'] == len(entry['ranges']) or entry.get('failed'):
+                    break
+                # The first max_errors errors are known once the tasks before hold them
+                if entry['job']['max_errors'] and entry['errors'] >= entry['job']['max_errors']:
+                    break
+                note = limits.exceeded(started) if limits is not None else None
+                if note:
+                    break
+                time.sleep(interval)
+        finally:
+            self.queue.cancel(job_id)
+            self.queue.remove_job(job_id)
+            del self.__jobs[job_id]
+        results = [entry['results'][number] for number in range(entry['prefix'])]
+        return merge_report(entry['job'], entry['ranges'], results, note, entry.get('failed'), timer)
+
+    # Internal
+
+    def __advance(self, job_id, entry):
+        # Results are taken in file order, the state before each task is exact
+        while entry['prefix'] in entry['finished']:
+            number = entry['prefix']
+            task, result = entry['finished'].pop(number)
+            if 'failed' in result:
+                entry['failed'] = result['failed']
+                return
+            if task['seed'] != entry['state']:
+                self.queue.put(dict(task, seed=entry['state']))
+                return
+            entry['results'][number] = result
+            entry['errors'] += len(kept_errors(result, number))
+            entry['state'] = merge_states(entry['state'], result['states'])
+            entry['prefix'] += 1
+        # Pending tasks start from the latest known state
+        for number in range(entry['prefix'], len(entry['ranges'])):
+            if number in entry['finished'] or entry['seeded'].get(number, {}) == entry['state']:
+                continue
+            # A task already claimed is run again if it has to
+            self.queue.reseed({'order': entry['order'], 'job_id': job_id, 'number': number}, entry['state'])
+            entry['seeded'][number] = entry['state']
+
+
+def task_name(task):
+    # Sorted by submission, then file order
+    return f"{task['order']}-{task['job_id']}-{task['number']:06d}"
+
+
+def merge_states(earlier, later):
+    """State of the stateful checks after two consecutive row ranges."""
+    merged = dict(earlier)
+    for name, state in later.items():
+        if name in merged:
+            merged[name] = getattr(custom_checks, name).merge_state(merged[name], state)
+        else:
+            merged[name] = state
+    return {name: state for name, state in merged.items() if state}
+
+
+def plan_job(filepath, config=None, raw_text=False, max_errors=DEFAULT_MAX_ERRORS,
+             task_bytes=DEFAULT_TASK_BYTES):
+    """
+    Job of validating filepath and its (start, stop, row position) ranges.
+
+    The schema is inferred from the head of the file like a single run.
+    Files that cannot be cut (compressed, other encodings...) are one range
+    of the whole file, (None, None, 2).
+    """
+    filepath = os.path.abspath(filepath)
+    config = config or config_store.current()
+    options = resource_options(filepath)
+    job = {
+        'filepath': filepath,
+        'options': options,
+        'config_version': config.version,
+        'config_files': config.files,
+        'max_errors': max_errors,
+        'schema': None,
+        'descriptor': None,
+        'header': None,
+        'stats': {},
+    }
+    ranges = None
+    checks = check_select(config)
+    detector = RawTextDetector(needed_types(checks)) if raw_text else Detector()
+    try:
+        with Resource(filepath, detector=detector, **options) as resource:
+            job['descriptor'] = resource.to_dict()
+            job['schema'] = resource.schema.to_dict()
+            dialect = resource.dialect
+            if _splittable(resource, options):
+                # The stats of a single run, its hash from the scan
+                hasher = hashlib.new(resource.hashing)
+                job['header'], ranges = split_ranges(
+                    filepath, task_bytes, dialect.quote_char.encode(), dialect.delimiter.encode(), hasher
+                )
+                job['stats'] = {
+                    'hash': hasher.hexdigest(), 'bytes': os.path.getsize(filepath),
+                    'fields': len(resource.schema.fields),
+                }
+                job['read_options'] = {
+                    'format': 'csv', 'encoding': resource.encoding, 'dialect': dialect.to_dict()
+                }
+    except FrictionlessException:
+        # The run of the range reports why the file cannot be read
+        pass
+    return job, ranges or [(None, None, 2)]
+
+
+def validate_range(job, start, stop, row_position, seed, limits):
+    """
+    Result of validating one range of a job, from the seed state of the
+    stateful checks: its errors, rows and the state after it, or the errors
+    of a run that failed under 'failed'.
+    """
+    config = ConfigSnapshot(job['config_version'], job['config_files'])
+    checks = check_select(config)
+    for check in checks:
+        name = type(check).__name__
+        if name in seed:
+            check.restore_state(seed[name])
+
+    options = dict(job['options'])
+    if job['schema'] is not None:
+        options['schema'] = job['schema']
+    if start is None:
+        report = validate_limited(job['filepath'], checks=checks, limits=limits, **options)
+    else:
+        source = io.BufferedReader(_RangeReader(job['filepath'], job['header'], start, stop))
+        options.update(job['read_options'])
+        report = validate_limited(source, checks=checks, limits=limits, row_offset=row_position - 2, **options)
+    if not report.tasks:
+        return {'failed': list(report.errors)}
+    return {
+        'errors': report.tasks[0].errors,
+        'partial': report.tasks[0].partial,
+        'rows': report.tasks[0].resource.stats.get('rows') or 0,
+        'stats': dict(report.tasks[0].resource.stats),
+        'states': {
+            type(check).__name__: check.state()
+            for check in checks if hasattr(check, 'state') and check.state()
+        },
+    }
+
+
+def kept_errors(result, number):
+    """Errors of the result of range number that go in the merged report."""
+    # Header and check errors come from the first range, the stops are
+    # decided over the whole file
+    return result['errors'].subset(lambda code: code != 'task-error', rows=bool(number))
+
+
+def merge_report(job, ranges, results, note=None, failed=None, timer=None):
+    """
+    Report of the results of the first ranges of a job, in file order, the
+    one a single run would write. note names the limit that stopped the run
+    before the other ranges.
+    """
+    timer = timer or helpers.Timer()
+    if failed:
+        return Report(time=timer.time, errors=failed, tasks=[])
+    limit = job['max_errors']
+    buffers = []
+    stops = []
+    rows = 0
+    for number, result in enumerate(results):
+        rows += result['rows']
+        buffers.append(kept_errors(result, number))
+        # A task stopped by another limit than max_errors ends the report
+        if result['partial']:
+            stops = [error for error in result['errors']
+                     if error.code == 'task-error' and not error['note'].startswith('max_errors')]
+            if stops:
+                break
+    errors = ErrorBuffer.merged(buffers, limit, sort=False)
+    partial = bool(note or stops)
+    if limit and len(errors) >= limit:
+        row = errors[-1].get('rowPosition') or 1
+        errors.add(TaskError(note=f'max_errors limit reached: stopped at {limit} errors (row {row})'))
+        partial = True
+    elif stops:
+        for error in stops:
+            errors.add(error)
+    elif note:
+        row = ranges[len(results)][2] - 1 if len(results) < len(ranges) else rows + 1
+        errors.add(TaskError(note=f'{note} (row {row})'))
+
+    descriptor = dict(job['descriptor'] or {'path': job['filepath']})
+    if len(ranges) == 1 and results:
+        descriptor['stats'] = results[0]['stats']
+    elif partial:
+        # Like a single run stopped midway, which never reads to the end
+        descriptor['stats'] = dict(job['stats'], hash='', bytes=0, rows=0)
+    else:
+        descriptor['stats'] = dict(job['stats'], rows=rows)
+    return Report(
+        time=timer.time,
+        errors=[],
+        tasks=[
+            ReportTask(
+                time=timer.time,
+                scope=errors.scope,
+                partial=partial,
+                errors=errors,
+                resource=Resource(descriptor, trusted=True),
+            )
+        ],
+    )
+
+
+def run_task(queue, claim, task, worker=None):
+    """Validate the rows of one task and store its result."""
+    job = queue.job(task['job_id'])
+    heartbeat = _Heartbeat(queue, claim)
+    limits = Limits(max_rows=None, max_seconds=None, max_errors=job['max_errors'],
+                    cancelled=heartbeat.lost)
+    try:
+        result = validate_range(job, task['start'], task['stop'], task['row_position'], task['seed'], limits)
+    except Exception as exception:
+        note = f'task of rows from {task["row_position"]} failed on {worker}: {exception!r}'
+        result = {'failed': [TaskError(note=note)]}
+    result['worker'] = worker
+    queue.complete(claim, result)
+
+
+def work(queue=None, worker=None, interval=1.0, idle_exit=None):
+    """
+    Run queued tasks until no task came for idle_exit seconds (never with None).
+
+    Any number of these run on any number of hosts sharing the queue
+    directory.
+    """
+    queue = queue or TaskQueue()
+    worker = worker or f'{socket.gethostname()}:{os.getpid()}'
+    idle_since = time.monotonic()
+    while True:
+        claimed = queue.claim()
+        if claimed is None:
+            if idle_exit is not None and time.monotonic() - idle_since > idle_exit:
+                return
+            time.sleep(interval)
+            continue
+        run_task(queue, *claimed, worker=worker)
+        idle_since = time.monotonic()
+
+
+def split_ranges(filepath, task_bytes, quote=b'"', delimiter=b',', hasher=None):
+    """
+    Header and (start, stop, row position) byte ranges of about task_bytes.
+
+    Ranges are cut at the end of a record: a newline in a quoted cell does
+    not end one, the cells are scanned like the csv module reads them
+    (doubled quotes, no escape character). hasher, if given, is updated
+    with every byte of the file.
+    """
+    header = None
+    ranges = []
+    start = start_row = None
+    next_cut = 0
+    records = 0
+    quoted = False
+    offset = 0
+    carry = b''
+
+    def cut(end, count):
+        # A record ending at byte end, the count-th of the file
+        nonlocal header, start, start_row, next_cut
+        if header is None:
+            header = end
+        else:
+            ranges.append((start, end, start_row))
+        start, start_row, next_cut = end, count + 1, end + task_bytes
+
+    with open(filepath, 'rb') as infile:
+        while True:
+            data = infile.read(SCAN_BLOCK)
+            if hasher is not None:
+                hasher.update(data)
+            block = carry + data
+            # Whole lines only, the rest waits for the next block
+            last = block.rfind(b'\n') if data else len(block) - 1
+            carry, block = block[last + 1:], block[:last + 1]
+            if not quoted and quote not in block:
+                # Every newline ends a record, only the cuts are looked up
+                while next_cut - offset < len(block):
+                    index = block.find(b'\n', max(0, next_cut - offset))
+                    if index < 0:
+                        break
+                    cut(offset + index + 1, records + block.count(b'\n', 0, index + 1))
+                records += block.count(b'\n')
+            else:
+                position = 0
+                while position < len(block):
+                    index = block.find(b'\n', position)
+                    index = len(block) - 1 if index < 0 else index
+                    line = block[position:index + 1]
+                    if quoted or quote in line:
+                        quoted = _still_quoted(line, quoted, quote, delimiter)
+                    if not quoted:
+                        records += 1
+                        if offset + index + 1 >= next_cut:
+                            cut(offset + index + 1, records)
+                    position = index + 1
+            offset += len(block)
+            if not data:
+                break
+    if header is None:
+        return None, []
+    if start < offset:
+        ranges.append((start, offset, start_row))
+    with open(filepath, 'rb') as infile:
+        return infile.read(header), ranges
+
+
+def scan_records(filepath, start, quote=b'"', delimiter=b',', max_bytes=None):
+    """
+    (end, records) of the complete records from byte start on: the offset
+    right after the last one and their count. With max_bytes it stops at
+    the first record ending max_bytes or more past start.
+
+    A record is complete once its newline is written, a record still being
+    appended to the file is left for a later scan.
+    """
+    end = offset = start
+    records = 0
+    quoted = False
+    carry = b''
+    with open(filepath, 'rb') as infile:
+        infile.seek(start)
+        while True:
+            data = infile.read(SCAN_BLOCK)
+            if not data:
+                return end, records
+            block = carry + data
+            last = block.rfind(b'\n')
+            carry, block = block[last + 1:], block[:last + 1]
+            if not quoted and quote not in block:
+                if max_bytes is not None and offset + len(block) - start >= max_bytes:
+                    index = block.find(b'\n', max(0, start + max_bytes - offset - 1))
+                    return offset + index + 1, records + block.count(b'\n', 0, index + 1)
+                records += block.count(b'\n')
+                end = offset + len(block)
+            else:
+                position = 0
+                while position < len(block):
+                    index = block.find(b'\n', position)
+                    line = block[position:index + 1]
+                    if quoted or quote in line:
+                        quoted = _still_quoted(line, quoted, quote, delimiter)
+                    if not quoted:
+                        records += 1
+                        end = offset + index + 1
+                        if max_bytes is not None and end - start >= max_bytes:
+                            return end, records
+                    position = index + 1
+            offset += len(block)
+
+
+# Internal
+
+
+def _job_id(name):
+    return name.split('-')[1]
+
+
+def _splittable(resource, options):
+    # Plain CSV, an ASCII compatible encoding, one header row and csv quoting
+    dialect = resource.dialect
+    return (
+        not options
+        and resource.format == 'csv'
+        and resource.layout.header_rows == [1]
+        and not codecs.lookup(resource.encoding).name.startswith(('utf-16', 'utf-32'))
+        and dialect.double_quote
+        and not dialect.escape_char
+        and not dialect.skip_initial_space
+    )
+
+
+def _still_quoted(line, quoted, quote, delimiter):
+    # Whether the record goes on after line, a quote opens a quoted cell
+    # only at the start of a cell like in the csv module
+    position = 0
+    cell_start = not quoted
+    while position < len(line):
+        if quoted:
+            index = line.find(quote, position)
+            if index < 0:
+                return True
+            if line[index + 1:index + 2] == quote:
+                position = index + 2
+                continue
+            quoted, cell_start, position = False, False, index + 1
+        elif cell_start and line[position:position + 1] == quote:
+            quoted, position = True, position + 1
+        else:
+            index = line.find(delimiter, position)
+            if index < 0:
+                return False
+            cell_start, position = True, index + 1
+    return quoted
+
+
+class _Heartbeat:
+    # Polled by the run like a cancel flag, touches the task file meanwhile
+    def __init__(self, queue, claim):
+        self.queue = queue
+        self.claim = claim
+        self.beat = time.monotonic()
+
+    def lost(self):
+        if time.monotonic() - self.beat < HEARTBEAT_SECONDS:
+            return False
+        self.beat = time.monotonic()
+        return not self.queue.heartbeat(self.claim)
+
+
+class _RangeReader(io.RawIOBase):
+    # The header record followed by the bytes start:stop of the file
+    def __init__(self, path, header, start, stop):
+        self.name = path
+        self.__file = open(path, 'rb')
+        self.__header = header
+        self.__start = start
+        self.__size = len(header) + stop - start
+        self.__position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.__position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self.__position, io.SEEK_END: self.__size}[whence]
+        self.__position = min(max(0, base + offset), self.__size)
+        return self.__position
+
+    def readinto(self, buffer):
+        size = min(len(buffer), self.__size - self.__position)
+        if self.__position < len(self.__header):
+            data = self.__header[self.__position:self.__position + size]
+        else:
+            self.__file.seek(self.__start + self.__position - len(self.__header))
+            data = self.__file.read(size)
+        buffer[:len(data)] = data
+        self.__position += len(data)
+        return len(data)
+
+    def close(self):
+        self.__file.close()
+        super().close()
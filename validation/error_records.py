@@ -0,0 +1,288 @@
+import json
+from array import array
+from collections import Counter
+from frictionless import errors
+from .error_store import report_errors
+
+# Separators of the stored reports, like json.dump(..., separators=(',', ':'))
+SEPARATORS = (',', ':')
+
+
+class ErrorBuffer:
+    """
+    Errors of a validation run, stored compactly and rendered on demand.
+
+    Cell and row errors are kept as a kind (error class and field), the row
+    position and number in arrays, and a (note, cells, cell) tuple. The
+    message, description and tags a frictionless Error carries are rebuilt
+    from custom_errors.py when the error is read, one at a time. Other
+    errors (task, header, check errors) are kept as they are.
+
+    Used as the errors of a ReportTask, it is iterated like a list of Errors.
+    Past the limit only the number of errors of each kind is kept, dropped
+    counts every error that was not.
+    """
+
+    def __init__(self, limit=None):
+        self.limit = limit
+        self.scope = []
+        self.__kinds = []
+        self.__kind_ids = {}
+        self.__notes = {}
+        self.__kind = array('l')
+        self.__row_position = array('q')
+        self.__row_number = array('q')
+        self.__args = []
+        self.__row_cells = (None, None)
+        self.__dropped_kinds = Counter()
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self.__kind)
+
+    def __iter__(self):
+        for index in range(len(self.__kind)):
+            yield self.__render(index)
+
+    def __getitem__(self, index):
+        return self.__render(range(len(self.__kind))[index])
+
+    def register(self, check):
+        for Error in check.Errors:
+            if Error.code not in self.scope:
+                self.scope.append(Error.code)
+
+    def append(self, error):
+        """Store error, unless the limit is reached (general errors always are)."""
+        if "#general" not in error.tags and self.limit and len(self.__kind) >= self.limit:
+            self.dropped += 1
+            key = self.__key(error)
+            if key is not None:
+                self.__dropped_kinds[self.__kind_id(key)] += 1
+            return
+        self.add(error)
+
+    def add(self, error):
+        """Store error, even past the limit."""
+        key = self.__key(error)
+        if key is None:
+            self.__kind.append(-1)
+            self.__row_position.append(0)
+            self.__row_number.append(0)
+            self.__args.append(error)
+            return
+        note = self.__notes.setdefault(error['note'], error['note'])
+        args = (note, self.__cells(error)) if key[1] is None else (note, self.__cells(error), error['cell'])
+        self.__kind.append(self.__kind_id(key))
+        self.__row_position.append(error['rowPosition'])
+        self.__row_number.append(error['rowNumber'])
+        self.__args.append(args)
+
+    def to_dict(self):
+        return [error.to_dict() for error in self]
+
+    def count_codes(self, counts, start=0):
+        """Add the errors from index start on to counts, per code, returns where they end."""
+        for index in range(start, len(self.__kind)):
+            code = self.__code(index)
+            counts[code] = counts.get(code, 0) + 1
+        return len(self.__kind)
+
+    def row_index(self):
+        """
+        (keys, kinds, row positions) of the errors, without rendering them.
+
+        The i-th error is of the (code, field name) keys[kinds[i]], or a
+        general error when kinds[i] is -1, read with buffer[i].
+        """
+        keys = [(Error.code, field_name) for Error, field_name, _, _ in self.__kinds]
+        return keys, self.__kind, self.__row_position
+
+    def field_counts(self):
+        """Errors per (code, field name), kept or dropped past the limit."""
+        counts = {}
+        for kinds in (Counter(self.__kind), self.__dropped_kinds):
+            for kind, count in kinds.items():
+                if kind >= 0:
+                    key = (self.__kinds[kind][0].code, self.__kinds[kind][1])
+                    counts[key] = counts.get(key, 0) + count
+        for index, kind in enumerate(self.__kind):
+            if kind < 0:
+                key = (self.__args[index].code, self.__args[index].get('fieldName'))
+                counts[key] = counts.get(key, 0) + 1
+        return counts
+
+    def subset(self, keep, rows=False):
+        """
+        New buffer with the errors whose code keep(code) accepts, with
+        rows=True only those of a row.
+        """
+        buffer = ErrorBuffer(self.limit)
+        buffer.scope = list(self.scope)
+        for index in range(len(self.__kind)):
+            if rows and self.__position(index)[0] is None:
+                continue
+            if keep(self.__code(index)):
+                buffer.__copy(self, index)
+        buffer.__carry_dropped(self, keep)
+        return buffer
+
+    @classmethod
+    def merged(cls, buffers, limit=None, sort=True):
+        """
+        One buffer with the errors of buffers, ordered by row and field.
+
+        Errors without a row (header, check errors) come first and task
+        errors last, both in buffer order. Past limit only general and task
+        errors are kept, task errors are how a run reports where it stopped.
+        With sort=False the buffers, e.g. of consecutive row ranges, are
+        only put one after the other.
+        """
+        buffer = cls(limit)
+        first, rows, last = [], [], []
+        for number, other in enumerate(buffers):
+            for scope in other.scope:
+                if scope not in buffer.scope:
+                    buffer.scope.append(scope)
+            for index in range(len(other.__kind)):
+                if not sort:
+                    first.append((other, index))
+                    continue
+                row_position, field_position = other.__position(index)
+                if other.__code(index) == 'task-error':
+                    last.append((other, index))
+                elif row_position is None:
+                    first.append((other, index))
+                else:
+                    rows.append((row_position, field_position or 0, number, index, other))
+        rows.sort(key=lambda entry: entry[:4])
+        count = 0
+        for other, index in first + [(entry[4], entry[3]) for entry in rows] + last:
+            general = "#general" in other.__tags(index) or other.__code(index) == 'task-error'
+            if not general and limit and count >= limit:
+                buffer.__drop(other, index)
+                continue
+            count += not general
+            buffer.__copy(other, index)
+        for other in buffers:
+            buffer.__carry_dropped(other)
+        return buffer
+
+    # Internal
+
+    def __key(self, error):
+        # Kind of a cell or row error, None for the others
+        Error = type(error)
+        if Error.__init__ is errors.CellError.__init__:
+            return (Error, error['fieldName'], error['fieldNumber'], error['fieldPosition'])
+        if Error.__init__ is errors.RowError.__init__:
+            return (Error, None, None, None)
+        return None
+
+    def __kind_id(self, key):
+        kind = self.__kind_ids.get(key)
+        if kind is None:
+            kind = self.__kind_ids[key] = len(self.__kinds)
+            self.__kinds.append(key)
+        return kind
+
+    def __cells(self, error):
+        # The errors of one row share a single copy of its cells
+        position, cells = self.__row_cells
+        if position != error['rowPosition'] or cells != error['cells']:
+            self.__row_cells = (error['rowPosition'], error['cells'])
+        return self.__row_cells[1]
+
+    def __copy(self, other, index):
+        kind = other.__kind[index]
+        if kind >= 0:
+            kind = self.__kind_id(other.__kinds[kind])
+        self.__kind.append(kind)
+        self.__row_position.append(other.__row_position[index])
+        self.__row_number.append(other.__row_number[index])
+        self.__args.append(other.__args[index])
+
+    def __drop(self, other, index):
+        # Error index of other, past the limit of this buffer
+        self.dropped += 1
+        kind = other.__kind[index]
+        if kind >= 0:
+            self.__dropped_kinds[self.__kind_id(other.__kinds[kind])] += 1
+
+    def __carry_dropped(self, other, keep=None):
+        # The errors other dropped, those of a code keep(code) accepts
+        dropped = 0
+        for kind, count in other.__dropped_kinds.items():
+            key = other.__kinds[kind]
+            if keep is None or keep(key[0].code):
+                self.__dropped_kinds[self.__kind_id(key)] += count
+                dropped += count
+        self.dropped += other.dropped if keep is None else dropped
+
+    def __code(self, index):
+        kind = self.__kind[index]
+        return self.__args[index].code if kind < 0 else self.__kinds[kind][0].code
+
+    def __tags(self, index):
+        kind = self.__kind[index]
+        return self.__args[index].tags if kind < 0 else self.__kinds[kind][0].tags
+
+    def __position(self, index):
+        kind = self.__kind[index]
+        if kind < 0:
+            error = self.__args[index]
+            return error.get('rowPosition'), error.get('fieldPosition')
+        return self.__row_position[index], self.__kinds[kind][3]
+
+    def __render(self, index):
+        kind = self.__kind[index]
+        if kind < 0:
+            return self.__args[index]
+        Error, field_name, field_number, field_position = self.__kinds[kind]
+        args = self.__args[index]
+        if field_name is None:
+            return Error(note=args[0], cells=args[1], row_number=self.__row_number[index],
+                         row_position=self.__row_position[index])
+        return Error(note=args[0], cells=args[1], row_number=self.__row_number[index],
+                     row_position=self.__row_position[index], cell=args[2],
+                     field_name=field_name, field_number=field_number,
+                     field_position=field_position)
+
+
+def dump_report(report, outfile, flatten=None):
+    """
+    Write a Report as JSON, or its flatten(spec) rows with flatten=spec.
+
+    Error buffers are written an error at a time, so no list of every
+    rendered error is ever built.
+    """
+    encoder = json.JSONEncoder(separators=SEPARATORS)
+    if flatten is not None:
+        outfile.write('[')
+        for number, error in enumerate(report_errors(report)):
+            outfile.write(',' if number else '')
+            outfile.write(encoder.encode([error.get(prop) for prop in flatten]))
+        outfile.write(']')
+        return
+
+    # The buffers are swapped for placeholders in a shallow copy of the
+    # report and written where the placeholders end up
+    buffers = []
+    tasks = []
+    for task in report.get('tasks', []):
+        task = dict(task)
+        if isinstance(task.get('errors'), ErrorBuffer):
+            buffers.append(task['errors'])
+            task['errors'] = f'\0errors-{len(buffers) - 1}\0'
+        tasks.append(task)
+    text = encoder.encode(dict(report, tasks=tasks))
+    for number, buffer in enumerate(buffers):
+        placeholder = encoder.encode(f'\0errors-{number}\0')
+        head, text = text.split(placeholder, 1)
+        outfile.write(head)
+        outfile.write('[')
+        for count, error in enumerate(buffer):
+            outfile.write(',' if count else '')
+            outfile.write(encoder.encode(error))
+        outfile.write(']')
+    outfile.write(text)
@@ -0,0 +1,151 @@
+import os
+import time
+from sqlalchemy import (Column, Float, Index, Integer, MetaData, String, Table, Text,
+                        create_engine, event, func, select)
+from .storage import DATA_DIR
+
+DEFAULT_DATABASE = os.path.join(DATA_DIR, 'errors.sqlite')
+
+# Errors are inserted in batches to keep memory flat on very large reports
+INSERT_BATCH_SIZE = 5000
+MAX_PAGE_SIZE = 1000
+
+metadata = MetaData()
+
+reports_table = Table(
+    'reports', metadata,
+    Column('report_id', String(32), primary_key=True),
+    Column('filename', Text),
+    Column('created', Float, nullable=False),
+    Column('error_count', Integer, nullable=False),
+)
+
+errors_table = Table(
+    'errors', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('report_id', String(32), nullable=False),
+    Column('code', String(100)),
+    Column('field_name', Text),
+    Column('field_position', Integer),
+    Column('row_position', Integer),
+    Column('cell', Text),
+    Column('note', Text),
+    Column('message', Text),
+    Index('ix_errors_report_code', 'report_id', 'code', 'row_position'),
+    Index('ix_errors_report_field', 'report_id', 'field_name', 'row_position'),
+    Index('ix_errors_report_row', 'report_id', 'row_position'),
+)
+
+
+class ErrorStore:
+    """
+    SQLite index of validation errors.
+
+    Lets the result page page through and filter the errors of a report
+    without downloading the whole report.
+    """
+
+    def __init__(self, database=DEFAULT_DATABASE):
+        os.makedirs(os.path.dirname(database) or '.', exist_ok=True)
+        self.engine = create_engine(f'sqlite:///{database}')
+        event.listen(self.engine, 'connect', configure_sqlite)
+        metadata.create_all(self.engine)
+
+    def add_report(self, report_id, report, filename=None):
+        """Index every error of a frictionless Report under report_id."""
+        batch = []
+        count = 0
+        with self.engine.begin() as connection:
+            for error in report_errors(report):
+                batch.append(_error_row(report_id, error))
+                if len(batch) >= INSERT_BATCH_SIZE:
+                    connection.execute(errors_table.insert(), batch)
+                    count += len(batch)
+                    batch = []
+            if batch:
+                connection.execute(errors_table.insert(), batch)
+                count += len(batch)
+            connection.execute(reports_table.insert().values(
+                report_id=report_id, filename=filename, created=time.time(), error_count=count
+            ))
+        return count
+
+    def has_report(self, report_id):
+        query = select(reports_table.c.report_id).where(reports_table.c.report_id == report_id)
+        with self.engine.connect() as connection:
+            return connection.execute(query).first() is not None
+
+    def errors(self, report_id, code=None, field=None, offset=0, limit=100):
+        """One page of errors ordered by row position, with the filtered total."""
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        offset = max(0, int(offset))
+        conditions = [errors_table.c.report_id == report_id]
+        if code:
+            conditions.append(errors_table.c.code == code)
+        if field:
+            conditions.append(errors_table.c.field_name == field)
+
+        columns = [
+            errors_table.c.code, errors_table.c.field_name, errors_table.c.field_position,
+            errors_table.c.row_position, errors_table.c.cell, errors_table.c.note,
+            errors_table.c.message,
+        ]
+        page = (
+            select(*columns).where(*conditions)
+            .order_by(errors_table.c.row_position, errors_table.c.id)
+            .offset(offset).limit(limit)
+        )
+        total = select(func.count()).select_from(errors_table).where(*conditions)
+        with self.engine.connect() as connection:
+            rows = [dict(row._mapping) for row in connection.execute(page)]
+            total = connection.execute(total).scalar()
+        return {'total': total, 'offset': offset, 'limit': limit, 'errors': rows}
+
+    def counts(self, report_id, by='code'):
+        """Number of errors per error code or per field name."""
+        column = errors_table.c.code if by == 'code' else errors_table.c.field_name
+        query = (
+            select(column, func.count()).where(errors_table.c.report_id == report_id)
+            .group_by(column).order_by(func.count().desc())
+        )
+        with self.engine.connect() as connection:
+            return {key if key is not None else '': count for key, count in connection.execute(query)}
+
+    def prune(self, older_than):
+        """Drop reports created before the older_than timestamp."""
+        expired = select(reports_table.c.report_id).where(reports_table.c.created < older_than)
+        with self.engine.begin() as connection:
+            connection.execute(errors_table.delete().where(errors_table.c.report_id.in_(expired)))
+            connection.execute(reports_table.delete().where(reports_table.c.created < older_than))
+
+
+def configure_sqlite(dbapi_connection, connection_record):
+    # WAL lets the web workers read while another worker is indexing
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.close()
+
+
+def report_errors(report):
+    """Every error of a frictionless Report, task level errors included."""
+    yield from report.errors
+    for task in report.tasks:
+        yield from task.errors
+
+
+# Internal
+
+
+def _error_row(report_id, error):
+    cell = error.get('cell')
+    return {
+        'report_id': report_id,
+        'code': error.code,
+        'field_name': error.get('fieldName'),
+        'field_position': error.get('fieldPosition'),
+        'row_position': error.get('rowPosition'),
+        'cell': None if cell is None else str(cell),
+        'note': error.get('note'),
+        'message': error.get('message'),
+    }
@@ -0,0 +1,287 @@
+import os
+import re
+import time
+from sqlalchemy import (Column, Float, ForeignKey, Index, Integer, MetaData, String, Table,
+                        Text, create_engine, event, func, select)
+from sqlalchemy.dialects.sqlite import insert
+from .error_records import ErrorBuffer
+from .error_store import configure_sqlite
+from .storage import DATA_DIR
+
+DEFAULT_DATABASE = os.path.join(DATA_DIR, 'history.sqlite')
+
+# Weight of the newest run in the exponentially weighted error rates
+EWMA_ALPHA = 0.3
+
+# Errors about the run itself, left out of the counts
+RUN_CODES = {'task-error', 'check-error'}
+
+MONTHS = {
+    'jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'sept', 'oct', 'nov', 'dec',
+    'january', 'february', 'march', 'april', 'june', 'july', 'august', 'september',
+    'october', 'november', 'december',
+}
+
+metadata = MetaData()
+
+runs_table = Table(
+    'runs', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('dataset', String(100), nullable=False),
+    Column('job_id', String(32)),
+    Column('filename', Text),
+    Column('created', Float, nullable=False),
+    Column('row_count', Integer, nullable=False),
+    Column('error_count', Integer, nullable=False),
+    Index('ix_runs_dataset_created', 'dataset', 'created'),
+)
+
+# Error count of every check and column in every run, the raw time series
+run_counts_table = Table(
+    'run_counts', metadata,
+    Column('run_id', Integer, ForeignKey('runs.id'), nullable=False),
+    Column('dataset', String(100), nullable=False),
+    Column('code', String(100), nullable=False),
+    Column('field_name', Text, nullable=False),
+    Column('error_count', Integer, nullable=False),
+    Index('ix_run_counts_series', 'dataset', 'code', 'field_name', 'run_id'),
+)
+
+# Rolling aggregates, updated with every run instead of rescanning old runs
+dataset_trends_table = Table(
+    'dataset_trends', metadata,
+    Column('dataset', String(100), primary_key=True),
+    Column('runs', Integer, nullable=False),
+    Column('total_rows', Integer, nullable=False),
+    Column('total_errors', Integer, nullable=False),
+    Column('last_rows', Integer, nullable=False),
+    Column('last_errors', Integer, nullable=False),
+    Column('last_rate', Float, nullable=False),
+    Column('ewma_rate', Float, nullable=False),
+    Column('best_rate', Float, nullable=False),
+    Column('first_run', Float, nullable=False),
+    Column('last_run', Float, nullable=False),
+)
+
+check_trends_table = Table(
+    'check_trends', metadata,
+    Column('dataset', String(100), primary_key=True),
+    Column('code', String(100), primary_key=True),
+    Column('field_name', Text, primary_key=True),
+    Column('runs', Integer, nullable=False),
+    Column('total_errors', Integer, nullable=False),
+    Column('last_errors', Integer, nullable=False),
+    Column('last_rate', Float, nullable=False),
+    Column('ewma_rate', Float, nullable=False),
+    Column('first_run', Float, nullable=False),
+    Column('last_run', Float, nullable=False),
+)
+
+
+def dataset_family(filename):
+    """
+    Name shared by every upload of the same dataset.
+
+    Dates, years, months, quarters and version numbers are dropped from the
+    filename so 'permits_2021-09.csv' and 'Permits October 2021.csv' are both
+    recorded as 'permits'.
+    """
+    stem = os.path.basename(str(filename)).split('.')[0].lower()
+    tokens = [token for token in re.split(r'[^a-z0-9]+', stem) if token]
+    kept = [
+        token for token in tokens
+        if not (
+            (token.isdigit() and len(token) != 3)
+            or token in MONTHS
+            or re.fullmatch(r'(q[1-4]|v\d+|\d{4}q[1-4]|\d+(st|nd|rd|th))', token)
+        )
+    ]
+    family = '-'.join(kept or tokens)
+    return family[:100] or 'dataset'
+
+
+class HistoryStore:
+    """
+    Data quality history of every dataset family.
+
+    Each validation run appends its row count and its error counts per check
+    and column, and folds them into running aggregates so trend queries never
+    read old reports.
+    """
+
+    def __init__(self, database=DEFAULT_DATABASE, ewma_alpha=EWMA_ALPHA):
+        os.makedirs(os.path.dirname(database) or '.', exist_ok=True)
+        self.ewma_alpha = ewma_alpha
+        self.engine = create_engine(f'sqlite:///{database}')
+        event.listen(self.engine, 'connect', configure_sqlite)
+        metadata.create_all(self.engine)
+
+    def add_run(self, dataset, report, job_id=None, filename=None, created=None):
+        """
+        Record one validation run of a dataset from its frictionless Report.
+
+        A run stopped early (a limit or a cancel) read part of the file and
+        has no row count, it is not recorded and None is returned.
+        """
+        if not report.tasks or any(task.partial for task in report.tasks):
+            return None
+        created = created or time.time()
+        row_count = sum(task.resource.stats.get('rows') or 0 for task in report.tasks)
+        counts = {}
+        for (code, field_name), count in _error_counts(report).items():
+            # Notes of the run, not data quality
+            if code not in RUN_CODES:
+                key = (code, field_name or '')
+                counts[key] = counts.get(key, 0) + count
+        error_count = sum(counts.values())
+
+        with self.engine.begin() as connection:
+            first_run = connection.execute(
+                select(dataset_trends_table.c.runs).where(dataset_trends_table.c.dataset == dataset)
+            ).first() is None
+            run_id = connection.execute(runs_table.insert().values(
+                dataset=dataset, job_id=job_id, filename=filename, created=created,
+                row_count=row_count, error_count=error_count,
+            )).inserted_primary_key[0]
+            if counts:
+                connection.execute(run_counts_table.insert(), [
+                    {'run_id': run_id, 'dataset': dataset, 'code': code,
+                     'field_name': field_name, 'error_count': count}
+                    for (code, field_name), count in counts.items()
+                ])
+            self.__update_dataset_trend(connection, dataset, row_count, error_count, created)
+            self.__update_check_trends(connection, dataset, row_count, counts, created, first_run)
+        return run_id
+
+    def trend(self, dataset, limit=50, code=None, field=None):
+        """Aggregates and the most recent runs of a dataset, newest first."""
+        limit = max(1, min(int(limit), 1000))
+        with self.engine.connect() as connection:
+            summary = connection.execute(
+                select(dataset_trends_table).where(dataset_trends_table.c.dataset == dataset)
+            ).first()
+            if summary is None:
+                return None
+
+            checks = select(check_trends_table).where(check_trends_table.c.dataset == dataset)
+            if code:
+                checks = checks.where(check_trends_table.c.code == code)
+            if field:
+                checks = checks.where(check_trends_table.c.field_name == field)
+            checks = checks.order_by(check_trends_table.c.ewma_rate.desc())
+
+            runs = (
+                select(runs_table.c.id, runs_table.c.job_id, runs_table.c.filename,
+                       runs_table.c.created, runs_table.c.row_count, runs_table.c.error_count)
+                .where(runs_table.c.dataset == dataset)
+                .order_by(runs_table.c.created.desc()).limit(limit)
+            )
+            runs = [dict(row._mapping) for row in connection.execute(runs)]
+
+            # Per run series of one check and/or column
+            if code or field:
+                series = select(run_counts_table.c.run_id, run_counts_table.c.code,
+                                run_counts_table.c.field_name, run_counts_table.c.error_count)
+                series = series.where(
+                    run_counts_table.c.dataset == dataset,
+                    run_counts_table.c.run_id.in_([run['id'] for run in runs]),
+                )
+                if code:
+                    series = series.where(run_counts_table.c.code == code)
+                if field:
+                    series = series.where(run_counts_table.c.field_name == field)
+                by_run = {}
+                for row in connection.execute(series):
+                    by_run.setdefault(row.run_id, []).append(
+                        {'code': row.code, 'field_name': row.field_name, 'error_count': row.error_count}
+                    )
+                for run in runs:
+                    run['counts'] = by_run.get(run['id'], [])
+
+            return {
+                'dataset': dataset,
+                'summary': dict(summary._mapping),
+                'checks': [dict(row._mapping) for row in connection.execute(checks)],
+                'runs': runs,
+            }
+
+    # Internal
+
+    def __update_dataset_trend(self, connection, dataset, row_count, error_count, created):
+        rate = _rate(error_count, row_count)
+        table = dataset_trends_table
+        statement = insert(table).values(
+            dataset=dataset, runs=1, total_rows=row_count, total_errors=error_count,
+            last_rows=row_count, last_errors=error_count, last_rate=rate, ewma_rate=rate,
+            best_rate=rate, first_run=created, last_run=created,
+        )
+        connection.execute(statement.on_conflict_do_update(
+            index_elements=[table.c.dataset],
+            set_={
+                'runs': table.c.runs + 1,
+                'total_rows': table.c.total_rows + row_count,
+                'total_errors': table.c.total_errors + error_count,
+                'last_rows': row_count,
+                'last_errors': error_count,
+                'last_rate': rate,
+                'ewma_rate': table.c.ewma_rate * (1 - self.ewma_alpha) + rate * self.ewma_alpha,
+                'best_rate': func.min(table.c.best_rate, rate),
+                'last_run': created,
+            },
+        ))
+
+    def __update_check_trends(self, connection, dataset, row_count, counts, created, first_run):
+        table = check_trends_table
+
+        # Checks and columns seen before but clean in this run decay towards zero
+        connection.execute(
+            table.update()
+            .where(table.c.dataset == dataset)
+            .values(
+                runs=table.c.runs + 1,
+                last_errors=0,
+                last_rate=0.0,
+                ewma_rate=table.c.ewma_rate * (1 - self.ewma_alpha),
+                last_run=created,
+            )
+        )
+        for (code, field_name), count in counts.items():
+            rate = _rate(count, row_count)
+            # A check failing for the first time had a zero rate in the earlier runs
+            statement = insert(table).values(
+                dataset=dataset, code=code, field_name=field_name, runs=1, total_errors=count,
+                last_errors=count, last_rate=rate,
+                ewma_rate=rate if first_run else rate * self.ewma_alpha,
+                first_run=created, last_run=created,
+            )
+            # The blanket update above already counted this run and decayed the average
+            connection.execute(statement.on_conflict_do_update(
+                index_elements=[table.c.dataset, table.c.code, table.c.field_name],
+                set_={
+                    'total_errors': table.c.total_errors + count,
+                    'last_errors': count,
+                    'last_rate': rate,
+                    'ewma_rate': table.c.ewma_rate + rate * self.ewma_alpha,
+                },
+            ))
+
+
+def _error_counts(report):
+    # Errors per (code, field name), with those an ErrorBuffer dropped past
+    # max_errors when the run read on (Limits.read_all_rows)
+    counts = {}
+    for task in report.tasks:
+        if isinstance(task.errors, ErrorBuffer):
+            task_counts = task.errors.field_counts()
+        else:
+            task_counts = {}
+            for error in task.errors:
+                key = (error.code, error.get('fieldName'))
+                task_counts[key] = task_counts.get(key, 0) + 1
+        for key, count in task_counts.items():
+            counts[key] = counts.get(key, 0) + count
+    return counts
+
+
+def _rate(errors, rows):
+    return errors / rows if rows else float(errors)
@@ -0,0 +1,43 @@
+import re
+from functools import lru_cache
+
+
+class KeywordScanner:
+    """
+    Case-insensitive search for any of a set of keywords.
+
+    The keywords are compiled once into a single pattern, so a cell or field
+    name is upper-cased once and scanned once instead of once per keyword.
+    Keywords that contain another keyword (MINUS contains MINU) can never be
+    the only match and are dropped.
+    """
+
+    def __init__(self, keywords):
+        keywords = {keyword.upper() for keyword in keywords if keyword}
+        self.keywords = tuple(sorted(
+            keyword for keyword in keywords
+            if not any(other != keyword and other in keyword for other in keywords)
+        ))
+        # Longest first, so the reported keyword is the most specific one
+        pattern = '|'.join(re.escape(keyword) for keyword in sorted(self.keywords, key=len, reverse=True))
+        self.__search = re.compile(pattern).search if self.keywords else None
+
+    def search(self, text):
+        """The first keyword found in text, or None."""
+        if self.__search is None or text is None:
+            return None
+        match = self.__search(str(text).upper())
+        return match.group() if match else None
+
+    def matching_fields(self, field_names):
+        """[(position, field name)] of the field names containing a keyword."""
+        return [
+            (position, name) for position, name in enumerate(field_names)
+            if self.search(name) is not None
+        ]
+
+
+@lru_cache(maxsize=64)
+def keyword_scanner(keywords):
+    """Shared scanner for a tuple of keywords, built once per configuration."""
+    return KeywordScanner(keywords)
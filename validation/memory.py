@@ -0,0 +1,152 @@
+import json
+import sys
+import threading
+import tracemalloc
+
+# Rows at which the state of every check is measured, doubling from the first
+# one so measuring stays cheap on large files
+FIRST_STATE_SAMPLE = 1000
+
+# A check is flagged when its state keeps growing by at least this many
+# bytes per row over the second half of the file
+GROWTH_BYTES_PER_ROW = 1.0
+
+# tracemalloc is process wide, held by the accounted run in progress
+_TRACING = threading.Lock()
+
+
+class AccountingBusyError(RuntimeError):
+    pass
+
+
+class MemoryAccounting:
+    """
+    Opt-in memory accounting per check, used as a context manager.
+
+    For every wrapped check:
+
+    - peak: the largest allocation of a single validate_* call, measured
+      with tracemalloc, the errors it yields included
+    - retained: the deep size of the check's own attributes, sampled as the
+      rows go by, which is how state growing with the row count is found
+
+    Allocations that outlive a call are not charged to the check, most of
+    them are values frictionless caches in the row being validated.
+
+    tracemalloc sees the whole process, so runs of other requests at the same
+    time add noise. One accounted run at a time per process, entering a
+    second one raises AccountingBusyError. Expect the run to be several
+    times slower.
+    """
+
+    def __init__(self, first_sample=FIRST_STATE_SAMPLE, growth_bytes_per_row=GROWTH_BYTES_PER_ROW):
+        self.first_sample = first_sample
+        self.growth_bytes_per_row = growth_bytes_per_row
+        self.checks = {}
+        self.rows = 0
+        self.__started = False
+
+    def __enter__(self):
+        if not _TRACING.acquire(blocking=False):
+            raise AccountingBusyError('another run of this process is being accounted')
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.__started = True
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.__started:
+            tracemalloc.stop()
+            self.__started = False
+        _TRACING.release()
+
+    def wrap(self, checks):
+        """Instrument the checks in place and return them."""
+        for check in checks:
+            name = type(check).__name__
+            stats = self.checks.setdefault(name, {'peak': 0, 'state': [], 'check': check})
+            for method in ('validate_start', 'validate_row', 'validate_end'):
+                # Metadata blocks attribute assignment, the instance dict still
+                # shadows the class method
+                check.__dict__[method] = self.__measured(getattr(check, method), stats, method)
+        return checks
+
+    def summary(self):
+        """{check: {'peak_bytes', 'retained_bytes', 'grows_with_rows', ...}}"""
+        summary = {}
+        for name, stats in self.checks.items():
+            samples = stats['state']
+            growth = _growth_per_row(samples)
+            summary[name] = {
+                'peak_bytes': stats['peak'],
+                'retained_bytes': samples[-1][1] if samples else _state_size(stats['check']),
+                'retained_samples': samples,
+                'growth_bytes_per_row': growth,
+                'grows_with_rows': growth is not None and growth >= self.growth_bytes_per_row,
+            }
+        return summary
+
+    def write(self, path):
+        with open(path, 'w') as outfile:
+            json.dump({'rows': self.rows, 'checks': self.summary()}, outfile, indent=1)
+        return path
+
+    # Internal
+
+    def __measured(self, method, stats, method_name):
+        next_sample = [self.first_sample]
+
+        def measured(*args):
+            reset_peak = getattr(tracemalloc, 'reset_peak', None)
+            if reset_peak:
+                reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            # Generators do their work while they are consumed, the empty
+            # tuple is a singleton and allocates nothing
+            errors = tuple(method(*args))
+            current, peak = tracemalloc.get_traced_memory()
+            stats['peak'] = max(stats['peak'], (peak if reset_peak else current) - before)
+            if method_name == 'validate_row':
+                row_number = args[0].row_number
+                self.rows = max(self.rows, row_number)
+                if row_number >= next_sample[0]:
+                    stats['state'].append((row_number, _state_size(stats['check'])))
+                    next_sample[0] *= 2
+            elif method_name == 'validate_end':
+                stats['state'].append((self.rows, _state_size(stats['check'])))
+            return iter(errors)
+        return measured
+
+
+def _state_size(check):
+    # Attributes set by the check itself, not frictionless' own
+    seen = set()
+    return sum(
+        _deep_size(value, seen) for key, value in vars(check).items()
+        if not key.startswith(('_Check__', '_Metadata__')) and not key.startswith('validate_')
+    )
+
+
+def _deep_size(value, seen):
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(_deep_size(key, seen) + _deep_size(item, seen) for key, item in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(_deep_size(item, seen) for item in value)
+    return size
+
+
+def _growth_per_row(samples):
+    # Bytes per row over the second half of the sampled rows
+    if len(samples) < 3:
+        return None
+    last_rows, last_size = samples[-1]
+    for rows, size in samples:
+        if rows >= last_rows / 2:
+            break
+    if last_rows == rows:
+        return None
+    return (last_size - size) / (last_rows - rows)
@@ -0,0 +1,267 @@
+import json
+import os
+import shutil
+import time
+from itertools import zip_longest
+import numpy as np
+from frictionless import Check, Resource, Schema, system
+from frictionless.parser import Parser
+from frictionless.plugin import Plugin
+from .storage import DATA_DIR, MIN_IDLE_SECONDS, new_job_id
+
+DEFAULT_DIRECTORY = os.path.join(DATA_DIR, 'parse_cache')
+
+# Cached tables are usually larger than their uploads, the cache has its own
+# budget next to the userfiles quota
+DEFAULT_QUOTA_BYTES = int(os.environ.get('PARSE_CACHE_QUOTA_MB', 1024)) * 1024 * 1024
+
+# Frictionless format of a cached table, read back by ColumnCacheParser
+CACHE_FORMAT = 'colcache'
+
+# Rows transposed into columns at a time while recording and replaying
+BATCH_ROWS = 10000
+
+
+class ParseCache:
+    """
+    Parsed tables of earlier runs, stored column by column.
+
+    Each upload (by content digest) gets a directory with the header, the
+    inferred schema and, for every column, the UTF-8 bytes of its cells in
+    one NumPy array plus an offsets array indexing the cells. A re-run reads
+    these instead of decompressing, sniffing and parsing the upload again.
+    The least recently used tables are dropped while the cache is over
+    quota_bytes.
+    """
+
+    def __init__(self, directory=DEFAULT_DIRECTORY, quota_bytes=DEFAULT_QUOTA_BYTES):
+        self.directory = directory
+        self.quota_bytes = quota_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, digest):
+        return os.path.join(self.directory, str(digest))
+
+    def has(self, digest):
+        return os.path.isfile(os.path.join(self.path(digest), 'meta.json'))
+
+    def recorder(self, digest):
+        """A check recording the validated table into the cache, or None if cached."""
+        if self.has(digest):
+            return None
+        return ColumnRecorder(self.directory, str(digest))
+
+    def resource(self, digest):
+        """Frictionless Resource reading the cached table of digest."""
+        path = self.path(digest)
+        with open(os.path.join(path, 'meta.json')) as infile:
+            meta = json.load(infile)
+        # Mark as used for the sweeper
+        os.utime(path)
+        return Resource(path=path, format=CACHE_FORMAT, schema=Schema(meta['schema']))
+
+    def prune(self, older_than):
+        """
+        Drop cached tables not used since the older_than timestamp, then the
+        least recently used ones until the cache is under quota_bytes.
+        """
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                entries.append((os.path.getmtime(path), _directory_size(path), name, path))
+            except FileNotFoundError:
+                continue
+        total = sum(size for _, size, _, _ in entries)
+        now = time.time()
+        for last_used, size, name, path in sorted(entries):
+            expired = last_used < older_than
+            if not expired and total <= self.quota_bytes:
+                break
+            # Recordings in progress and tables read right now stay, like
+            # the uploads of UploadStore.sweep
+            if not expired and (name.startswith('.incoming-') or now - last_used < MIN_IDLE_SECONDS):
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+
+class ColumnRecorder(Check):
+    """
+    Records the rows of a validation run into a ParseCache directory.
+
+    Runs as the first custom check of the first validation of an upload,
+    where a check removed for a CheckError cannot shift it out. The cache
+    is only published if the whole table was read and every cell was text,
+    a partial or typed table (e.g. Excel) is not cached.
+    """
+
+    code = "column-recorder"
+    Errors = []
+
+    def __init__(self, directory, digest, descriptor=None):
+        super().__init__(descriptor)
+        self.__directory = directory
+        self.__digest = digest
+        self.__temp_path = None
+        self.__meta = {}
+        self.__batch = []
+        self.__columns = []
+        self.__lengths = []
+
+    def validate_start(self):
+        header = self.resource.header
+        if not self.resource.tabular or header.row_positions != [1]:
+            return
+        self.__meta = {
+            'labels': list(header.labels),
+            'schema': self.resource.schema.to_dict(),
+        }
+        self.__temp_path = os.path.join(self.__directory, '.incoming-' + new_job_id())
+        os.makedirs(self.__temp_path)
+        yield from []
+
+    def validate_row(self, row):
+        if self.__temp_path is None:
+            return
+        cells = row.cells
+        # Replayed row positions are consecutive, like the source
+        if row.row_position != len(self.__lengths) + 2 or not all(isinstance(cell, str) for cell in cells):
+            self.discard()
+            return
+        self.__lengths.append(len(cells))
+        self.__batch.append(cells)
+        if len(self.__batch) >= BATCH_ROWS:
+            self.__flush()
+        yield from []
+
+    def validate_end(self):
+        if self.__temp_path is None:
+            return
+        self.__flush()
+        for column in self.__columns:
+            column['data'].close()
+            offsets = np.concatenate([np.zeros(1, dtype=np.int64)] + column['ends'])
+            np.save(os.path.join(self.__temp_path, f"offsets-{column['index']}.npy"), offsets)
+        np.save(os.path.join(self.__temp_path, 'lengths.npy'), np.array(self.__lengths, dtype=np.int32))
+        self.__meta['rows'] = len(self.__lengths)
+        self.__meta['columns'] = len(self.__columns)
+        # Hash and size of the upload, the stats of a re-run
+        self.__meta['hash'] = self.resource.stats['hash']
+        self.__meta['bytes'] = self.resource.stats['bytes']
+        self.__meta['created'] = time.time()
+        with open(os.path.join(self.__temp_path, 'meta.json'), 'w') as outfile:
+            json.dump(self.__meta, outfile)
+        try:
+            os.rename(self.__temp_path, os.path.join(self.__directory, self.__digest))
+        except OSError:
+            # Another worker cached the same upload first
+            shutil.rmtree(self.__temp_path, ignore_errors=True)
+        self.__temp_path = None
+        yield from []
+
+    def discard(self):
+        """Drop an unpublished recording, e.g. after a partial run."""
+        if self.__temp_path is None:
+            return
+        for column in self.__columns:
+            column['data'].close()
+        shutil.rmtree(self.__temp_path, ignore_errors=True)
+        self.__temp_path = None
+        self.__batch = []
+        self.__columns = []
+
+    # Internal
+
+    def __flush(self):
+        if not self.__batch:
+            return
+        rows = len(self.__batch)
+        rows_before = len(self.__lengths) - rows
+        columns = list(zip_longest(*self.__batch, fillvalue=''))
+        for index in range(max(len(columns), len(self.__columns))):
+            if index >= len(self.__columns):
+                self.__add_column(index, rows_before)
+            column = self.__columns[index]
+            if index >= len(columns):
+                # Columns the batch did not reach get empty cells
+                column['ends'].append(np.full(rows, column['size'], dtype=np.int64))
+                continue
+            encoded = [value.encode('utf-8', 'surrogatepass') for value in columns[index]]
+            column['data'].write(b''.join(encoded))
+            ends = np.cumsum(np.fromiter(map(len, encoded), dtype=np.int64, count=rows)) + column['size']
+            column['ends'].append(ends)
+            column['size'] = int(ends[-1])
+        self.__batch = []
+
+    def __add_column(self, index, rows_before):
+        data = open(os.path.join(self.__temp_path, f'data-{index}.bin'), 'wb')
+        ends = [np.zeros(rows_before, dtype=np.int64)]
+        self.__columns.append({'index': index, 'data': data, 'ends': ends, 'size': 0})
+
+    metadata_profile = {  # type: ignore
+        "type": "object",
+        "properties": {},
+    }
+
+
+class ColumnCachePlugin(Plugin):
+    """Frictionless plugin reading tables stored by ParseCache."""
+
+    code = CACHE_FORMAT
+
+    def create_parser(self, resource):
+        if resource.format == CACHE_FORMAT:
+            return ColumnCacheParser(resource)
+
+
+class ColumnCacheParser(Parser):
+
+    requires_loader = False
+    supported_types = ['string']
+
+    def read_list_stream_create(self):
+        path = self.resource.path
+        with open(os.path.join(path, 'meta.json')) as infile:
+            meta = json.load(infile)
+        # Reported as the stats of the upload the table was parsed from
+        self.resource.stats['hash'] = meta.get('hash', '')
+        self.resource.stats['bytes'] = meta.get('bytes', 0)
+        yield meta['labels']
+        lengths = np.load(os.path.join(path, 'lengths.npy'))
+        columns = [
+            (np.load(os.path.join(path, f'offsets-{index}.npy'), mmap_mode='r'),
+             _map_bytes(os.path.join(path, f'data-{index}.bin')))
+            for index in range(meta['columns'])
+        ]
+        for start in range(0, meta['rows'], BATCH_ROWS):
+            stop = min(start + BATCH_ROWS, meta['rows'])
+            values = []
+            for offsets, data in columns:
+                bounds = offsets[start:stop + 1].tolist()
+                base = bounds[0]
+                chunk = data[base:bounds[-1]].tobytes()
+                values.append([
+                    chunk[low - base:high - base].decode('utf-8', 'surrogatepass')
+                    for low, high in zip(bounds, bounds[1:])
+                ])
+            rows = zip(*values) if values else [()] * (stop - start)
+            for length, cells in zip(lengths[start:stop].tolist(), rows):
+                yield list(cells[:length])
+
+
+# Internal
+
+
+def _directory_size(path):
+    return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+
+
+def _map_bytes(path):
+    # numpy cannot memory-map an empty file
+    if not os.path.getsize(path):
+        return np.zeros(0, dtype=np.uint8)
+    return np.memmap(path, dtype=np.uint8, mode='r')
+
+
+system.register(ColumnCachePlugin.code, ColumnCachePlugin())
@@ -0,0 +1,103 @@
+import json
+import os
+import sys
+import threading
+import time
+from frictionless import Check
+
+# Seconds between two samples of the profiled thread
+DEFAULT_INTERVAL = 0.005
+
+# Check methods that get their own line in the time per check summary
+CHECK_METHODS = ('validate_start', 'validate_row', 'validate_end')
+
+
+class SamplingProfiler:
+    """
+    Statistical profiler for one thread, used as a context manager.
+
+    A background thread samples the stack of the profiled thread every
+    interval seconds and counts identical stacks, the collapsed format read
+    by flamegraph.pl and speedscope. Frames of a Check method are labelled
+    with the check class, so the summary can attribute time to every check
+    and its validate_row.
+    """
+
+    def __init__(self, interval=DEFAULT_INTERVAL, thread_id=None):
+        self.interval = interval
+        self.thread_id = thread_id
+        self.stacks = {}
+        self.samples = 0
+        self.started = None
+        self.elapsed = 0.0
+        self.__stop = threading.Event()
+        self.__thread = None
+
+    def __enter__(self):
+        self.thread_id = self.thread_id or threading.get_ident()
+        self.started = time.perf_counter()
+        self.__thread = threading.Thread(target=self.__run, name='sampling-profiler', daemon=True)
+        self.__thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.__stop.set()
+        self.__thread.join()
+        self.elapsed = time.perf_counter() - self.started
+
+    def collapsed(self):
+        """Lines of 'frame;frame;frame count', root first."""
+        return [f'{";".join(stack)} {count}' for stack, count in sorted(self.stacks.items())]
+
+    def check_times(self):
+        """{check class: {method: seconds, 'total': seconds}} estimated from the samples."""
+        seconds = self.elapsed / self.samples if self.samples else 0.0
+        times = {}
+        for stack, count in self.stacks.items():
+            # The innermost check frame owns the sample
+            for frame in reversed(stack):
+                if frame.startswith('check:'):
+                    name, method = frame[len('check:'):].rsplit('.', 1)
+                    entry = times.setdefault(name, {'total': 0.0})
+                    entry[method] = entry.get(method, 0.0) + count * seconds
+                    entry['total'] += count * seconds
+                    break
+        return times
+
+    def write(self, path):
+        """Write path.folded (collapsed stacks) and path.json (time per check)."""
+        with open(path + '.folded', 'w') as outfile:
+            outfile.write('\n'.join(self.collapsed()) + '\n')
+        summary = {
+            'interval': self.interval,
+            'samples': self.samples,
+            'elapsed': self.elapsed,
+            'checks': self.check_times(),
+        }
+        with open(path + '.json', 'w') as outfile:
+            json.dump(summary, outfile, indent=1)
+        return [path + '.folded', path + '.json']
+
+    # Internal
+
+    def __run(self):
+        while not self.__stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_label(frame))
+                frame = frame.f_back
+            stack = tuple(reversed(stack))
+            self.stacks[stack] = self.stacks.get(stack, 0) + 1
+            self.samples += 1
+
+
+def _label(frame):
+    code = frame.f_code
+    if code.co_name in CHECK_METHODS:
+        owner = frame.f_locals.get('self')
+        if isinstance(owner, Check):
+            return f'check:{type(owner).__name__}.{code.co_name}'
+    return f'{os.path.basename(code.co_filename)}:{code.co_name}'
@@ -0,0 +1,194 @@
+import csv
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import numpy as np
+from .parse_cache import _map_bytes
+from .rules import LOOKUPS_DIR
+from .storage import DATA_DIR, new_job_id
+
+DEFAULT_DIRECTORY = os.path.join(DATA_DIR, 'reference_index')
+
+# Slots per distinct value, the hash table is at most half full
+LOAD_FACTOR = 0.5
+
+
+class ReferenceIndex:
+    """
+    Set of the distinct values of one column of a reference CSV, on disk.
+
+    The values are stored once, UTF-8 encoded one after the other with an
+    offsets array, and an open addressing hash table of 64 bit value hashes
+    points at them. All arrays are memory-mapped, so opening an index costs
+    nothing and a lookup reads a few pages whatever the size of the
+    reference file. Lookups compare the stored bytes, a hash collision
+    never lets a missing value through.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as infile:
+            self.meta = json.load(infile)
+        self.__hashes = np.load(os.path.join(path, 'hashes.npy'), mmap_mode='r')
+        self.__slots = np.load(os.path.join(path, 'slots.npy'), mmap_mode='r')
+        self.__offsets = np.load(os.path.join(path, 'offsets.npy'), mmap_mode='r')
+        self.__data = _map_bytes(os.path.join(path, 'values.bin'))
+        self.__mask = len(self.__hashes) - 1
+
+    def __len__(self):
+        return self.meta['values']
+
+    def __contains__(self, value):
+        encoded = value.encode('utf-8', 'surrogatepass')
+        value_hash = _hash(encoded)
+        slot = value_hash & self.__mask
+        while True:
+            slot_hash = int(self.__hashes[slot])
+            if not slot_hash:
+                return False
+            if slot_hash == value_hash:
+                number = int(self.__slots[slot])
+                start, stop = int(self.__offsets[number]), int(self.__offsets[number + 1])
+                if self.__data[start:stop].tobytes() == encoded:
+                    return True
+            slot = (slot + 1) & self.__mask
+
+
+class ReferenceIndexes:
+    """
+    Indexes of the reference files in settings/lookups, built on first use.
+
+    An index is named after the reference file, its size and modification
+    time and the column, so editing the file builds a new one and the old
+    one is pruned once unused. Opened indexes are kept for the life of the
+    process.
+    """
+
+    def __init__(self, directory=DEFAULT_DIRECTORY, lookups_dir=LOOKUPS_DIR):
+        self.directory = directory
+        self.lookups_dir = lookups_dir
+        os.makedirs(directory, exist_ok=True)
+        self.__lock = threading.Lock()
+        self.__opened = {}
+
+    def get(self, filename, column=None):
+        """
+        ReferenceIndex of column (the first one by default) of filename.
+
+        File names and columns are matched case-insensitively, fields.cfg is
+        stored in upper case. Raises FileNotFoundError or ValueError.
+        """
+        source = self.__resolve(filename)
+        stat = os.stat(source)
+        key = f'{os.path.realpath(source)}\0{stat.st_size}\0{stat.st_mtime_ns}\0{(column or "").upper()}'
+        name = hashlib.sha1(key.encode('utf-8', 'surrogatepass')).hexdigest()
+        path = os.path.join(self.directory, name)
+        with self.__lock:
+            index = self.__opened.get(name)
+            if index is None:
+                if not os.path.isfile(os.path.join(path, 'meta.json')):
+                    build_index(source, column, path)
+                index = self.__opened[name] = ReferenceIndex(path)
+        # Mark as used for the sweeper
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return index
+
+    def prune(self, older_than):
+        """Drop indexes not used since the older_than timestamp."""
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                if os.path.getmtime(path) >= older_than:
+                    continue
+                shutil.rmtree(path)
+            except FileNotFoundError:
+                continue
+            # Indexes still in use stay mapped
+            with self.__lock:
+                self.__opened.pop(name, None)
+
+    def __resolve(self, filename):
+        filename = os.path.basename(filename)
+        try:
+            names = os.listdir(self.lookups_dir)
+        except FileNotFoundError:
+            names = []
+        for name in names:
+            if name.upper() == filename.upper():
+                return os.path.join(self.lookups_dir, name)
+        raise FileNotFoundError(f'reference file {filename} not found in settings/lookups')
+
+
+def build_index(source, column, path):
+    """Write the ReferenceIndex of column of the source CSV to path."""
+    with open(source, newline='', encoding='utf-8-sig') as infile:
+        reader = csv.reader(infile)
+        header = next(reader, [])
+        position = _column_position(header, column, source)
+        # Distinct values, in file order
+        values = {}
+        for row in reader:
+            if position < len(row):
+                value = row[position].strip()
+                if value:
+                    values[value] = None
+
+    encoded = [value.encode('utf-8', 'surrogatepass') for value in values]
+    size = 16
+    while size * LOAD_FACTOR < len(encoded):
+        size *= 2
+    mask = size - 1
+    hashes = [0] * size
+    slots = [0] * size
+    for number, value in enumerate(encoded):
+        value_hash = _hash(value)
+        slot = value_hash & mask
+        while hashes[slot]:
+            slot = (slot + 1) & mask
+        hashes[slot] = value_hash
+        slots[slot] = number
+
+    temp_path = os.path.join(os.path.dirname(path), '.incoming-' + new_job_id())
+    os.makedirs(temp_path)
+    np.save(os.path.join(temp_path, 'hashes.npy'), np.array(hashes, dtype=np.uint64))
+    np.save(os.path.join(temp_path, 'slots.npy'), np.array(slots, dtype=np.int64))
+    ends = np.cumsum(np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded)))
+    np.save(os.path.join(temp_path, 'offsets.npy'), np.concatenate([np.zeros(1, dtype=np.int64), ends]))
+    with open(os.path.join(temp_path, 'values.bin'), 'wb') as outfile:
+        outfile.write(b''.join(encoded))
+    meta = {
+        'source': os.path.basename(source),
+        'column': header[position] if position < len(header) else None,
+        'values': len(encoded),
+        'created': time.time(),
+    }
+    with open(os.path.join(temp_path, 'meta.json'), 'w') as outfile:
+        json.dump(meta, outfile)
+    try:
+        os.rename(temp_path, path)
+    except OSError:
+        # Another worker built the same index first
+        shutil.rmtree(temp_path, ignore_errors=True)
+
+
+# Internal
+
+
+def _column_position(header, column, source):
+    if not column:
+        return 0
+    for position, label in enumerate(header):
+        if label.strip().upper() == column.strip().upper():
+            return position
+    raise ValueError(f'column {column} not found in {os.path.basename(source)}')
+
+
+def _hash(encoded):
+    # Stable across processes, 0 marks an empty slot
+    return int.from_bytes(hashlib.blake2b(encoded, digest_size=8).digest(), 'little') or 1
@@ -0,0 +1,151 @@
+import csv
+import os
+import re
+from settings.store import SETTINGS_DIR
+
+LOOKUPS_DIR = os.path.join(SETTINGS_DIR, 'lookups')
+
+
+class RuleError(ValueError):
+    pass
+
+
+class MissingColumnError(RuleError):
+    pass
+
+
+def compile_rules(rules, field_names, lookups_dir=LOOKUPS_DIR, skipped=None):
+    """
+    Compile parsed rules.cfg rules against the columns of a table.
+
+    Returns [(cell index, field name, tests)] for every column with rules.
+    Each test is a closure test(value, cells) returning an error note or
+    None, specialized for its rule when it is compiled so validating a cell
+    is a plain function call.
+
+    A rule comparing with a column the table does not have is left out, with
+    a note appended to the skipped list if one is given. Other broken rules
+    raise RuleError.
+    """
+    positions = {name.upper(): index for index, name in enumerate(field_names)}
+    compiled = {}
+    for column, rule, argument, line in rules:
+        index = positions.get(column.upper())
+        if index is None:
+            continue
+        factory = RULES.get(rule)
+        if factory is None:
+            raise RuleError(f'rules.cfg line {line}: unknown rule "{rule}"')
+        try:
+            test = factory(argument, positions, lookups_dir)
+        except MissingColumnError as exception:
+            if skipped is not None:
+                skipped.append(f'rules.cfg line {line}: {exception}, the rule was skipped')
+            continue
+        except (ValueError, re.error, OSError) as exception:
+            raise RuleError(f'rules.cfg line {line}: {exception}')
+        compiled.setdefault(index, []).append(test)
+
+    return [
+        (index, field_names[index], tuple(tests))
+        for index, tests in sorted(compiled.items())
+    ]
+
+
+# Rule factories
+
+
+def _regex(argument, positions, lookups_dir):
+    if not argument:
+        raise ValueError('regex needs a pattern')
+    fullmatch = re.compile(argument).fullmatch
+    note = f'does not match the pattern {argument}'
+
+    def test(value, cells):
+        if fullmatch(value) is None:
+            return note
+    return test
+
+
+def _enum(argument, positions, lookups_dir):
+    allowed = frozenset(item.strip() for item in argument.split('|') if item.strip())
+    if not allowed:
+        raise ValueError('enum needs values separated by |')
+    note = f'is not one of {"|".join(sorted(allowed))}'
+
+    def test(value, cells):
+        if value not in allowed:
+            return note
+    return test
+
+
+def _lookup(argument, positions, lookups_dir):
+    path = os.path.join(lookups_dir, os.path.basename(argument))
+    with open(path, newline='', encoding='utf-8') as infile:
+        allowed = frozenset(row[0].strip() for row in csv.reader(infile) if row)
+    note = f'is not a value listed in {os.path.basename(argument)}'
+
+    def test(value, cells):
+        if value not in allowed:
+            return note
+    return test
+
+
+def _range(argument, positions, lookups_dir):
+    low, high = _bounds(argument, float)
+
+    def test(value, cells):
+        try:
+            number = float(value)
+        except ValueError:
+            return 'is not a number'
+        if low is not None and number < low:
+            return f'is less than {argument.split("..")[0].strip()}'
+        if high is not None and number > high:
+            return f'is greater than {argument.split("..")[1].strip()}'
+    return test
+
+
+def _length(argument, positions, lookups_dir):
+    low, high = _bounds(argument, int)
+    low = low or 0
+    note = f'must be {argument.strip()} characters long'
+
+    def test(value, cells):
+        length = len(value)
+        if length < low or (high is not None and length > high):
+            return note
+    return test
+
+
+def _cross_field(equal):
+    def factory(argument, positions, lookups_dir):
+        other = positions.get(argument.strip().upper())
+        if other is None:
+            raise MissingColumnError(f'column "{argument.strip()}" does not exist')
+        note = f'must {"equal" if equal else "differ from"} {argument.strip()}'
+
+        def test(value, cells):
+            other_value = cells[other] if other < len(cells) else None
+            if (value == other_value) != equal:
+                return note
+        return test
+    return factory
+
+
+RULES = {
+    'regex': _regex,
+    'enum': _enum,
+    'lookup': _lookup,
+    'range': _range,
+    'length': _length,
+    'equals': _cross_field(True),
+    'differs': _cross_field(False),
+}
+
+
+def _bounds(argument, cast):
+    if '..' not in argument:
+        raise ValueError('bounds must be written as min..max')
+    low, high = (part.strip() for part in argument.split('..', 1))
+    return (cast(low) if low else None, cast(high) if high else None)
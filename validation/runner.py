@@ -0,0 +1,375 @@
+import functools
+import json
+import os
+import time
+import types
+from dataclasses import dataclass
+from typing import Any, Optional, Tuple
+from frictionless import Check, Report, ReportTask, Resource, helpers, system
+from frictionless.errors import TaskError
+from frictionless.exception import FrictionlessException
+from .compression import resource_options
+from .error_records import ErrorBuffer
+from .storage import DATA_DIR
+
+# Defaults can be overridden through the environment, 0 means no limit
+DEFAULT_MAX_ROWS = int(os.environ.get('VALIDATION_MAX_ROWS', 0)) or None
+DEFAULT_MAX_SECONDS = float(os.environ.get('VALIDATION_MAX_SECONDS', 0)) or None
+DEFAULT_MAX_ERRORS = int(os.environ.get('VALIDATION_MAX_ERRORS', 1000)) or None
+DEFAULT_MAX_MEMORY_MB = int(os.environ.get('VALIDATION_MAX_MEMORY_MB', 1000)) or None
+
+# Rows between two checks of the clock, the memory and the cancel flag
+POLL_ROWS = 1000
+
+# Seconds between two progress samples of a run
+PROGRESS_SECONDS = float(os.environ.get('VALIDATION_PROGRESS_SECONDS', 1))
+
+CANCEL_DIR = os.path.join(DATA_DIR, 'cancel')
+PROGRESS_DIR = os.path.join(DATA_DIR, 'progress')
+
+
+class Limits:
+    """
+    Resource limits of one validation run, None meaning no limit.
+
+    cancelled is an optional callable, the run stops as soon as it returns
+    True. progress, if given, is called with a sample of the run (see
+    ProgressBoard) at most every PROGRESS_SECONDS. With read_all_rows the
+    run goes on past max_errors, for checks that need every row (the parse
+    cache recorder), only the first max_errors errors are kept.
+    """
+
+    def __init__(self, max_rows=DEFAULT_MAX_ROWS, max_seconds=DEFAULT_MAX_SECONDS,
+                 max_errors=DEFAULT_MAX_ERRORS, max_memory_mb=DEFAULT_MAX_MEMORY_MB, cancelled=None,
+                 progress=None, read_all_rows=False):
+        self.max_rows = max_rows
+        self.max_seconds = max_seconds
+        self.max_errors = max_errors
+        self.max_memory_mb = max_memory_mb
+        self.cancelled = cancelled
+        self.progress = progress
+        self.read_all_rows = read_all_rows
+
+    def exceeded(self, started):
+        """Note naming the time, memory or cancel limit that was hit, or None."""
+        if self.cancelled is not None and self.cancelled():
+            return 'cancelled: the run was cancelled'
+        if self.max_seconds and time.monotonic() - started > self.max_seconds:
+            return f'max_seconds limit reached: stopped after {self.max_seconds:g} seconds'
+        if self.max_memory_mb:
+            memory = helpers.get_current_memory_usage()
+            if memory and memory > self.max_memory_mb:
+                return f'max_memory_mb limit reached: the process used more than {self.max_memory_mb}MB'
+        return None
+
+
+@dataclass
+class RunOptions:
+    """
+    Options of a validator.custom_validate run, all optional.
+
+    Where the report goes (report_path, report_compression), the job it
+    belongs to (job_id, filename, dataset), how the file is read (config,
+    limits, raw_text, column_shards, memory_accounting), the corrected copy
+    to write (fix_paths) and the stores that record the run.
+    """
+
+    report_path: Optional[str] = None
+    report_compression: Optional[str] = None
+    job_id: Optional[str] = None
+    filename: Optional[str] = None
+    dataset: Optional[str] = None
+    config: Any = None
+    limits: Optional[Limits] = None
+    raw_text: bool = False
+    column_shards: Optional[int] = None
+    memory_accounting: Any = None
+    fix_paths: Optional[Tuple[str, str]] = None
+    digest: Optional[str] = None
+    parse_cache: Any = None
+    error_store: Any = None
+    history_store: Any = None
+    checkpoints: Any = None
+    bitmap_store: Any = None
+
+
+class CancelFlags:
+    """
+    Cancellation requests for running jobs.
+
+    Stored as files so a request to any worker process can cancel a run in
+    another one.
+    """
+
+    def __init__(self, directory=CANCEL_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def cancel(self, job_id):
+        with open(self.__path(job_id), 'w'):
+            pass
+
+    def is_cancelled(self, job_id):
+        return os.path.exists(self.__path(job_id))
+
+    def checker(self, job_id):
+        # A partial, unlike a lambda, can be sent to worker processes
+        return functools.partial(self.is_cancelled, job_id)
+
+    def clear(self, job_id):
+        try:
+            os.remove(self.__path(job_id))
+        except FileNotFoundError:
+            pass
+
+    def prune(self, older_than):
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                if os.path.getmtime(path) < older_than:
+                    os.remove(path)
+            except FileNotFoundError:
+                continue
+
+    def __path(self, job_id):
+        return os.path.join(self.directory, os.path.basename(str(job_id)))
+
+
+class ProgressBoard:
+    """
+    Latest progress sample of running jobs, for the page to poll while its
+    upload is being validated.
+
+    A sample has the rows and bytes read, the bytes of the file (total,
+    None when unknown, e.g. compressed), rows and bytes per second, the
+    errors so far per error code, and the eta in seconds. Stored as files
+    like the cancel flags, a run in any worker process publishes them.
+    """
+
+    def __init__(self, directory=PROGRESS_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def publish(self, job_id, sample):
+        sample = dict(sample, done=False, eta=None)
+        if sample['total'] and sample['bytes_per_second']:
+            sample['eta'] = max(0.0, (sample['total'] - sample['bytes']) / sample['bytes_per_second'])
+        self.__write(job_id, sample)
+
+    def finish(self, job_id):
+        self.__write(job_id, {'done': True})
+
+    def reporter(self, job_id):
+        # A partial, unlike a lambda, can be sent to worker processes
+        return functools.partial(self.publish, job_id)
+
+    def latest(self, job_id):
+        """(modification time, sample) of job_id, None before its first sample."""
+        try:
+            with open(self.__path(job_id), encoding='utf-8') as infile:
+                return os.fstat(infile.fileno()).st_mtime_ns, json.load(infile)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def prune(self, older_than):
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                if os.path.getmtime(path) < older_than:
+                    os.remove(path)
+            except FileNotFoundError:
+                continue
+
+    def __path(self, job_id):
+        return os.path.join(self.directory, os.path.basename(str(job_id)))
+
+    def __write(self, job_id, sample):
+        temp_path = self.__path(job_id) + '.incoming'
+        with open(temp_path, 'w', encoding='utf-8') as outfile:
+            json.dump(sample, outfile)
+        os.replace(temp_path, self.__path(job_id))
+
+
+def offset_progress(progress, bytes_before, errors_before, total):
+    """
+    progress of a run over a range of a file, its samples made samples of
+    the whole file: bytes and errors of the ranges before added.
+    """
+    if progress is None:
+        return None
+    return functools.partial(_offset_sample, progress, bytes_before, dict(errors_before), total)
+
+
+@Report.from_validate
+def validate_limited(source, checks=None, limits=None, row_offset=0, select=None, **options):
+    """
+    Validate a table like frictionless.validate, within Limits.
+
+    Follows frictionless' validate_resource, but the row loop also stops on
+    the row, time, memory and cancel limits. A stopped run still returns the
+    errors found so far, in a report marked partial with a task error naming
+    the limit. The errors are kept in an ErrorBuffer.
+
+    row_offset is added to the row positions and numbers the checks see,
+    for a table that is a header and a range of rows of a larger file.
+
+    select, if given, is called with each error the checks find and only
+    the errors it accepts are kept, and counted against max_errors.
+    """
+    limits = limits or Limits()
+    resource = None
+    partial = False
+    timer = helpers.Timer()
+    started = time.monotonic()
+    errors = ErrorBuffer(limits.max_errors)
+    progress = None
+
+    # Create resource
+    try:
+        native = isinstance(source, Resource)
+        resource = source.to_copy() if native else Resource(source, **options)
+        stats = {key: val for key, val in resource.stats.items() if val}
+    except FrictionlessException as exception:
+        errors.append(exception.error)
+
+    # Open resource
+    if not errors:
+        try:
+            resource.open()
+        except FrictionlessException as exception:
+            errors.append(exception.error)
+            resource.close()
+
+    # Prepare checks
+    if not errors:
+        checks = list(checks or [])
+        checks.insert(0, {"code": "baseline", "stats": stats})
+        for index, check in enumerate(checks):
+            if not isinstance(check, Check):
+                func = isinstance(check, types.FunctionType)
+                check = Check(function=check) if func else system.create_check(check)
+                checks[index] = check
+            errors.register(check)
+        for check in list(checks):
+            if check.metadata_errors:
+                checks.remove(check)
+                for error in check.metadata_errors:
+                    errors.append(error)
+
+    # Validate metadata
+    if not errors:
+        for error in resource.metadata_errors:
+            errors.append(error)
+
+    # Validate data
+    if not errors:
+        with resource:
+            for check in list(checks):
+                check.connect(resource)
+                for error in check.validate_start():
+                    if error.code == "check-error":
+                        checks.remove(check)
+                    if select is None or select(error):
+                        errors.append(error)
+
+            if limits.progress is not None:
+                progress = _Progress(limits.progress, resource, started, row_offset)
+            if resource.tabular:
+                for row in resource.row_stream:
+                    if row_offset:
+                        shift_row(row, row_offset)
+                    for check in checks:
+                        for error in check.validate_row(row):
+                            if select is None or select(error):
+                                errors.append(error)
+
+                    # Limits
+                    note = None
+                    if limits.max_errors and len(errors) >= limits.max_errors and not limits.read_all_rows:
+                        note = f'max_errors limit reached: stopped at {limits.max_errors} errors'
+                    elif limits.max_rows and row.row_number >= limits.max_rows:
+                        note = f'max_rows limit reached: stopped after {limits.max_rows} rows'
+                    elif not row.row_number % POLL_ROWS:
+                        note = limits.exceeded(started)
+                        if progress is not None:
+                            progress.sample(row.row_position, errors)
+                    if note:
+                        # Past the error cap too, the report must say why it stopped
+                        errors.add(TaskError(note=f'{note} (row {row.row_position})'))
+                        partial = True
+                        break
+
+            if not partial:
+                if not resource.tabular:
+                    helpers.pass_through(resource.byte_stream)
+                for check in checks:
+                    for error in check.validate_end():
+                        if select is None or select(error):
+                            errors.append(error)
+
+            if errors.dropped:
+                found = len(errors) + errors.dropped
+                errors.add(TaskError(note=f'max_errors limit reached: kept {len(errors)} of {found} errors'))
+
+    return Report(
+        time=timer.time,
+        errors=[],
+        tasks=[
+            ReportTask(
+                time=timer.time,
+                scope=errors.scope,
+                partial=partial,
+                errors=errors,
+                resource=resource,
+            )
+        ],
+    )
+
+
+def shift_row(row, offset):
+    """Move a Row read from a slice of a file to its position in the file."""
+    # Row keeps its positions private, its errors are built from them lazily
+    row._Row__row_position += offset
+    row._Row__row_number += offset
+
+
+# Internal
+
+
+class _Progress:
+    # Samples of one run, a cheap clock check every POLL_ROWS rows and the
+    # errors counted from where the last sample stopped
+    def __init__(self, publish, resource, started, row_offset):
+        self.publish = publish
+        self.resource = resource
+        self.started = self.sent = started
+        self.row_offset = row_offset
+        self.counts = {}
+        self.counted = 0
+        self.total = None
+        if isinstance(resource.path, str) and not resource_options(resource.path) and os.path.isfile(resource.path):
+            self.total = os.path.getsize(resource.path)
+
+    def sample(self, row_position, errors):
+        now = time.monotonic()
+        if now - self.sent < PROGRESS_SECONDS:
+            return
+        self.sent = now
+        self.counted = errors.count_codes(self.counts, self.counted)
+        elapsed = max(now - self.started, 1e-6)
+        # frictionless only sets stats['bytes'] at the end of the file, the
+        # parser reads through a loader of its own
+        loader = getattr(getattr(self.resource, '_Resource__parser', None), 'loader', None)
+        read = getattr(getattr(loader, 'byte_stream', None), '_ByteStreamWithStatsHandling__counter', 0)
+        self.publish({
+            'rows': row_position - 1, 'bytes': read, 'total': self.total,
+            'rows_per_second': (row_position - 1 - self.row_offset) / elapsed, 'bytes_per_second': read / elapsed,
+            'errors': dict(self.counts), 'elapsed': elapsed,
+        })
+
+
+def _offset_sample(progress, bytes_before, errors_before, total, sample):
+    errors = dict(errors_before)
+    for code, count in sample['errors'].items():
+        errors[code] = errors.get(code, 0) + count
+    progress(dict(sample, bytes=bytes_before + sample['bytes'], total=total, errors=errors))
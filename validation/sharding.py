@@ -0,0 +1,140 @@
+import copy
+import os
+from concurrent.futures import ProcessPoolExecutor
+from frictionless import Detector, Layout, Report, ReportTask, Resource, helpers
+from frictionless.errors import CheckError
+from .error_records import ErrorBuffer
+from .runner import validate_limited
+from .validator import RawTextDetector, check_select, needed_types
+
+# Worker processes of a column sharded run, 0 or 1 turns sharding off
+DEFAULT_COLUMN_SHARDS = int(os.environ.get('VALIDATION_COLUMN_SHARDS', 0))
+
+# Narrower tables are validated in one process, sharding would not pay off
+MIN_SHARDED_FIELDS = int(os.environ.get('VALIDATION_SHARD_MIN_FIELDS', 100))
+
+# Baseline errors of a column shard, every other baseline error comes from
+# the row shard
+CELL_CODES = ('type-error', 'constraint-error')
+
+
+def shard_count(filepath, shards=DEFAULT_COLUMN_SHARDS, **options):
+    """Column shards to use for filepath, 0 when it should not be sharded."""
+    if shards < 2:
+        return 0
+    fields = _field_count(filepath, options)
+    if fields < MIN_SHARDED_FIELDS:
+        return 0
+    return min(shards, fields)
+
+
+@Report.from_validate
+def validate_sharded(filepath, config=None, shards=DEFAULT_COLUMN_SHARDS, limits=None,
+                     raw_text=False, **options):
+    """
+    Validate a wide table with its columns split across processes.
+
+    Every column shard reads only its columns (Layout pick_fields) and runs
+    the checks marked column_local, plus the baseline type and constraint
+    checks of its columns. One row shard reads whole rows as text for the
+    baseline header and row structure errors and the checks looking at
+    several columns. The errors are merged into one report ordered by row
+    position, with the schema of the column shards. The cells of an error
+    found by a column shard are those of its columns only.
+
+    A check error of a column check is reported once, when every column
+    shard reported it, i.e. the check found none of its columns.
+    """
+    timer = helpers.Timer()
+    fields = _field_count(filepath, options)
+    # Contiguous runs of field positions, from 1
+    size = -(-fields // max(1, min(shards, fields)))
+    groups = [list(range(start + 1, min(start + size, fields) + 1)) for start in range(0, fields, size)]
+
+    with ProcessPoolExecutor(max_workers=len(groups) + 1) as executor:
+        futures = [executor.submit(_validate_shard, filepath, config, None, limits, raw_text, options)]
+        futures += [
+            executor.submit(_validate_shard, filepath, config, positions, limits, raw_text, options)
+            for positions in groups
+        ]
+        results = [future.result() for future in futures]
+
+    # A shard that could not even read the file fails the run like a plain one
+    for result in results:
+        if result['resource'] is None:
+            return Report(time=timer.time, errors=result['errors'], tasks=[])
+
+    row_result, column_results = results[0], results[1:]
+    check_notes = [set(result['check_errors']) for result in column_results]
+    missing = set.intersection(*check_notes) if check_notes else set()
+    check_errors = ErrorBuffer()
+    for note in column_results[0]['check_errors'] if column_results else []:
+        if note in missing:
+            check_errors.add(CheckError(note=note))
+
+    limit = limits.max_errors if limits is not None else None
+    errors = ErrorBuffer.merged(
+        [check_errors, row_result['errors']] + [result['errors'] for result in column_results], limit
+    )
+    descriptor = dict(row_result['resource'])
+    descriptor['schema'] = dict(descriptor.get('schema') or {}, fields=[
+        field for result in column_results for field in result['resource']['schema']['fields']
+    ])
+    return Report(
+        time=timer.time,
+        errors=[],
+        tasks=[
+            ReportTask(
+                time=timer.time,
+                scope=errors.scope,
+                partial=any(result['partial'] for result in results),
+                errors=errors,
+                resource=Resource(descriptor, trusted=True),
+            )
+        ],
+    )
+
+
+# Internal
+
+
+def _field_count(filepath, options):
+    # From the header alone
+    with Resource(filepath, layout=Layout(limit_rows=1),
+                  detector=Detector(sample_size=1, field_type='string'), **options) as resource:
+        return len(resource.labels)
+
+
+def _validate_shard(filepath, config, positions, limits, raw_text, options):
+    # Runs in a worker process, positions None is the row shard
+    checks = check_select(config)
+    if positions is None:
+        checks = [check for check in checks if not getattr(check, 'column_local', False)]
+        report = validate_limited(filepath, checks=checks, limits=limits,
+                                  detector=RawTextDetector(needed_types(checks)), **options)
+    else:
+        checks = [check for check in checks if getattr(check, 'column_local', False)]
+        detector = RawTextDetector(needed_types(checks)) if raw_text else Detector()
+        if limits is not None and limits.progress is not None:
+            # The row shard reports the progress of the run
+            limits = copy.copy(limits)
+            limits.progress = None
+        report = validate_limited(filepath, checks=checks, limits=limits, detector=detector,
+                                  layout=Layout(pick_fields=positions), **options)
+    if not report.tasks:
+        return {'resource': None, 'errors': list(report.errors)}
+
+    task = report.tasks[0]
+    errors = task.errors
+    check_errors = []
+    if positions is not None:
+        codes = set(CELL_CODES)
+        codes.update(Error.code for check in checks for Error in check.Errors)
+        check_errors = [error.note for error in errors if error.code == 'check-error']
+        errors = errors.subset(lambda code: code in codes or code == 'task-error')
+    return {
+        'resource': task.resource.to_dict(),
+        'errors': errors,
+        'check_errors': check_errors,
+        'partial': task.partial,
+    }
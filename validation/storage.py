@@ -0,0 +1,387 @@
+import hashlib
+import hmac
+import os
+import re
+import secrets
+import threading
+import time
+import uuid
+from .compression import detect_compression
+
+# Everything the validator writes lives under static/userfiles so reports
+# stay reachable from the result page.
+USERFILES_DIR = './static/userfiles'
+UPLOADS_DIR = 'uploads'
+REPORTS_DIR = 'reports'
+
+# Databases and other server-side state that must not be publicly served
+DATA_DIR = os.environ.get('VALIDATOR_DATA_DIR', './instance')
+JOBS_DIR = os.path.join(DATA_DIR, 'jobs')
+PINS_DIR = os.path.join(DATA_DIR, 'pins')
+
+# Defaults can be overridden through the environment (Heroku config vars)
+DEFAULT_QUOTA_BYTES = int(os.environ.get('USERFILES_QUOTA_MB', 1024)) * 1024 * 1024
+DEFAULT_MAX_AGE = int(os.environ.get('USERFILES_MAX_AGE_HOURS', 24)) * 3600
+DEFAULT_SWEEP_INTERVAL = int(os.environ.get('USERFILES_SWEEP_SECONDS', 300))
+
+# Files touched more recently than this are never evicted, so a sweep in one
+# worker cannot delete an upload another worker is still validating.
+MIN_IDLE_SECONDS = 600
+
+CHUNK_SIZE = 1024 * 1024
+
+# Content hashes of served files kept in memory
+DIGEST_CACHE_SIZE = 1024
+
+# Bytes of an upload kept for a header only pre-flight run
+PREFLIGHT_BYTES = int(os.environ.get('PREFLIGHT_KB', 1024)) * 1024
+
+
+def new_job_id():
+    return uuid.uuid4().hex
+
+
+class JobTokens:
+    """
+    Job ids handed out before an upload, each with a secret token.
+
+    The ids are made here, never by the client, and each starts one run
+    only. Cancelling or resuming a run takes the token of its id. Stored as
+    files so every worker process can check them.
+    """
+
+    def __init__(self, directory=JOBS_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def issue(self):
+        """(job id, token) of a new job."""
+        job_id = new_job_id()
+        token = secrets.token_hex(16)
+        with open(self.__path(job_id), 'x', encoding='ascii') as outfile:
+            outfile.write(token)
+        return job_id, token
+
+    def check(self, job_id, token):
+        """True if token is the token of job_id."""
+        try:
+            with open(self.__path(job_id), encoding='ascii') as infile:
+                stored = infile.read()
+        except FileNotFoundError:
+            return False
+        return bool(token) and hmac.compare_digest(stored, str(token))
+
+    def start(self, job_id, token):
+        """True the first time the run of job_id starts with its token."""
+        if not self.check(job_id, token):
+            return False
+        try:
+            os.close(os.open(self.__path(job_id) + '.started', os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        except FileExistsError:
+            return False
+        return True
+
+    def prune(self, older_than):
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                if os.path.getmtime(path) < older_than:
+                    os.remove(path)
+            except FileNotFoundError:
+                continue
+
+    def __path(self, job_id):
+        return os.path.join(self.directory, os.path.basename(str(job_id)))
+
+
+def safe_stem(filename):
+    """Filesystem-safe version of a user supplied filename without extensions."""
+    stem = os.path.basename(str(filename)).split('.')[0]
+    stem = re.sub(r'[^A-Za-z0-9_-]+', '_', stem).strip('_')
+    return stem[:60] or 'upload'
+
+
+def file_extension(filename):
+    """Every extension of the filename (e.g. '.csv' or '.csv.gz'), lowercased."""
+    name = os.path.basename(str(filename)).lower()
+    if '.' not in name:
+        return ''
+    extension = '.' + name.split('.', 1)[1]
+    return re.sub(r'[^a-z0-9.]', '', extension)[:20]
+
+
+class StoredUpload:
+    """An upload saved in the store, addressed by the sha256 of its content."""
+
+    def __init__(self, digest, path, filename, size, duplicate):
+        self.digest = digest
+        self.path = path
+        self.filename = filename
+        self.size = size
+        self.duplicate = duplicate
+
+
+class UploadStore:
+    """
+    Content-addressed storage for uploads and job-scoped storage for reports.
+
+    Uploads are stored once per distinct content as uploads/<sha256><ext>, reports
+    are written as reports/<job id>-<name>. A background sweeper removes files
+    older than max_age and, while the store is over quota, the least recently
+    used files first.
+    """
+
+    def __init__(self, root=USERFILES_DIR, quota_bytes=DEFAULT_QUOTA_BYTES,
+                 max_age=DEFAULT_MAX_AGE, sweep_interval=DEFAULT_SWEEP_INTERVAL, pins_dir=PINS_DIR):
+        self.root = root
+        self.quota_bytes = quota_bytes
+        self.max_age = max_age
+        self.sweep_interval = sweep_interval
+        self.uploads_dir = os.path.join(root, UPLOADS_DIR)
+        self.reports_dir = os.path.join(root, REPORTS_DIR)
+        os.makedirs(self.uploads_dir, exist_ok=True)
+        os.makedirs(self.reports_dir, exist_ok=True)
+        self.pins_dir = pins_dir
+        os.makedirs(pins_dir, exist_ok=True)
+        self.__lock = threading.Lock()
+        self.__pinned = {}
+        # Pin files of this process are named <file name>.<pin id>
+        self.__pin_id = new_job_id()
+        self.__sweeper = None
+        self.__sweep_hooks = []
+        self.__digests = {}
+        self.__total_bytes = self.__scan_total()
+
+    @property
+    def total_bytes(self):
+        return self.__total_bytes
+
+    # Uploads
+
+    def save_upload(self, file_storage):
+        """Stream a werkzeug FileStorage into the store while hashing it."""
+        filename = str(file_storage.filename)
+        temp_path = os.path.join(self.uploads_dir, '.incoming-' + new_job_id())
+        sha = hashlib.sha256()
+        size = 0
+        with open(temp_path, 'wb') as outfile:
+            while True:
+                chunk = file_storage.stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                sha.update(chunk)
+                outfile.write(chunk)
+                size += len(chunk)
+
+        digest = sha.hexdigest()
+        path = os.path.join(self.uploads_dir, digest + file_extension(filename))
+        duplicate = os.path.exists(path)
+        if duplicate:
+            # Identical content is already stored, keep the existing copy
+            os.remove(temp_path)
+            self.touch(path)
+        else:
+            os.replace(temp_path, path)
+            self.__add_bytes(size)
+        return StoredUpload(digest, path, filename, size, duplicate)
+
+    def save_head(self, file_storage, max_bytes=PREFLIGHT_BYTES):
+        """
+        Save only the first max_bytes of an upload, for pre-flight runs.
+
+        The head of a plain file is cut after its last complete line. The
+        caller removes the file, it is never added to the store.
+        """
+        filename = str(file_storage.filename)
+        head = file_storage.stream.read(max_bytes)
+        truncated = bool(file_storage.stream.read(1))
+        # Compressed heads are kept whole, the decompressor stops at the first record
+        if truncated and not detect_compression(filename)[0] and b'\n' in head:
+            head = head[: head.rindex(b'\n') + 1]
+        path = os.path.join(self.uploads_dir, '.preflight-' + new_job_id() + file_extension(filename))
+        with open(path, 'wb') as outfile:
+            outfile.write(head)
+        return path
+
+    def find_upload(self, digest):
+        """Path of a stored upload by digest, or None if it has been evicted."""
+        if not re.fullmatch(r'[0-9a-f]{64}', str(digest)):
+            return None
+        for name in os.listdir(self.uploads_dir):
+            if name.startswith(digest):
+                path = os.path.join(self.uploads_dir, name)
+                self.touch(path)
+                return path
+        return None
+
+    # Reports
+
+    def report_path(self, job_id, filename, output_selection=''):
+        if output_selection:
+            output_selection = '-' + output_selection
+        name = f'{job_id}-{safe_stem(filename)}{output_selection}-report.json'
+        return os.path.join(self.reports_dir, name)
+
+    def record_write(self, path):
+        """Account for a file the validator wrote directly into the store."""
+        try:
+            self.__add_bytes(os.path.getsize(path))
+        except OSError:
+            pass
+
+    def digest(self, path):
+        """
+        sha256 of a stored file, computed once per file.
+
+        Stored files are never rewritten in place, so the result is cached by
+        inode and size (the mtime moves with every access).
+        """
+        stat = os.stat(path)
+        key = (path, stat.st_ino, stat.st_size)
+        with self.__lock:
+            if key in self.__digests:
+                return self.__digests[key]
+        sha = hashlib.sha256()
+        with open(path, 'rb') as infile:
+            for chunk in iter(lambda: infile.read(CHUNK_SIZE), b''):
+                sha.update(chunk)
+        with self.__lock:
+            if len(self.__digests) >= DIGEST_CACHE_SIZE:
+                self.__digests.pop(next(iter(self.__digests)))
+            self.__digests[key] = sha.hexdigest()
+        return self.__digests[key]
+
+    # Access tracking
+
+    def touch(self, path):
+        # mtime doubles as the last access time for LRU eviction
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def pin(self, path):
+        """
+        Protect a file from eviction while it is in use, from the sweeps of
+        every worker process.
+
+        The pin is a file in pins_dir. The pins of a worker that died stay
+        until max_age, so a checkpointed run can still be resumed.
+        """
+        with self.__lock:
+            self.__pinned[path] = self.__pinned.get(path, 0) + 1
+            if self.__pinned[path] == 1:
+                open(self.__pin_path(path), 'w').close()
+        self.touch(path)
+
+    def unpin(self, path):
+        with self.__lock:
+            count = self.__pinned.get(path, 0) - 1
+            if count > 0:
+                self.__pinned[path] = count
+                return
+            self.__pinned.pop(path, None)
+            try:
+                os.remove(self.__pin_path(path))
+            except FileNotFoundError:
+                pass
+
+    # Eviction
+
+    def sweep(self, now=None):
+        """Evict expired files, then LRU files until under quota. Returns bytes freed."""
+        now = now or time.time()
+        entries = []
+        for path in self.__files():
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        freed = 0
+        pinned = self.__pinned_names(now)
+        entries.sort()
+        for last_used, size, path in entries:
+            expired = now - last_used > self.max_age
+            over_quota = total - freed > self.quota_bytes
+            if not expired and not over_quota:
+                break
+            if now - last_used < MIN_IDLE_SECONDS or os.path.basename(path) in pinned:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            freed += size
+
+        # Resync with the disk, other workers write to the same store
+        with self.__lock:
+            self.__total_bytes = total - freed
+        for hook in self.__sweep_hooks:
+            hook(now - self.max_age)
+        return freed
+
+    def add_sweep_hook(self, hook):
+        """Call hook(expired_before) after every sweep to expire derived data."""
+        self.__sweep_hooks.append(hook)
+
+    def start_sweeper(self):
+        if self.__sweeper and self.__sweeper.is_alive():
+            return self.__sweeper
+        self.__sweeper = threading.Thread(
+            target=self.__sweep_forever, name='userfiles-sweeper', daemon=True
+        )
+        self.__sweeper.start()
+        return self.__sweeper
+
+    # Internal
+
+    def __sweep_forever(self):
+        while True:
+            try:
+                self.sweep()
+            except Exception:
+                # Keep sweeping, a failed pass is retried on the next interval
+                pass
+            time.sleep(self.sweep_interval)
+
+    def __files(self):
+        for directory in (self.uploads_dir, self.reports_dir):
+            for name in os.listdir(directory):
+                yield os.path.join(directory, name)
+
+    def __scan_total(self):
+        total = 0
+        for path in self.__files():
+            try:
+                total += os.path.getsize(path)
+            except FileNotFoundError:
+                pass
+        return total
+
+    def __add_bytes(self, size):
+        with self.__lock:
+            self.__total_bytes += size
+
+    def __pin_path(self, path):
+        return os.path.join(self.pins_dir, os.path.basename(path) + '.' + self.__pin_id)
+
+    def __pinned_names(self, now):
+        # Names of the files pinned by any process. The pins of this one are
+        # refreshed, those older than max_age were left by workers that died
+        with self.__lock:
+            for path in self.__pinned:
+                self.touch(self.__pin_path(path))
+        names = set()
+        for name in os.listdir(self.pins_dir):
+            path = os.path.join(self.pins_dir, name)
+            try:
+                if now - os.path.getmtime(path) > self.max_age:
+                    os.remove(path)
+                    continue
+            except FileNotFoundError:
+                continue
+            names.add(name.rsplit('.', 1)[0])
+        return names
@@ -0,0 +1,142 @@
+import os
+import time
+from .distributed import kept_errors, merge_states, plan_job, scan_records, validate_range
+from .error_records import ErrorBuffer
+from .runner import Limits
+
+# Seconds between two looks at a followed file that did not grow
+DEFAULT_TAIL_SECONDS = float(os.environ.get('VALIDATION_TAIL_SECONDS', 5))
+
+# At most this many bytes are validated per batch, a long backlog comes
+# in several batches
+DEFAULT_BATCH_BYTES = int(os.environ.get('VALIDATION_TAIL_BATCH_MB', 64)) * 1024 * 1024
+
+
+class FileTail:
+    """
+    Validation of an append-only CSV that goes on as the file grows.
+
+    Each poll() validates the complete records appended since the last one,
+    with the stateful checks (the consistency checks) starting from the
+    state the rows before left them in, and returns their errors as a
+    batch. The cost of a poll is that of the new rows, the batches of a
+    file add up to the errors of one run over all of it.
+
+    The schema is inferred from the head of the file at the first poll,
+    like a single run, or at the first records when the file only had its
+    header. A file that shrinks or gets another header (rotated or
+    rewritten) is followed again from its first row.
+    """
+
+    def __init__(self, filepath, config=None, raw_text=False, from_start=True,
+                 batch_bytes=DEFAULT_BATCH_BYTES, checkpoint=None):
+        self.filepath = os.path.abspath(filepath)
+        self.config = config
+        self.raw_text = raw_text
+        self.from_start = from_start
+        self.batch_bytes = batch_bytes
+        self.job = None
+        self.offset = self.row_position = None
+        self.state = {}
+        self.batches = 0
+        self.schema_pending = False
+        if checkpoint is not None:
+            self.job = checkpoint['job']
+            self.offset = checkpoint['offset']
+            self.row_position = checkpoint['row_position']
+            self.state = checkpoint['state']
+            self.batches = checkpoint['batches']
+            self.schema_pending = checkpoint.get('schema_pending', False)
+
+    def checkpoint(self):
+        """Where the tail is, to go on from there with FileTail(..., checkpoint=...)."""
+        return {
+            'job': self.job, 'offset': self.offset, 'row_position': self.row_position,
+            'state': self.state, 'batches': self.batches, 'schema_pending': self.schema_pending,
+        }
+
+    def poll(self):
+        """
+        Batch of the records appended since the last poll, None if there
+        are none yet: number, start and stop bytes, first row position,
+        rows, errors (an ErrorBuffer) and restarted, True when the file was
+        replaced and is followed from its start again.
+        """
+        if not os.path.exists(self.filepath) or not os.path.getsize(self.filepath):
+            # Not there yet, or being rotated
+            return None
+        restarted = self.job is not None and self.__replaced()
+        if self.job is None or restarted:
+            # A replaced file is new data, all of it
+            self.__start(self.from_start or restarted)
+        end, _ = self.__scan(self.batch_bytes)
+        if end == self.offset:
+            return None
+        if self.schema_pending:
+            # Every field of a schema inferred from no rows is 'any'
+            self.job = self.__plan()
+            self.schema_pending = False
+
+        limits = Limits(max_rows=None, max_seconds=None, max_errors=None, max_memory_mb=None)
+        result = validate_range(self.job, self.offset, end, self.row_position, self.state, limits)
+        if 'failed' in result:
+            # Read again at the next poll
+            errors = ErrorBuffer()
+            for error in result['failed']:
+                errors.add(error)
+            return {'number': self.batches, 'start': self.offset, 'stop': self.offset,
+                    'row_position': self.row_position, 'rows': 0, 'errors': errors, 'restarted': restarted}
+
+        batch = {
+            'number': self.batches, 'start': self.offset, 'stop': end, 'row_position': self.row_position,
+            'rows': result['rows'], 'errors': kept_errors(result, self.batches), 'restarted': restarted,
+        }
+        self.offset = end
+        self.row_position += result['rows']
+        self.state = merge_states(self.state, result['states'])
+        self.batches += 1
+        return batch
+
+    def follow(self, interval=DEFAULT_TAIL_SECONDS, stop=None):
+        """Batches as the file grows, until stop() returns True (never with None)."""
+        while stop is None or not stop():
+            batch = self.poll()
+            if batch is None:
+                time.sleep(interval)
+                continue
+            yield batch
+
+    # Internal
+
+    def __start(self, from_start):
+        self.job = self.__plan()
+        self.offset = len(self.job['header'])
+        self.row_position = 2
+        self.state = {}
+        self.batches = 0
+        end, records = self.__scan()
+        self.schema_pending = not records
+        if not from_start:
+            # The rows already there are taken as validated, the checks
+            # start fresh at the first appended one
+            self.offset = end
+            self.row_position += records
+            self.batches = 1
+
+    def __plan(self):
+        # task_bytes of the whole file, the ranges of the plan are not used
+        job, _ = plan_job(self.filepath, self.config, self.raw_text, None, os.path.getsize(self.filepath) + 1)
+        if job['header'] is None:
+            raise ValueError(f'{self.filepath} cannot be followed: only plain CSV files with a header can')
+        return job
+
+    def __scan(self, max_bytes=None):
+        dialect = self.job['read_options']['dialect']
+        return scan_records(self.filepath, self.offset, dialect.get('quoteChar', '"').encode(),
+                            dialect.get('delimiter', ',').encode(), max_bytes)
+
+    def __replaced(self):
+        if os.path.getsize(self.filepath) < self.offset:
+            return True
+        with open(self.filepath, 'rb') as infile:
+            return infile.read(len(self.job['header'])) != self.job['header']
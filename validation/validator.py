@@ -1,51 +1,244 @@
-from re import S
-from . import custom_checks
-from frictionless import describe, validate
-import json, inspect
-import importlib.resources as resources
+from . import custom_checks, history
+from .autofix import AutoFixer
+from .compression import open_report, resource_options
+from .error_records import dump_report
+from .runner import Limits, RunOptions, validate_limited
+from frictionless import Check, Detector, Layout, describe, helpers, validate
+from settings.store import config_store
+import copy, json, inspect, os
 
 # Load the checks.cfg file into a dictionary with
 # the User's custom fields
 
+# Records read by a header only pre-flight run
+PREFLIGHT_ROWS = 1
 
-def custom_validate(file, output_selection = None):
-    check_selection = check_select()
+# Errors a publish gate stops at
+DEFAULT_GATE_ERRORS = int(os.environ.get('VALIDATION_GATE_ERRORS', 1))
+
+
+def custom_validate(filepath, output_selection = None, run = None):
+    # Where the results go and how the file is read, see RunOptions
+    run = run or RunOptions()
     output_report = None
-    
-    filepath = './static/userfiles/' + file
 
-    report = validate(filepath, checks=check_selection)
+    # Compressed uploads (.csv.gz, .csv.bz2, ...) are decompressed while reading
+    options = resource_options(filepath)
+    # Row, time, error and memory limits, a stopped run reports what it found
+    limits = run.limits or Limits()
+    if output_selection == 'header':
+        report = preflight(filepath, run.config)
+    elif run.fix_paths:
+        # The corrected copy is written from the cells of the file in one process
+        report = validate_file(filepath, options, run.config, None, None, run.memory_accounting, limits,
+                               run.raw_text, run.fix_paths)
+    elif run.parse_cache is not None and run.digest and run.parse_cache.has(run.digest):
+        # Re-run from the parsed columns of an earlier run of the same upload
+        checks = accounted(check_select(run.config), run.memory_accounting)
+        resource = run.parse_cache.resource(run.digest)
+        if run.raw_text:
+            resource.schema = text_schema(resource.schema, needed_types(checks))
+        report = validate_limited(resource, checks=checks, limits=limits)
+    else:
+        # Wide tables are validated with their columns split across processes,
+        # per check memory accounting needs the checks in this process
+        from .sharding import DEFAULT_COLUMN_SHARDS, shard_count, validate_sharded
+        from .checkpoint import should_checkpoint, validate_checkpointed
+        config = run.config or config_store.current()
+        # A run of the job that was checkpointed before its worker died goes on
+        resuming = run.checkpoints is not None and run.job_id and run.checkpoints.run(run.job_id) is not None
+        shards = 0
+        if run.memory_accounting is None and not resuming:
+            column_shards = DEFAULT_COLUMN_SHARDS if run.column_shards is None else run.column_shards
+            shards = shard_count(filepath, column_shards, **options)
+        if shards:
+            report = validate_sharded(filepath, config, shards, limits, run.raw_text, **options)
+        elif run.memory_accounting is None and should_checkpoint(filepath, run.checkpoints, run.job_id):
+            # Long runs checkpoint their progress, with what a resume needs
+            arguments = {
+                'filepath': filepath, 'output_selection': output_selection, 'report_path': run.report_path,
+                'report_compression': run.report_compression, 'filename': run.filename, 'dataset': run.dataset,
+                'digest': run.digest, 'raw_text': run.raw_text, 'config_version': config.version,
+            }
+            report = validate_checkpointed(filepath, run.checkpoints, run.job_id, config, limits, run.raw_text,
+                                           arguments)
+        else:
+            report = validate_file(filepath, options, config, run.parse_cache, run.digest, run.memory_accounting,
+                                   limits, run.raw_text)
+
+    # Index the errors so the result page can browse them page by page
+    if run.error_store is not None and run.job_id:
+        run.error_store.add_report(run.job_id, report, run.filename or os.path.basename(filepath))
+    # Failing rows per check and column, for row filters and quarantines
+    if run.bitmap_store is not None and run.job_id:
+        run.bitmap_store.add_report(run.job_id, report)
+
+    # Track the data quality of the dataset across uploads, a header only
+    # run says nothing about the rows
+    if run.history_store is not None and output_selection != 'header':
+        filename = run.filename or os.path.basename(filepath)
+        dataset = run.dataset or history.dataset_family(filename)
+        run.history_store.add_run(dataset, report, run.job_id, filename)
     
     if output_selection == 'schema':
-        output_report = describe(filepath)
-    elif output_selection == 'error':
-        output_report = report.flatten(['note','message','description'])
+        output_report = describe(filepath, **options)
     else:
         output_report = report
     
-    if output_selection != '':
-        output_selection = '-' + output_selection
-
-    new_file = './static/userfiles/' + file.split('.')[0] + output_selection + '-report.json'
+    # Reports are written where the caller asks (a job-scoped name from the
+    # upload store), otherwise next to the validated file
+    if run.report_path:
+        new_file = run.report_path
+    else:
+        suffix = '-' + output_selection if output_selection else ''
+        stem = os.path.basename(filepath).split('.')[0]
+        new_file = os.path.join(os.path.dirname(filepath), stem + suffix + '-report.json')
     
-    with open(new_file,'w') as outfile:
-        json.dump(output_report,outfile, indent=2)
+    new_file, outfile = open_report(new_file, run.report_compression)
+    with outfile:
+        if output_selection == 'schema':
+            json.dump(output_report, outfile, separators=(',', ':'))
+        else:
+            # Errors are rendered one at a time while writing
+            flatten = ['note','message','description'] if output_selection == 'error' else None
+            dump_report(output_report, outfile, flatten)
     
-    return new_file.split('./',1)[1]
+    return os.path.normpath(new_file).replace(os.sep, '/')
+
+def validate_file(filepath, options, config = None, parse_cache = None, digest = None,
+                  memory_accounting = None, limits = None, raw_text = False, fix_paths = None):
+    # One process, recording the parsed table into the parse cache
+    checks = accounted(check_select(config), memory_accounting)
+    read_options = dict(options, detector=RawTextDetector(needed_types(checks))) if raw_text else options
+    # The cache keeps the inferred schema, raw text runs do not record
+    recorder = parse_cache.recorder(digest) if parse_cache is not None and digest and not raw_text else None
+    if recorder is not None:
+        checks.insert(0, recorder)
+    # With fix_paths, a corrected CSV and its change log are written
+    fixer = None
+    if fix_paths:
+        fixer = AutoFixer(checks, *fix_paths)
+        checks.append(fixer)
+    if recorder is not None or fixer is not None:
+        # Runs that reach max_errors are cached and fixed too, the run keeps
+        # reading rows for them and keeps only the first errors
+        limits = copy.copy(limits or Limits())
+        limits.read_all_rows = True
+    report = validate_limited(filepath, checks=checks, limits=limits, **read_options)
+    # Nothing is cached or fixed when the run stopped early (time, rows, cancel)
+    if recorder is not None:
+        recorder.discard()
+    if fixer is not None:
+        fixer.discard()
+    return report
+
+def preflight(filepath, config = None):
+    """
+    Validate the structure of a file from its header and first record.
+
+    Only the baseline header checks and the selected custom checks that never
+    look at rows (header_format, address_field_seperate) are run, so the
+    answer comes back in milliseconds whatever the size of the file.
+    """
+    checks = [check for check in check_select(config) if is_header_check(check)]
+    options = resource_options(filepath)
+    # Reading stops after the first record, which is also all the dialect
+    # and schema detection gets to see
+    return validate(filepath, checks=checks, layout=Layout(limit_rows=PREFLIGHT_ROWS),
+                    detector=Detector(sample_size=PREFLIGHT_ROWS), **options)
+
+def gate(filepath, config = None, max_errors = DEFAULT_GATE_ERRORS, codes = None, raw_text = False):
+    """
+    Pass or fail answer for publish pipelines, with no report written.
+
+    The run stops at the first max_errors errors whose code or tag (e.g.
+    'type-error', '#header') is one of codes, by default at any error but
+    the notes of checks that found nothing to look at (check-error). Checks
+    that cannot raise a selected error are not run. Returns valid, those
+    errors, and the row the run stopped at (None when it read every row).
+    """
+    timer = helpers.Timer()
+    codes = set(codes or ())
+
+    def selected(error):
+        if codes:
+            return error.code in codes or not codes.isdisjoint(error.tags)
+        return error.code != 'check-error'
+
+    checks = check_select(config)
+    if codes:
+        checks = [check for check in checks
+                  if any(Error.code in codes or not codes.isdisjoint(Error.tags) for Error in check.Errors)]
+    options = resource_options(filepath)
+    if raw_text:
+        options['detector'] = RawTextDetector(needed_types(checks))
+    limits = Limits(max_rows = None, max_seconds = None, max_errors = max_errors)
+    report = validate_limited(filepath, checks = checks, limits = limits, select = selected, **options)
+    task = report.tasks[0] if report.tasks else None
+    found = [error for error in (task.errors if task else report.errors) if error.code != 'task-error']
+    row = None
+    if task is not None and task.partial:
+        row = (found[-1].get('rowPosition') or 1) if found else None
+    return {'valid': not found, 'errors': found, 'row': row, 'time': timer.time}
+
+class RawTextDetector(Detector):
+    """
+    Detector of raw text runs: checks get the text of each cell as it appears
+    in the file instead of values cast by frictionless.
+
+    Only columns whose inferred type is listed in keep_types, the types a
+    selected check reads (see needs_types), are still typed and cast, with no
+    such types the inference is skipped altogether. Type errors are only
+    reported for those columns.
+    """
+
+    def __init__(self, keep_types = (), **options):
+        if not keep_types:
+            options['field_type'] = 'string'
+        super().__init__(**options)
+        self.keep_types = frozenset(keep_types)
+
+    def detect_schema(self, fragment, *, labels = None, schema = None):
+        # A schema given by the caller is used as it is
+        inferred = not schema or not schema.fields
+        detected = super().detect_schema(fragment, labels=labels, schema=schema)
+        return text_schema(detected, self.keep_types) if inferred else detected
+
+def text_schema(schema, keep_types = ()):
+    # Turn every field of a type no check needs into a string field
+    for field in schema.fields:
+        if field.type not in keep_types:
+            field.type = 'string'
+            field.pop('format', None)
+    return schema
+
+def needed_types(checks):
+    types = set()
+    for check in checks:
+        types.update(getattr(check, 'needs_types', ()))
+    return types
+
+def is_header_check(check):
+    # Checks without validate_row are answered from the header alone
+    return type(check).validate_row is Check.validate_row
+
+def accounted(checks, memory_accounting = None):
+    # Per check memory accounting is opt-in, it slows the run down
+    if memory_accounting is None:
+        return checks
+    return memory_accounting.wrap(checks)
 
-def check_select():
-    add_checks = []
-    check_file = resources.open_text('settings', 'checks.cfg')
-    for line in check_file:
-        custom_check, value = line.rstrip('\n').split('=')
-        if value.strip() == '1':
-            add_checks.append(custom_check.strip())
+def check_select(config = None):
+    # Checks and their fields come from one config version for the whole run
+    config = config or config_store.current()
+    add_checks = config.selected_checks
 
     selected_checks = []
-    for name, obj in inspect.getmembers(custom_checks):
-        if inspect.isclass(obj):
-            if name in add_checks:
-                selected_checks.append(obj())
+    with custom_checks.pinned_config(config):
+        for name, obj in inspect.getmembers(custom_checks):
+            if inspect.isclass(obj):
+                if name in add_checks:
+                    selected_checks.append(obj())
 
     return selected_checks
     